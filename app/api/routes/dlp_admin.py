@@ -1,10 +1,34 @@
-from fastapi import APIRouter
-from typing import List
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import StreamingResponse
+from typing import List, Dict, Any, AsyncIterator, Optional
+from tempfile import SpooledTemporaryFile
+from collections import deque
 from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database import get_db, AsyncSessionLocal
+import asyncio
+import json
+import os
+from app.config import settings
 from app.dlp.engine import dlp_engine
+from app.dlp.edm import edm_registry
+from app.dlp.blocklist import blocklist_registry, build_blocklist, iter_feeds
+from app.dlp.fingerprint import docx_text, fingerprint_index
+from app.dlp.offline import parse_ndjson_line
+from app.models.user import User
+from app.services.policy_service import policy_service
+from app.services.backfill_service import backfill_service
+from app.services.held_message_service import held_message_service
+from app.services.scan_scheduler import scan_scheduler
 
 router = APIRouter()
 
+# Максимальная длина одной строки NDJSON в потоковой проверке
+SCAN_MAX_LINE_BYTES = 1024 * 1024
+# Загружаемый файл больше этого размера сохраняется на диск
+SCAN_SPOOL_BYTES = 8 * 1024 * 1024
+
 
 class KeywordAdd(BaseModel):
     """Схема для добавления ключевого слова"""
@@ -16,39 +40,782 @@ class KeywordRemove(BaseModel):
     keyword: str
 
 
+class RuleEnabled(BaseModel):
+    """Схема для включения/выключения правила"""
+    enabled: bool
+
+
+class BlocklistReload(BaseModel):
+    """Схема для перезагрузки блоклиста (rebuild - собрать заново из DLP_BLOCKLIST_FEEDS_DIR)"""
+    rebuild: bool = False
+
+
+class ShadowStart(BaseModel):
+    """Схема для запуска теневой проверки кандидатной политики"""
+    rules: List[Dict[str, Any]]
+    sample_rate: float = 0.1
+    name: Optional[str] = None
+
+
+class BackfillStart(BaseModel):
+    """Схема для запуска проверки истории (rate_limit - сообщений в секунду, 0 - без ограничения)"""
+    rate_limit: Optional[float] = None
+
+
+async def _require_admin(db: AsyncSession, admin_id: int) -> User:
+    """Проверка прав администратора"""
+    result = await db.execute(select(User).where(User.id == admin_id))
+    admin = result.scalar_one_or_none()
+
+    if not admin or not admin.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Доступ запрещён"
+        )
+    return admin
+
+
+def _feed_files(directory: str) -> List[str]:
+    """Файлы фидов из каталога (в порядке имён)"""
+    return sorted(
+        entry.path for entry in os.scandir(directory)
+        if entry.is_file() and not entry.name.startswith(".")
+    )
+
+
 @router.get("/keywords")
 def get_keywords():
     """Получить список всех запрещённых слов"""
     return {
         "keywords": dlp_engine.text_analyzer.get_keywords(),
-        "count": len(dlp_engine.text_analyzer.get_keywords())
+        "count": len(dlp_engine.text_analyzer.get_keywords()),
+        "policy_version": policy_service.version
     }
 
 
 @router.post("/keywords")
-def add_keyword(data: KeywordAdd):
+async def add_keyword(data: KeywordAdd, db: AsyncSession = Depends(get_db)):
     """Добавить новое запрещённое слово"""
-    dlp_engine.text_analyzer.add_keyword(data.keyword)
+    try:
+        added = await policy_service.add_keyword(db, data.keyword)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
     return {
         "status": "success",
-        "message": f"Ключевое слово '{data.keyword}' добавлено",
-        "keywords": dlp_engine.text_analyzer.get_keywords()
+        "message": f"Ключевое слово '{data.keyword}' добавлено" if added
+        else f"Ключевое слово '{data.keyword}' уже есть",
+        "keywords": dlp_engine.text_analyzer.get_keywords(),
+        "policy_version": policy_service.version
     }
 
 
 @router.delete("/keywords")
-def remove_keyword(data: KeywordRemove):
+async def remove_keyword(data: KeywordRemove, db: AsyncSession = Depends(get_db)):
     """Удалить запрещённое слово"""
-    dlp_engine.text_analyzer.remove_keyword(data.keyword)
+    removed = await policy_service.remove_keyword(db, data.keyword)
+    return {
+        "status": "success",
+        "message": f"Ключевое слово '{data.keyword}' удалено" if removed
+        else f"Ключевое слово '{data.keyword}' не найдено",
+        "keywords": dlp_engine.text_analyzer.get_keywords(),
+        "policy_version": policy_service.version
+    }
+
+
+@router.get("/rules")
+async def get_rules(admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Получить все правила DLP политики"""
+    await _require_admin(db, admin_id)
+
+    rules = await policy_service.get_rules(db)
+    return {
+        "rules": [rule.to_dict() for rule in rules],
+        "count": len(rules),
+        "policy_version": policy_service.version
+    }
+
+
+@router.put("/rules/{rule_id}")
+async def put_rule(rule_id: str, definition: Dict[str, Any], admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Создать или заменить правило (применяется без перезапуска)"""
+    await _require_admin(db, admin_id)
+
+    definition["id"] = rule_id
+
+    try:
+        rule = await policy_service.put_rule(db, definition)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return {
+        "status": "success",
+        "message": f"Правило '{rule_id}' сохранено",
+        "rule": rule.to_dict(),
+        "policy_version": policy_service.version
+    }
+
+
+@router.post("/rules/{rule_id}/enabled")
+async def set_rule_enabled(rule_id: str, data: RuleEnabled, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Включить или выключить правило"""
+    await _require_admin(db, admin_id)
+
+    try:
+        rule = await policy_service.set_rule_enabled(db, rule_id, data.enabled)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    if not rule:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Правило не найдено"
+        )
+
+    return {
+        "status": "success",
+        "message": f"Правило '{rule_id}' {'включено' if data.enabled else 'выключено'}",
+        "rule": rule.to_dict(),
+        "policy_version": policy_service.version
+    }
+
+
+@router.delete("/rules/{rule_id}")
+async def delete_rule(rule_id: str, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Удалить правило"""
+    await _require_admin(db, admin_id)
+
+    try:
+        deleted = await policy_service.delete_rule(db, rule_id)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    if not deleted:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Правило не найдено"
+        )
+
+    return {
+        "status": "success",
+        "message": f"Правило '{rule_id}' удалено",
+        "policy_version": policy_service.version
+    }
+
+
+@router.get("/shadow")
+async def get_shadow(admin_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Теневая проверка кандидатной политики: сводка этого воркера
+
+    Матрица переходов действий, срабатывания правил обоими планами,
+    время стадий и перцентили времени проверки
+    """
+    await _require_admin(db, admin_id)
+
+    shadow = await policy_service.get_shadow(db)
+    return {
+        "candidate": shadow.to_dict() if shadow else None,
+        "recorded_disagreements": await policy_service.count_disagreements(db, shadow.id) if shadow else 0,
+        "stats": dlp_engine.shadow.stats(),
+        "policy_version": policy_service.version
+    }
+
+
+@router.post("/shadow")
+async def start_shadow(data: ShadowStart, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Запустить теневую проверку кандидатной политики (прежний кандидат отбрасывается)"""
+    await _require_admin(db, admin_id)
+
+    try:
+        shadow = await policy_service.start_shadow(db, data.rules, data.sample_rate, data.name)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return {
+        "status": "success",
+        "message": f"Теневая проверка кандидатной политики #{shadow.id} запущена",
+        "candidate": shadow.to_dict(),
+        "policy_version": policy_service.version
+    }
+
+
+@router.get("/shadow/disagreements")
+async def get_shadow_disagreements(
+        admin_id: int,
+        shadow_id: Optional[int] = None,
+        after_id: int = Query(0, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+        db: AsyncSession = Depends(get_db)
+):
+    """Расхождения вердиктов кандидата с активной политикой (по умолчанию - текущего кандидата)"""
+    await _require_admin(db, admin_id)
+
+    if shadow_id is None:
+        shadow = await policy_service.get_shadow(db)
+        if shadow is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Кандидатная политика не запущена"
+            )
+        shadow_id = shadow.id
+
+    disagreements = await policy_service.get_disagreements(db, shadow_id, after_id, limit)
+    return {
+        "disagreements": [item.to_dict() for item in disagreements],
+        "next_after_id": disagreements[-1].id if len(disagreements) == limit else None
+    }
+
+
+@router.post("/shadow/promote")
+async def promote_shadow(admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Сделать кандидатную политику активной"""
+    await _require_admin(db, admin_id)
+
+    try:
+        shadow = await policy_service.promote_shadow(db)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    if shadow is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Кандидатная политика не запущена"
+        )
+
+    return {
+        "status": "success",
+        "message": f"Кандидатная политика #{shadow.id} стала активной",
+        "policy_version": policy_service.version
+    }
+
+
+@router.delete("/shadow")
+async def discard_shadow(admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Отбросить кандидатную политику"""
+    await _require_admin(db, admin_id)
+
+    shadow = await policy_service.discard_shadow(db)
+    if shadow is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Кандидатная политика не запущена"
+        )
+
+    return {
+        "status": "success",
+        "message": f"Кандидатная политика #{shadow.id} отброшена",
+        "policy_version": policy_service.version
+    }
+
+
+@router.get("/cache")
+def get_cache_stats():
+    """Статистика кэша результатов DLP проверки"""
+    return {
+        **dlp_engine.cache.stats(),
+        "policy_version": dlp_engine.plan.version,
+        "url_verdict_version": dlp_engine.url_verdict_version
+    }
+
+
+@router.get("/metrics")
+def get_metrics():
+    """Метрики DLP проверки"""
+    return {
+        "scan_timeouts": dlp_engine.scan_timeouts,
+        "scan_budget_ms": dlp_engine.plan.budget.budget_ms,
+        "fail_closed": dlp_engine.plan.budget.fail_closed,
+        "cache": dlp_engine.cache.stats(),
+        "url_verdicts": dlp_engine.url_verdicts.stats(),
+        "virustotal_scanner": scan_scheduler.stats(),
+        "policy_version": dlp_engine.plan.version
+    }
+
+
+@router.get("/edm")
+def get_edm_stats():
+    """Состояние индекса точного совпадения (EDM)"""
+    return edm_registry.stats()
+
+
+@router.post("/edm/reload")
+async def reload_edm(admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Перезагрузить индекс EDM из DLP_EDM_INDEX_PATH (только для админов)"""
+    await _require_admin(db, admin_id)
+
+    path = settings.DLP_EDM_INDEX_PATH
+    if not path:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Не задан DLP_EDM_INDEX_PATH"
+        )
+
+    try:
+        stats = await asyncio.to_thread(dlp_engine.load_edm, path)
+    except (OSError, ValueError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Индекс EDM не загружен: {e}"
+        )
+
     return {
         "status": "success",
-        "message": f"Ключевое слово '{data.keyword}' удалено",
-        "keywords": dlp_engine.text_analyzer.get_keywords()
+        "message": f"Индекс EDM загружен: {stats['records']} записей",
+        **stats
     }
 
 
+@router.get("/blocklist")
+def get_blocklist_stats():
+    """Состояние блоклиста доменов: размер в памяти, доля отсечённых фильтром, время проверки"""
+    return blocklist_registry.stats()
+
+
+@router.post("/blocklist/reload")
+async def reload_blocklist(admin_id: int, data: Optional[BlocklistReload] = None,
+                           db: AsyncSession = Depends(get_db)):
+    """
+    Перезагрузить блоклист доменов из DLP_BLOCKLIST_PATH (только для админов)
+
+    Если указан rebuild, блоклист сначала собирается из файлов фидов
+    каталога DLP_BLOCKLIST_FEEDS_DIR в отдельном потоке; старый работает
+    до замены. Пути задаются только настройками сервера.
+    """
+    await _require_admin(db, admin_id)
+
+    path = settings.DLP_BLOCKLIST_PATH
+    if not path:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Не задан DLP_BLOCKLIST_PATH"
+        )
+    if data and data.rebuild and not settings.DLP_BLOCKLIST_FEEDS_DIR:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Не задан DLP_BLOCKLIST_FEEDS_DIR"
+        )
+
+    try:
+        if data and data.rebuild:
+            feeds = _feed_files(settings.DLP_BLOCKLIST_FEEDS_DIR)
+            await asyncio.to_thread(build_blocklist, iter_feeds(feeds), path)
+        stats = dlp_engine.load_blocklist(path)
+    except (OSError, ValueError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Блоклист не загружен: {e}"
+        )
+
+    # Сообщения, ждущие ссылки на домены из фидов, отклоняются
+    resolved = await held_message_service.resolve_pending(db)
+
+    return {
+        "status": "success",
+        "message": f"Блоклист загружен: {stats['domains']} доменов",
+        "rejected_held_messages": len(resolved["rejected"]),
+        **stats
+    }
+
+
+@router.get("/fingerprints")
+async def get_fingerprints(admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Реестр конфиденциальных документов и состояние индекса отпечатков"""
+    await _require_admin(db, admin_id)
+
+    documents = await policy_service.get_documents(db)
+    return {
+        "documents": [document.to_dict() for document in documents],
+        "index": fingerprint_index.stats()
+    }
+
+
+@router.post("/fingerprints")
+async def register_fingerprint(
+        admin_id: int,
+        name: str = Form(...),
+        file: UploadFile = File(...),
+        db: AsyncSession = Depends(get_db)
+):
+    """Зарегистрировать конфиденциальный документ (.docx)"""
+    await _require_admin(db, admin_id)
+
+    if not file.filename.lower().endswith(".docx"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Регистрировать можно только документы .docx"
+        )
+
+    with SpooledTemporaryFile(max_size=SCAN_SPOOL_BYTES) as document_file:
+        document_file.write(await file.read())
+        document_file.seek(0)
+        try:
+            text = await asyncio.to_thread(docx_text, document_file)
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Ошибка чтения документа: {e}"
+            )
+
+    try:
+        document = await policy_service.register_document(db, name, text, file.filename)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    return {
+        "status": "success",
+        "message": f"Документ «{name}» зарегистрирован: {document.chunk_count} фрагментов",
+        "document": document.to_dict(),
+        "policy_version": policy_service.version
+    }
+
+
+@router.delete("/fingerprints/{document_id}")
+async def delete_fingerprint(document_id: int, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Удалить документ из реестра конфиденциальных документов"""
+    await _require_admin(db, admin_id)
+
+    if not await policy_service.remove_document(db, document_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Документ {document_id} не найден"
+        )
+
+    return {
+        "status": "success",
+        "message": f"Документ {document_id} удалён из реестра",
+        "policy_version": policy_service.version
+    }
+
+
+@router.get("/backfill")
+async def get_backfill_jobs(admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Задачи ретроспективной проверки истории сообщений"""
+    await _require_admin(db, admin_id)
+
+    jobs = await backfill_service.get_jobs(db)
+    return {"jobs": [job.to_dict() for job in jobs]}
+
+
+@router.post("/backfill")
+async def start_backfill(admin_id: int, data: Optional[BackfillStart] = None,
+                         db: AsyncSession = Depends(get_db)):
+    """Проверить историю сообщений текущей версией политики"""
+    await _require_admin(db, admin_id)
+
+    rate_limit = data.rate_limit if data else None
+    if rate_limit is not None and rate_limit < 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Ограничение скорости не может быть отрицательным"
+        )
+
+    try:
+        job = await backfill_service.start(db, rate_limit)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+
+    return {
+        "status": "success",
+        "message": f"Проверка истории #{job.id} запущена: {job.total} сообщений",
+        "job": job.to_dict()
+    }
+
+
+async def _backfill_action(action, db: AsyncSession, job_id: int) -> Dict:
+    """Выполнить действие над задачей проверки истории"""
+    try:
+        job = await action(db, job_id)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=str(e)
+        )
+
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Проверка истории {job_id} не найдена"
+        )
+    return {"status": "success", "job": job.to_dict()}
+
+
+@router.get("/backfill/{job_id}")
+async def get_backfill_job(job_id: int, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Ход проверки истории: прогресс, скорость, оценка оставшегося времени"""
+    await _require_admin(db, admin_id)
+
+    job = await backfill_service.get_job(db, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Проверка истории {job_id} не найдена"
+        )
+    return job.to_dict()
+
+
+@router.post("/backfill/{job_id}/pause")
+async def pause_backfill(job_id: int, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Приостановить проверку истории на ближайшей контрольной точке"""
+    await _require_admin(db, admin_id)
+
+    return await _backfill_action(backfill_service.pause, db, job_id)
+
+
+@router.post("/backfill/{job_id}/resume")
+async def resume_backfill(job_id: int, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Продолжить проверку истории с контрольной точки"""
+    await _require_admin(db, admin_id)
+
+    return await _backfill_action(backfill_service.resume, db, job_id)
+
+
+@router.post("/backfill/{job_id}/cancel")
+async def cancel_backfill(job_id: int, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Отменить проверку истории (найденные нарушения сохраняются)"""
+    await _require_admin(db, admin_id)
+
+    return await _backfill_action(backfill_service.cancel, db, job_id)
+
+
+@router.get("/backfill/{job_id}/results")
+async def get_backfill_results(
+        job_id: int,
+        admin_id: int,
+        after_id: int = Query(0, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+        db: AsyncSession = Depends(get_db)
+):
+    """Нарушения, найденные проверкой истории (следующая страница - after_id = next_after_id)"""
+    await _require_admin(db, admin_id)
+
+    results = await backfill_service.get_results(db, job_id, after_id, limit)
+    return {
+        "results": [result.to_dict() for result in results],
+        "next_after_id": results[-1].id if len(results) == limit else None
+    }
+
+
+@router.delete("/cache")
+def clear_cache():
+    """Очистить кэш результатов DLP проверки"""
+    dlp_engine.cache.clear()
+    return {
+        "status": "success",
+        "message": "Кэш DLP очищен"
+    }
+
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    Потоковый ответ, генератор которого сам читает тело запроса
+
+    StreamingResponse (ASGI до 2.4) параллельно ждёт отключения клиента
+    через receive() и забирал бы куски тела. Здесь receive() читает только
+    генератор, отключение клиента приходит в него как ClientDisconnect.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def _read_documents(request: Request, batch_size: int) -> AsyncIterator[List[Dict]]:
+    """
+    Чтение NDJSON из тела запроса по мере поступления
+
+    Документы разбираются, как только пришёл конец их строки; пачка
+    отдаётся при заполнении и в конце каждого принятого куска тела, чтобы
+    медленный клиент получал вердикты, не дожидаясь следующих документов.
+    Строка длиннее SCAN_MAX_LINE_BYTES не накапливается в памяти, общий
+    размер тела не ограничен (в одном соединении - миллионы документов),
+    если не задан DLP_SCAN_MAX_BODY_BYTES.
+    """
+    max_body = settings.DLP_SCAN_MAX_BODY_BYTES
+    batch = []
+    buffer = bytearray()
+    line_number = 0
+    received = 0
+    too_long = False  # Текущая строка превысила лимит, её остаток пропускается
+
+    async for chunk in request.stream():
+        received += len(chunk)
+        if max_body and received > max_body:
+            batch.append({"line": line_number + 1, "error": f"Тело запроса больше {max_body} байт"})
+            yield batch
+            return
+
+        position = 0
+        while True:
+            newline = chunk.find(b"\n", position)
+            if newline < 0:
+                if not too_long:
+                    buffer += chunk[position:]
+                    if len(buffer) > SCAN_MAX_LINE_BYTES:
+                        too_long = True
+                        buffer.clear()
+                break
+
+            line_number += 1
+            if too_long:
+                batch.append({"line": line_number, "error": "Строка слишком длинная"})
+            else:
+                buffer += chunk[position:newline]
+                if buffer.strip():
+                    batch.append(parse_ndjson_line(bytes(buffer), line_number, SCAN_MAX_LINE_BYTES))
+            buffer.clear()
+            too_long = False
+            position = newline + 1
+
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+        if batch:
+            yield batch
+            batch = []
+
+    # Последняя строка без перевода строки
+    line_number += 1
+    if too_long:
+        yield [{"line": line_number, "error": "Строка слишком длинная"}]
+    elif buffer.strip():
+        yield [parse_ndjson_line(bytes(buffer), line_number, SCAN_MAX_LINE_BYTES)]
+
+
+async def _scan_batch(batch: List[Dict]) -> List[str]:
+    """Проверка пачки документов, результат - готовые строки NDJSON"""
+    documents = [document for document in batch if "error" not in document]
+
+    results = []
+    if documents:
+        async with AsyncSessionLocal() as db:
+            results = await dlp_engine.check_messages(
+                [document["text"] for document in documents], user="scan", db_session=db
+            )
+
+    verdicts = iter(results)
+    lines = []
+    for document in batch:
+        if "error" in document:
+            output = {"line": document["line"], "error": document["error"]}
+        else:
+            result = next(verdicts)
+            output = {
+                "id": document["id"],
+                "allowed": result["allowed"],
+                "status": result["status"],
+                "reason": result["reason"],
+                "rule": result.get("rule"),
+                "found_keywords": result["found_keywords"],
+                "sensitive_data": [
+                    {"type": item["type"], "value": item["value"], "start": item["start"], "end": item["end"]}
+                    for item in (result["sensitive_data"] or {}).get("found_data", [])
+                ],
+                "urls": (result["urls"] or {}).get("urls", [])
+            }
+        lines.append(json.dumps(output, ensure_ascii=False) + "\n")
+    return lines
+
+
+async def _scan_stream(request: Request, concurrency: int, batch_size: int) -> AsyncIterator[str]:
+    """
+    Потоковая проверка: не более concurrency пачек в работе одновременно
+
+    Тело читается, пока проверяются уже принятые пачки; вердикты самой
+    старой пачки отправляются клиенту, как только она готова. Новая пачка
+    не читается, пока в работе concurrency пачек, поэтому память
+    ограничена concurrency * batch_size документами, а порядок результатов
+    совпадает с порядком входа.
+    """
+    in_flight = deque()
+    reader = _read_documents(request, batch_size)
+    next_batch = asyncio.ensure_future(anext(reader, None))
+
+    try:
+        while next_batch is not None or in_flight:
+            if next_batch is not None and len(in_flight) < concurrency:
+                waiting = {next_batch, in_flight[0]} if in_flight else {next_batch}
+                await asyncio.wait(waiting, return_when=asyncio.FIRST_COMPLETED)
+                if next_batch.done():
+                    batch = next_batch.result()
+                    if batch is None:
+                        next_batch = None
+                    else:
+                        in_flight.append(asyncio.create_task(_scan_batch(batch)))
+                        next_batch = asyncio.ensure_future(anext(reader, None))
+
+            # Готовые пачки - сразу клиенту; при полной очереди или конце тела - ждём самую старую
+            while in_flight and (in_flight[0].done() or next_batch is None or len(in_flight) >= concurrency):
+                for line in await in_flight.popleft():
+                    yield line
+    finally:
+        tasks = list(in_flight)
+        if next_batch is not None:
+            tasks.append(next_batch)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await reader.aclose()
+
+
+@router.post("/scan")
+async def scan_documents(
+        request: Request,
+        concurrency: int = Query(4, ge=1, le=32),
+        batch_size: int = Query(64, ge=1, le=1000)
+):
+    """
+    Потоковая DLP проверка документов для внутренних сервисов
+
+    Тело - NDJSON: по одному документу {"id": ..., "text": "..."} на строку.
+    Тело читается по мере поступления, ответ - NDJSON с вердиктами в том же
+    порядке, каждый отдаётся, как только проверена его пачка.
+    """
+    max_body = settings.DLP_SCAN_MAX_BODY_BYTES
+    content_length = request.headers.get("content-length")
+    if max_body and content_length and content_length.isdigit() and int(content_length) > max_body:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Тело запроса больше {max_body} байт"
+        )
+
+    return _DuplexStreamingResponse(
+        _scan_stream(request, concurrency, batch_size),
+        media_type="application/x-ndjson"
+    )
+
+
 @router.post("/keywords/test")
-def test_message(text: str):
-    """Тестирование сообщения через DLP"""
-    result = dlp_engine.check_message(text, "TestUser")
-    return result
\ No newline at end of file
+async def test_message(text: str, explain: bool = False, db: AsyncSession = Depends(get_db)):
+    """
+    Тестирование сообщения через DLP
+
+    explain=true - вердикт с объяснением: время стадий, совпадения
+    со смещениями, запросы к БД и решающее правило
+    """
+    return await dlp_engine.check_message(text, "TestUser", db_session=db, explain=explain)
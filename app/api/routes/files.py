@@ -9,7 +9,8 @@ from app.models.file import UploadedFile
 from app.models.user import User
 from app.websocket.manager import manager
 from fastapi.responses import FileResponse as FastAPIFileResponse
-from docx import Document
+from app.dlp.fingerprint import extract_docx, docx_text, fingerprint_index
+import asyncio
 
 
 router = APIRouter()
@@ -23,6 +24,17 @@ ALLOWED_EXTENSIONS = {".exe", ".doc", ".docx"}
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
 
 
+def _match_document(file_path: Path):
+    """Совпадение текста Word документа с реестром конфиденциальных документов"""
+    try:
+        text = docx_text(str(file_path))
+    except Exception as e:
+        # Нечитаемый документ проверит модератор
+        print(f"⚠️ Не удалось прочитать {file_path.name} для проверки отпечатков: {e}")
+        return None
+    return fingerprint_index.match_text(text)
+
+
 @router.post("/upload")
 async def upload_file(
         user_id: int,
@@ -76,6 +88,25 @@ async def upload_file(
     with open(file_path, "wb") as f:
         f.write(content)
 
+    # Проверяем, не содержит ли документ фрагменты конфиденциальных документов
+    if file_ext == ".docx" and len(fingerprint_index):
+        match = await asyncio.to_thread(_match_document, file_path)
+        if match:
+            file_path.unlink(missing_ok=True)
+            await manager.save_violation(
+                db=db,
+                user_id=user.id,
+                username=user.username,
+                display_name=user.display_name,
+                message_text=f"Файл {file.filename}",
+                found_keywords=[f"Документ: {match['name']}"]
+            )
+            print(f"📄 Файл {file.filename} от {user.display_name} содержит фрагмент документа «{match['name']}»")
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Файл содержит фрагменты конфиденциального документа «{match['name']}»"
+            )
+
     # Сохраняем информацию в БД
     uploaded_file = UploadedFile(
         user_id=user.id,
@@ -94,6 +125,11 @@ async def upload_file(
     await db.commit()
     await db.refresh(uploaded_file)
 
+    if moderation_type == "virustotal":
+        # Файл проверит фоновая проверка VirusTotal
+        from app.services.scan_scheduler import scan_scheduler
+        scan_scheduler.notify()
+
     moderation_text = "ручную модерацию" if moderation_type == "manual" else "проверку VirusTotal"
     print(f"📎 Файл загружен: {file.filename} от {user.display_name} (тип модерации: {moderation_type})")
 
@@ -440,9 +476,14 @@ async def check_virustotal(
     elif result.get("status") == "malicious":
         file_obj.status = "rejected"
         print(f"❌ Файл автоматически отклонён (VirusTotal: обнаружены вирусы)")
+    elif result.get("status") == "suspicious":
+        # Подозрительный - оставляем на ручную проверку
+        print(f"⚠️ Файл требует ручной проверки (VirusTotal: подозрительный)")
     else:
-        # Если подозрительный или ошибка - оставляем на ручную проверку
-        print(f"⚠️ Файл требует ручной проверки (VirusTotal: {result.get('status')})")
+        # Анализ ещё идёт или ошибка - результат заберёт фоновая проверка
+        print(f"⏳ Файл на проверке (VirusTotal: {result.get('status')})")
+        from app.services.scan_scheduler import scan_scheduler
+        scan_scheduler.notify()
 
     await db.commit()
     await db.refresh(file_obj)
@@ -573,26 +614,8 @@ async def preview_file(
         )
 
     try:
-        # Читаем Word документ
-        doc = Document(str(file_path))
-
-        # Извлекаем текст из параграфов
-        paragraphs = []
-        for para in doc.paragraphs:
-            if para.text.strip():
-                paragraphs.append({
-                    "text": para.text,
-                    "style": para.style.name if para.style else "Normal"
-                })
-
-        # Извлекаем текст из таблиц
-        tables = []
-        for table in doc.tables:
-            table_data = []
-            for row in table.rows:
-                row_data = [cell.text for cell in row.cells]
-                table_data.append(row_data)
-            tables.append(table_data)
+        # Читаем Word документ: абзацы и таблицы
+        paragraphs, tables = extract_docx(str(file_path))
 
         print(f"👁️ Предпросмотр файла: {file_obj.filename} пользователем {user.username}")
 
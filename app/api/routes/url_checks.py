@@ -1,14 +1,44 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from pydantic import BaseModel
+from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.database import get_db
 from app.models.user import User
-from app.models.url_check import URLCheck
+from app.models.url_check import URLCheck, URLRule
+from app.dlp.engine import dlp_engine
+from app.dlp.url_verdicts import URL_RULE_STATUSES, parse_url_rule
+from app.services.held_message_service import held_message_service
 import json
 
 router = APIRouter()
 
 
+class URLRuleCreate(BaseModel):
+    """Схема для правила домена или префикса: corp.example, *.corp.example, corp.example/wiki/"""
+    pattern: str
+    status: str
+    comment: Optional[str] = None
+
+
+class HeldMessageReject(BaseModel):
+    """Схема для отклонения задержанного сообщения"""
+    reason: Optional[str] = None
+
+
+async def _require_admin(db: AsyncSession, admin_id: int) -> User:
+    """Проверка прав администратора"""
+    result = await db.execute(select(User).where(User.id == admin_id))
+    admin = result.scalar_one_or_none()
+
+    if not admin or not admin.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Доступ запрещён"
+        )
+    return admin
+
+
 @router.get("/pending")
 async def get_pending_urls(admin_id: int, db: AsyncSession = Depends(get_db)):
     """Получить URL на проверке (только для админов)"""
@@ -99,54 +129,48 @@ async def scan_url_virustotal(
 
     # Сохраняем результат
     url_check.virustotal_result = json.dumps(vt_result, ensure_ascii=False)
-    url_check.is_reviewed = True
 
     # Автоматически определяем статус
     if vt_result.get("status") == "clean":
         url_check.status = "safe"
+        url_check.is_reviewed = True
         print(f"✅ URL безопасен (VirusTotal): {url_check.url}")
 
-        # Публикуем сообщение в чат
-        from app.websocket.manager import manager
-
-        await manager.save_message(db=db, user=url_check.display_name, text=url_check.message_text)
-
-        await manager.broadcast({
-            "type": "message",
-            "user": url_check.display_name,
-            "text": url_check.message_text,
-            "timestamp": url_check.created_at.strftime("%H:%M:%S")
-        })
-
-        await manager.broadcast({
-            "type": "info",
-            "message": f"✅ Сообщение со ссылкой проверено и опубликовано (VirusTotal)"
-        })
-
     elif vt_result.get("status") == "malicious":
         url_check.status = "malicious"
+        url_check.is_reviewed = True
         print(f"⚠️ URL опасен (VirusTotal): {url_check.url}")
 
-        from app.websocket.manager import manager
-
-        await manager.broadcast({
-            "type": "warning",
-            "message": f"⚠️ Сообщение заблокировано: обнаружена опасная ссылка (VirusTotal)"
-        })
-
     elif vt_result.get("status") == "suspicious":
-        url_check.status = "suspicious"
+        # Остаётся на проверке с результатом VirusTotal - решает администратор
         print(f"⚠️ URL подозрителен (VirusTotal): {url_check.url}")
 
+    else:
+        # Анализ ещё идёт или ошибка - URL остаётся в очереди фоновой проверки
+        print(f"⏳ URL на проверке (VirusTotal: {vt_result.get('status')}): {url_check.url}")
+
     await db.commit()
     await db.refresh(url_check)
 
+    resolved = {"published": [], "rejected": []}
+    if url_check.is_reviewed:
+        # Вердикт по URL изменился - индекс вердиктов и кэш DLP проверок обновляются
+        dlp_engine.update_url_verdict(url_check.url, url_check.status, url_check.created_at, url_check.id)
+
+        # Сообщения, ждавшие этот URL последним, публикуются или отклоняются
+        resolved = await held_message_service.resolve(db, {url_check.url: url_check.status})
+    else:
+        from app.services.scan_scheduler import scan_scheduler
+        scan_scheduler.notify()
+
     return {
         "status": "success",
         "message": "Проверка URL завершена",
         "virustotal_result": vt_result,
         "url_check": url_check.to_dict(),
-        "auto_published": url_check.status == "safe"
+        "auto_published": len(resolved["published"]) > 0,
+        "published": len(resolved["published"]),
+        "rejected": len(resolved["rejected"])
     }
 
 
@@ -156,7 +180,7 @@ async def mark_url_safe(
         admin_id: int,
         db: AsyncSession = Depends(get_db)
 ):
-    """Отметить URL как безопасный и опубликовать сообщение"""
+    """Отметить URL как безопасный и опубликовать сообщения, у которых проверены все ссылки"""
 
     # Проверяем права админа
     result = await db.execute(select(User).where(User.id == admin_id))
@@ -184,32 +208,19 @@ async def mark_url_safe(
     await db.commit()
     await db.refresh(url_check)
 
-    print(f"✅ URL одобрен: {url_check.url}")
-
-    # Публикуем сообщение в чат
-    from app.websocket.manager import manager
-
-    # Сохраняем сообщение в БД
-    await manager.save_message(db=db, user=url_check.display_name, text=url_check.message_text)
+    # Вердикт по URL изменился - индекс вердиктов и кэш DLP проверок обновляются
+    dlp_engine.update_url_verdict(url_check.url, url_check.status, url_check.created_at, url_check.id)
 
-    # Отправляем всем в чат
-    await manager.broadcast({
-        "type": "message",
-        "user": url_check.display_name,
-        "text": url_check.message_text,
-        "timestamp": url_check.created_at.strftime("%H:%M:%S")
-    })
+    print(f"✅ URL одобрен: {url_check.url}")
 
-    # Уведомляем пользователя
-    await manager.broadcast({
-        "type": "info",
-        "message": f"✅ Ваше сообщение со ссылкой было одобрено администратором"
-    })
+    # Публикуются только сообщения, у которых это была последняя ссылка без вердикта
+    resolved = await held_message_service.resolve(db, {url_check.url: "safe"})
 
     return {
         "status": "success",
-        "message": f"URL '{url_check.url}' одобрен и сообщение опубликовано",
-        "url_check": url_check.to_dict()
+        "message": f"URL '{url_check.url}' одобрен, опубликовано сообщений: {len(resolved['published'])}",
+        "url_check": url_check.to_dict(),
+        "published": len(resolved["published"])
     }
 
 
@@ -247,10 +258,157 @@ async def mark_url_malicious(
     await db.commit()
     await db.refresh(url_check)
 
+    # Вердикт по URL изменился - индекс вердиктов и кэш DLP проверок обновляются
+    dlp_engine.update_url_verdict(url_check.url, url_check.status, url_check.created_at, url_check.id)
+
     print(f"⚠️ URL отмечен как опасный: {url_check.url}")
 
+    # Сообщения с этой ссылкой отклоняются
+    resolved = await held_message_service.resolve(db, {url_check.url: "malicious"})
+
     return {
         "status": "success",
         "message": f"URL '{url_check.url}' отмечен как опасный",
-        "url_check": url_check.to_dict()
-    }
\ No newline at end of file
+        "url_check": url_check.to_dict(),
+        "rejected": len(resolved["rejected"])
+    }
+
+@router.get("/rules")
+async def get_url_rules(admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Правила доменов и префиксов путей (только для админов)"""
+    await _require_admin(db, admin_id)
+
+    result = await db.execute(select(URLRule).order_by(URLRule.domain, URLRule.path_prefix))
+    rules = result.scalars().all()
+
+    return {
+        "rules": [rule.to_dict() for rule in rules],
+        "count": len(rules)
+    }
+
+
+@router.post("/rules")
+async def create_url_rule(data: URLRuleCreate, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Отметить домен (со всеми поддоменами) или префикс пути безопасным или опасным"""
+    await _require_admin(db, admin_id)
+
+    if data.status not in URL_RULE_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Недопустимый статус: {data.status}. Разрешены: {', '.join(URL_RULE_STATUSES)}"
+        )
+
+    try:
+        domain, path_prefix = parse_url_rule(data.pattern)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    # Правило для того же домена и префикса заменяется
+    result = await db.execute(
+        select(URLRule).where(URLRule.domain == domain, URLRule.path_prefix == path_prefix)
+    )
+    rule = result.scalars().first()
+    if rule:
+        rule.status = data.status
+        rule.comment = data.comment
+        rule.created_by = admin_id
+    else:
+        rule = URLRule(domain=domain, path_prefix=path_prefix, status=data.status,
+                       comment=data.comment, created_by=admin_id)
+        db.add(rule)
+
+    await db.commit()
+    await db.refresh(rule)
+
+    dlp_engine.url_verdicts.add_rule(rule.id, rule.domain, rule.path_prefix, rule.status)
+    print(f"🔗 Правило URL: {rule.to_dict()['pattern']} -> {rule.status}")
+
+    # Правило решает сразу все ожидающие ссылки домена
+    resolved = await held_message_service.resolve_pending(db)
+
+    return {
+        "status": "success",
+        "message": f"Ссылки {rule.to_dict()['pattern']} отмечены как {rule.status}",
+        "rule": rule.to_dict(),
+        "published": len(resolved["published"]),
+        "rejected": len(resolved["rejected"])
+    }
+
+
+@router.delete("/rules/{rule_id}")
+async def delete_url_rule(rule_id: int, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Удалить правило домена или префикса"""
+    await _require_admin(db, admin_id)
+
+    rule = await db.get(URLRule, rule_id)
+    if not rule:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Правило не найдено"
+        )
+
+    await db.delete(rule)
+    await db.commit()
+
+    dlp_engine.url_verdicts.remove_rule(rule_id)
+
+    return {
+        "status": "success",
+        "message": f"Правило {rule_id} удалено"
+    }
+
+
+@router.get("/held")
+async def get_held_messages(admin_id: int, message_status: str = "held", after_id: int = 0,
+                            limit: int = 100, db: AsyncSession = Depends(get_db)):
+    """Сообщения, задержанные до проверки ссылок, со статусами ссылок (только для админов)"""
+    await _require_admin(db, admin_id)
+
+    messages = await held_message_service.get_held(db, message_status, after_id, min(limit, 1000))
+    return {
+        "messages": messages,
+        "count": len(messages),
+        "next_after_id": messages[-1]["id"] if messages else None
+    }
+
+
+@router.post("/held/{held_id}/publish")
+async def publish_held_message(held_id: int, admin_id: int, db: AsyncSession = Depends(get_db)):
+    """Опубликовать задержанное сообщение, не дожидаясь вердиктов по ссылкам"""
+    await _require_admin(db, admin_id)
+
+    held = await held_message_service.publish(db, held_id)
+    if not held:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Задержанное сообщение не найдено или уже решено"
+        )
+
+    return {
+        "status": "success",
+        "message": "Сообщение опубликовано",
+        "held_message": held.to_dict()
+    }
+
+
+@router.post("/held/{held_id}/reject")
+async def reject_held_message(held_id: int, admin_id: int, data: Optional[HeldMessageReject] = None,
+                              db: AsyncSession = Depends(get_db)):
+    """Отклонить задержанное сообщение"""
+    await _require_admin(db, admin_id)
+
+    held = await held_message_service.reject(db, held_id, data.reason if data else None)
+    if not held:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Задержанное сообщение не найдено или уже решено"
+        )
+
+    return {
+        "status": "success",
+        "message": "Сообщение отклонено",
+        "held_message": held.to_dict()
+    }
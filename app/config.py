@@ -26,12 +26,22 @@ class Settings(BaseSettings):
     DLP_ENABLED: bool = True
     OCR_LANGUAGE: str = "rus+eng"
     MAX_FILE_SIZE_MB: int = 50
+    DLP_POLICY_POLL_SECONDS: float = 5.0  # Как часто воркер проверяет версию политики
+    DLP_SCAN_BUDGET_MS: float = 50.0  # Лимит времени regex-анализа одного сообщения
+    DLP_SCAN_FAIL_CLOSED: bool = True  # При превышении лимита: True - блокировать, False - пропустить
+    DLP_SCAN_MAX_BODY_BYTES: Optional[int] = None  # Лимит тела потоковой проверки /scan (None - без лимита)
+    DLP_EDM_INDEX_PATH: Optional[str] = None  # Индекс реестра идентификаторов клиентов (python -m app.dlp.edm)
+    DLP_BLOCKLIST_PATH: Optional[str] = None  # Блоклист доменов из фидов угроз (python -m app.dlp.blocklist)
+    DLP_BLOCKLIST_FEEDS_DIR: Optional[str] = None  # Каталог файлов фидов для пересборки блоклиста
 
     # Tesseract (для OCR)
     TESSERACT_CMD: Optional[str] = None
 
     # VirusTotal API
     VIRUSTOTAL_API_KEY: str = "your_api_key_here"  # ← добавили
+    VIRUSTOTAL_REQUESTS_PER_MINUTE: int = 4  # Квота API (публичный ключ - 4 запроса в минуту, 0 - без ограничения)
+    VIRUSTOTAL_AUTO_SCAN: bool = True  # Фоновая проверка ожидающих URL и файлов (достаточно одного воркера)
+    VIRUSTOTAL_CONCURRENCY: int = 4  # Одновременных проверок в фоне
 
     # CORS
     BACKEND_CORS_ORIGINS: list = ["http://localhost:3000", "http://localhost:8080"]
@@ -32,7 +32,7 @@ async def init_db():
     """Инициализация БД (создание таблиц)"""
     async with engine.begin() as conn:
         # Импортируем все модели перед созданием таблиц
-        from app.models import user, message, violation, file, url_check
+        from app.models import user, message, violation, file, url_check, dlp_policy, dlp_backfill
 
         # Создаём таблицы
         await conn.run_sync(Base.metadata.create_all)
@@ -0,0 +1,130 @@
+"""
+Командная строка DLP
+
+    python -m app.dlp scan ПУТЬ [ПУТЬ ...] [-o results.ndjson] [--resume]
+
+Проверяет каталоги (рекурсивно: текстовые файлы, .docx, выгрузки .ndjson)
+и NDJSON со стандартного ввода ("-") правилами мессенджера в пуле процессов.
+Результаты - NDJSON, по строке на документ.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List, Tuple
+
+
+def _with_keywords(rules: List[Dict], keywords: List[str]) -> List[Dict]:
+    """Подстановка списка слов в правила со словами из хранилища"""
+    from app.dlp.policy import KEYWORD_STORE_SOURCE
+
+    return [dict(rule, keywords=keywords) if rule.get("source") == KEYWORD_STORE_SOURCE else dict(rule)
+            for rule in rules]
+
+
+def _load_rules_file(path: str) -> List[Dict]:
+    """
+    Правила из JSON: список описаний правил или ответ GET /api/dlp/rules
+    ({"rules": [{"definition": ..., "is_enabled": ...}, ...]})
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    if isinstance(data, dict):
+        return [rule["definition"] for rule in data.get("rules", []) if rule.get("is_enabled", True)]
+    return list(data)
+
+
+def _load_rules_db() -> Tuple[List[Dict], int]:
+    """Текущая политика из БД приложения (нужны настройки app.config)"""
+    import asyncio
+    from app.database import AsyncSessionLocal
+    from app.services.policy_service import policy_service
+
+    async def load():
+        async with AsyncSessionLocal() as db:
+            rules, _ = await policy_service.get_policy_rules(db)
+            return rules, await policy_service.get_version(db)
+
+    return asyncio.run(load())
+
+
+def _scan(args) -> int:
+    from app.dlp.analyzers.text_analyzer import DEFAULT_KEYWORDS
+    from app.dlp.guard import ScanBudget
+    from app.dlp.offline import OfflineScanner
+    from app.dlp.policy import DEFAULT_RULES
+
+    keywords = list(DEFAULT_KEYWORDS)
+    if args.keywords:
+        with open(args.keywords, encoding="utf-8") as f:
+            keywords = [line.strip().lower() for line in f if line.strip()]
+
+    version = 0
+    if args.db:
+        rules, version = _load_rules_db()
+    else:
+        rules = _with_keywords(_load_rules_file(args.rules) if args.rules else DEFAULT_RULES, keywords)
+
+    state_path = args.state or (f"{args.output}.state" if args.output else None)
+    if args.resume and not state_path:
+        print("❌ Для продолжения нужен --output или --state", file=sys.stderr)
+        return 2
+
+    try:
+        scanner = OfflineScanner(
+            rules, version,
+            budget=ScanBudget(args.budget_ms, False),
+            edm_path=args.edm,
+            secrets_action=args.secrets_action,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            only_violations=args.only_violations
+        )
+        print(f"🔎 DLP проверка: {scanner.workers} процессов, {len(rules)} правил", file=sys.stderr)
+        stats = scanner.run(args.paths, args.output, state_path, args.resume)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 2
+
+    if stats["interrupted"]:
+        print(f"\n⏸️ Проверка прервана после {stats['documents']} документов, "
+              f"продолжить: добавьте --resume", file=sys.stderr)
+        return 130
+
+    print(
+        f"✅ Проверено документов: {stats['documents']} (нарушений: {stats['violations']}, "
+        f"ошибок: {stats['errors']}) за {stats['seconds']} с, {stats['per_second']} док/с",
+        file=sys.stderr
+    )
+    return 0
+
+
+def main(argv=None) -> int:
+    from app.dlp.plugins import SecretsPlugin
+
+    parser = argparse.ArgumentParser(prog="python -m app.dlp", description="DLP проверка вне сервера")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scan = commands.add_parser("scan", help="Проверить каталоги, файлы и выгрузки NDJSON")
+    scan.add_argument("paths", nargs="+", help="Каталоги, файлы или - (NDJSON со стандартного ввода)")
+    scan.add_argument("-o", "--output", help="Файл результатов NDJSON (по умолчанию - stdout)")
+    scan.add_argument("--state", help="Файл состояния для продолжения (по умолчанию - OUTPUT.state)")
+    scan.add_argument("--resume", action="store_true", help="Продолжить прерванную проверку")
+    scan.add_argument("--workers", type=int, help="Число процессов (по умолчанию - число ядер)")
+    scan.add_argument("--batch-size", type=int, default=32, help="Документов в одной задаче воркера")
+    scan.add_argument("--rules", help="JSON с правилами (список или ответ GET /api/dlp/rules)")
+    scan.add_argument("--keywords", help="Файл запрещённых слов, по слову в строке")
+    scan.add_argument("--db", action="store_true", help="Взять текущую политику из БД приложения")
+    scan.add_argument("--edm", help="Индекс EDM (python -m app.dlp.edm)")
+    scan.add_argument("--budget-ms", type=float, default=10000.0, help="Лимит времени анализа одного документа")
+    scan.add_argument("--secrets-action", choices=SecretsPlugin.ACTIONS, default="block")
+    scan.add_argument("--only-violations", action="store_true", help="Не выводить разрешённые документы")
+
+    args = parser.parse_args(argv)
+    if args.command == "scan":
+        return _scan(args)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
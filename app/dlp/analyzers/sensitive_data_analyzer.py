@@ -1,45 +1,125 @@
 import re
-from typing import List, Dict
+from typing import List, Dict, Tuple, Optional
+from app.dlp.scanner import PatternScanner, ScanMatch
+from app.dlp.validators import validate_batch, max_confidence
+
+
+# Маска для цифр: все цифры заменяются на "*" за один вызов translate
+_DIGIT_MASK = str.maketrans("0123456789", "*" * 10)
+
+
+# Паттерны для поиска конфиденциальных данных.
+# Порядок важен: в одной позиции побеждает первый совпавший паттерн.
+# validator - контрольная сумма, без которой кандидат отбрасывается,
+# fallback - тип, которым считается кандидат, не прошедший проверку
+# (с уверенностью fallback_confidence, по умолчанию "low"),
+# prefilter - символы, без которых паттерн совпасть не может
+DEFAULT_PATTERNS = {
+    "bank_card": {
+        "regex": r'\b\d{4}[\s\-]?\d{4}[\s\-]?\d{4}[\s\-]?\d{4}\b',
+        "name": "Номер банковской карты",
+        "severity": "high",
+        "validator": "luhn",
+        "prefilter": r'\d'
+    },
+    "email": {
+        "regex": r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b',
+        "name": "Email адрес",
+        "severity": "medium",
+        "prefilter": "@"
+    },
+    "snils": {
+        "regex": r'\b\d{3}[\s\-]?\d{3}[\s\-]?\d{3}[\s\-]?\d{2}\b',
+        "name": "СНИЛС",
+        "severity": "high",
+        "validator": "snils",
+        # 11 цифр подряд с 8 в начале: без контрольной суммы СНИЛС - телефон
+        "fallback": "phone",
+        "fallback_confidence": "medium",
+        "prefilter": r'\d'
+    },
+    "phone": {
+        "regex": r'(?<!\w)(?:\+7|8)[\s\-]?\(?\d{3}\)?[\s\-]?\d{3}[\s\-]?\d{2}[\s\-]?\d{2}\b',
+        "name": "Номер телефона",
+        "severity": "medium",
+        "prefilter": r'\d'
+    },
+    "inn": {
+        "regex": r'\b\d{10}(?:\d{2})?\b',
+        "name": "ИНН",
+        "severity": "medium",
+        "validator": "inn",
+        "fallback": "passport",
+        "prefilter": r'\d'
+    },
+    "passport": {
+        "regex": r'\b\d{4}[\s\-]?\d{6}\b',
+        "name": "Серия и номер паспорта",
+        "severity": "high",
+        "prefilter": r'\d'
+    }
+}
 
 
 class SensitiveDataAnalyzer:
     """Анализатор конфиденциальных данных"""
 
-    def __init__(self):
-        # Паттерны для поиска конфиденциальных данных
-        self.patterns = {
-            "bank_card": {
-                "regex": r'\b\d{4}[\s\-]?\d{4}[\s\-]?\d{4}[\s\-]?\d{4}\b',
-                "name": "Номер банковской карты",
-                "severity": "high"
-            },
-            "email": {
-                "regex": r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b',
-                "name": "Email адрес",
-                "severity": "medium"
-            },
-            "phone": {
-                "regex": r'\b(?:\+7|8)[\s\-]?\(?(\d{3})\)?[\s\-]?(\d{3})[\s\-]?(\d{2})[\s\-]?(\d{2})\b',
-                "name": "Номер телефона",
-                "severity": "medium"
-            },
-            "passport": {
-                "regex": r'\b\d{4}[\s\-]?\d{6}\b',
-                "name": "Серия и номер паспорта",
-                "severity": "high"
-            },
-            "inn": {
-                "regex": r'\b\d{10}(?:\d{2})?\b',
-                "name": "ИНН",
-                "severity": "medium"
-            },
-            "snils": {
-                "regex": r'\b\d{3}[\s\-]?\d{3}[\s\-]?\d{3}[\s\-]?\d{2}\b',
-                "name": "СНИЛС",
-                "severity": "high"
-            }
+    def __init__(self, patterns: Optional[Dict[str, Dict]] = None):
+        self.patterns = patterns if patterns is not None else DEFAULT_PATTERNS
+
+        # Все паттерны сканируются за один проход. Если в тексте нет символов,
+        # без которых не совпадает ни один паттерн (для паттернов по умолчанию -
+        # цифр и "@"), текст пропускается сразу
+        prefilters = [info.get("prefilter") for info in self.patterns.values()]
+        self.scanner = PatternScanner(
+            {data_type: info["regex"] for data_type, info in self.patterns.items()},
+            prefilter="|".join(dict.fromkeys(prefilters)) if prefilters and all(prefilters) else None
+        )
+        self._fallback_patterns = {
+            info["fallback"]: re.compile(self.patterns[info["fallback"]]["regex"])
+            for info in self.patterns.values() if "fallback" in info
         }
 
+    def scan(self, text: str, deadline: Optional[float] = None) -> List[ScanMatch]:
+        """Поиск кандидатов с типами и смещениями в тексте (см. PatternScanner.scan)"""
+        return self.scanner.scan(text, deadline)
+
+    def validate(self, matches: List[ScanMatch]) -> List[Tuple[ScanMatch, str, str]]:
+        """
+        Проверка контрольных сумм всех кандидатов сообщения
+
+        Кандидаты одного типа проверяются одним пакетом. Возвращает только
+        прошедших проверку кандидатов: (совпадение, итоговый тип, уверенность).
+        Проверенные по контрольной сумме получают уверенность "high",
+        паттерны без контрольной суммы - "medium", кандидаты, перешедшие
+        в fallback-тип, - fallback_confidence паттерна ("low" по умолчанию).
+        """
+        by_validator = {}
+        for i, match in enumerate(matches):
+            validator = self.patterns[match.type].get("validator")
+            if validator:
+                by_validator.setdefault(validator, []).append(i)
+
+        passed = [True] * len(matches)
+        for validator, indices in by_validator.items():
+            results = validate_batch(validator, [matches[i].value for i in indices])
+            for i, ok in zip(indices, results):
+                passed[i] = ok
+
+        validated = []
+        for match, ok in zip(matches, passed):
+            pattern_info = self.patterns[match.type]
+            if ok:
+                confidence = "high" if "validator" in pattern_info else "medium"
+                validated.append((match, match.type, confidence))
+                continue
+
+            fallback = pattern_info.get("fallback")
+            if fallback and self._fallback_patterns[fallback].fullmatch(match.value):
+                validated.append((match, fallback, pattern_info.get("fallback_confidence", "low")))
+
+        return validated
+
     def analyze(self, text: str) -> Dict:
         """
         Анализ текста на наличие конфиденциальных данных
@@ -49,56 +129,60 @@ class SensitiveDataAnalyzer:
             "has_sensitive_data": True/False,
             "found_data": [...],
             "severity": "low/medium/high",
+            "confidence": "low/medium/high",
             "message": "..."
         }
         """
-        found_data = []
-        max_severity = "low"
+        return self.report(self.validate(self.scan(text)))
 
-        for data_type, pattern_info in self.patterns.items():
-            matches = re.findall(pattern_info["regex"], text)
-
-            if matches:
-                # Для номера телефона matches это кортежи, преобразуем
-                if data_type == "phone":
-                    matches = [f"+7 ({m[0]}) {m[1]}-{m[2]}-{m[3]}" for m in matches]
-
-                for match in matches:
-                    found_data.append({
-                        "type": data_type,
-                        "name": pattern_info["name"],
-                        "value": self._mask_value(str(match), data_type),
-                        "severity": pattern_info["severity"]
-                    })
-
-                # Обновляем максимальную критичность
-                if pattern_info["severity"] == "high":
-                    max_severity = "high"
-                elif pattern_info["severity"] == "medium" and max_severity != "high":
-                    max_severity = "medium"
-
-        if found_data:
-            data_types = ", ".join(set([d["name"] for d in found_data]))
+    def report(self, matches: List[Tuple[ScanMatch, str, str]]) -> Dict:
+        """Формирование результата анализа по проверенным кандидатам"""
+        if not matches:
             return {
-                "has_sensitive_data": True,
-                "found_data": found_data,
-                "severity": max_severity,
-                "message": f"Обнаружены конфиденциальные данные: {data_types}"
+                "has_sensitive_data": False,
+                "found_data": [],
+                "severity": "low",
+                "confidence": "low",
+                "message": "Конфиденциальные данные не обнаружены"
             }
 
+        found_data = []
+        max_severity = "low"
+
+        for match, data_type, confidence in matches:
+            pattern_info = self.patterns[data_type]
+
+            found_data.append({
+                "type": data_type,
+                "name": pattern_info["name"],
+                "value": self.mask_value(match.value, data_type),
+                "severity": pattern_info["severity"],
+                "confidence": confidence,
+                "start": match.start,
+                "end": match.end
+            })
+
+            # Обновляем максимальную критичность
+            if pattern_info["severity"] == "high":
+                max_severity = "high"
+            elif pattern_info["severity"] == "medium" and max_severity != "high":
+                max_severity = "medium"
+
+        data_types = ", ".join(set([d["name"] for d in found_data]))
         return {
-            "has_sensitive_data": False,
-            "found_data": [],
-            "severity": "low",
-            "message": "Конфиденциальные данные не обнаружены"
+            "has_sensitive_data": True,
+            "found_data": found_data,
+            "severity": max_severity,
+            "confidence": max_confidence([d["confidence"] for d in found_data]),
+            "message": f"Обнаружены конфиденциальные данные: {data_types}"
         }
 
-    def _mask_value(self, value: str, data_type: str) -> str:
+    def mask_value(self, value: str, data_type: str) -> str:
         """Маскирование значения для отображения"""
         if data_type == "bank_card":
             # Показываем только последние 4 цифры
-            digits = re.sub(r'\D', '', value)
-            return f"****-****-****-{digits[-4:]}" if len(digits) >= 4 else "****"
+            digits = [c for c in value if c.isdigit()]
+            return f"****-****-****-{''.join(digits[-4:])}" if len(digits) >= 4 else "****"
 
         elif data_type == "email":
             parts = value.split('@')
@@ -109,9 +193,14 @@ class SensitiveDataAnalyzer:
                 return f"{masked_username}@{domain}"
 
         elif data_type == "phone":
-            return re.sub(r'\d(?=\d{2})', '*', value)
+            # Показываем только последние 2 цифры
+            digit_positions = [i for i, c in enumerate(value) if c.isdigit()]
+            if len(digit_positions) <= 2:
+                return value
+            cut = digit_positions[-2]
+            return value[:cut].translate(_DIGIT_MASK) + value[cut:]
 
         elif data_type in ["passport", "inn", "snils"]:
-            return re.sub(r'\d', '*', value)
+            return value.translate(_DIGIT_MASK)
 
-        return value
\ No newline at end of file
+        return value
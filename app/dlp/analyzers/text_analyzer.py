@@ -1,27 +1,68 @@
-from flashtext import KeywordProcessor
-from typing import List, Dict
+from typing import List, Dict, Set, Iterable, NamedTuple, Tuple
+from app.dlp.automaton import KeywordAutomaton, split_keyword
+from app.dlp.morphology import word_forms
+
+
+# Запрещённые слова по умолчанию (используются, пока политика не загружена из БД)
+DEFAULT_KEYWORDS = [
+    "конфиденциально",
+    "секретно",
+    "пароль",
+    "password",
+    "банковская карта",
+    "кредитная карта"
+]
+
+
+class KeywordSnapshot(NamedTuple):
+    """
+    Неизменяемый снимок ключевых слов вместе с построенным автоматом
+
+    anchors - слова-якоря правил близости: ищутся тем же автоматом,
+    но сами по себе запрещёнными словами не являются
+    """
+    version: int
+    keywords: Tuple[str, ...]
+    automaton: KeywordAutomaton
+    anchors: Tuple[str, ...] = ()
 
 
 class TextAnalyzer:
     """Анализатор текста на запрещённые слова"""
 
     def __init__(self):
-        self.keyword_processor = KeywordProcessor()
-        # Добавляем тестовые запрещённые слова
-        self.forbidden_keywords = [
-            "конфиденциально",
-            "секретно",
-            "пароль",
-            "password",
-            "банковская карта",
-            "кредитная карта"
-        ]
-        self._load_keywords()
-
-    def _load_keywords(self):
-        """Загрузка ключевых слов в процессор"""
-        for keyword in self.forbidden_keywords:
-            self.keyword_processor.add_keyword(keyword)
+        # Словоформы каждого слова ключевых фраз (считаются один раз на слово)
+        self._forms: Dict[str, Set[str]] = {}
+        self._snapshot = self.build_snapshot(DEFAULT_KEYWORDS)
+
+    @property
+    def version(self) -> int:
+        """Версия политики, по которой построен текущий автомат"""
+        return self._snapshot.version
+
+    def build_snapshot(self, keywords: Iterable[str], version: int = 0,
+                       anchors: Iterable[str] = ()) -> KeywordSnapshot:
+        """
+        Построение нового снимка ключевых слов
+
+        Не трогает текущий снимок, поэтому может выполняться в отдельном
+        потоке, пока сообщения проверяются по старому автомату.
+        """
+        keywords = tuple(dict.fromkeys(keyword.lower() for keyword in keywords))
+        anchors = tuple(dict.fromkeys(anchor.lower() for anchor in anchors))
+
+        return KeywordSnapshot(version, keywords, KeywordAutomaton(keywords + anchors, self._word_forms), anchors)
+
+    def _word_forms(self, word: str) -> Set[str]:
+        """Словоформы слова из кэша"""
+        forms = self._forms.get(word)
+        if forms is None:
+            forms = self._forms[word] = word_forms(word)
+        return forms
+
+    def swap(self, snapshot: KeywordSnapshot):
+        """Атомарная замена снимка (одно присваивание)"""
+        self._snapshot = snapshot
 
     def analyze(self, text: str) -> Dict:
         """
@@ -31,38 +72,55 @@ class TextAnalyzer:
         {
             "status": "allow" | "block" | "quarantine",
             "found_keywords": [...],
+            "matches": [{"keyword", "form", "start", "end"}, ...],
             "message": "..."
         }
         """
-        # Ищем запрещённые слова
-        found = self.keyword_processor.extract_keywords(text.lower())
+        # Ищем запрещённые слова во всех словоформах
+        snapshot = self._snapshot
+        matches = snapshot.automaton.find(text)
+        if snapshot.anchors:
+            keywords = set(snapshot.keywords)
+            matches = [m for m in matches if m.lemma in keywords]
 
-        if not found:
+        if not matches:
             return {
                 "status": "allow",
                 "found_keywords": [],
+                "matches": [],
                 "message": "Сообщение разрешено"
             }
 
+        found = list(dict.fromkeys(m.lemma for m in matches))
+
         # Если найдены запрещённые слова - блокируем
         return {
             "status": "block",
             "found_keywords": found,
+            "matches": [
+                {"keyword": m.lemma, "form": m.form, "start": m.start, "end": m.end}
+                for m in matches
+            ],
             "message": f"Обнаружены запрещённые слова: {', '.join(found)}"
         }
 
     def add_keyword(self, keyword: str):
-        """Добавить новое ключевое слово"""
-        if keyword.lower() not in self.forbidden_keywords:
-            self.forbidden_keywords.append(keyword.lower())
-            self.keyword_processor.add_keyword(keyword.lower())
+        """Добавить новое ключевое слово (только в памяти этого процесса)"""
+        snapshot = self._snapshot
+        if keyword.lower() not in snapshot.keywords:
+            self.swap(self.build_snapshot(snapshot.keywords + (keyword,), snapshot.version, snapshot.anchors))
 
     def remove_keyword(self, keyword: str):
-        """Удалить ключевое слово"""
-        if keyword.lower() in self.forbidden_keywords:
-            self.forbidden_keywords.remove(keyword.lower())
-            self.keyword_processor.remove_keyword(keyword.lower())
+        """Удалить ключевое слово (только в памяти этого процесса)"""
+        snapshot = self._snapshot
+        if keyword.lower() in snapshot.keywords:
+            keywords = [k for k in snapshot.keywords if k != keyword.lower()]
+            used = {word for k in keywords + list(snapshot.anchors) for word in split_keyword(k)[0]}
+            for word in split_keyword(keyword.lower())[0]:
+                if word not in used:
+                    self._forms.pop(word, None)
+            self.swap(self.build_snapshot(keywords, snapshot.version, snapshot.anchors))
 
     def get_keywords(self) -> List[str]:
         """Получить список всех ключевых слов"""
-        return self.forbidden_keywords.copy()
\ No newline at end of file
+        return list(self._snapshot.keywords)
@@ -1,22 +1,144 @@
 import re
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from urllib.parse import quote, urlsplit
+from app.dlp.guard import ScanTimeout, finditer
+
+
+# Параметры отслеживания: не меняют страницу, но делают каждую ссылку уникальной
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "gbraid", "wbraid", "yclid", "ysclid", "msclkid", "igshid",
+    "mc_cid", "mc_eid", "_openstat", "_ga", "_gl", "ref_src", "spm"
+}
+TRACKING_PREFIXES = ("utm_",)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Символы, которые не нужно кодировать (RFC 3986: unreserved)
+_UNRESERVED = frozenset("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+# Зарезервированные символы и % остаются как есть, кодируются только пробелы и не-ASCII
+_SAFE_CHARS = "!#$%&'()*+,/:;=?@[]~"
+_PERCENT_RE = re.compile(r'%([0-9A-Fa-f]{2})')
+# Знаки препинания, которыми предложение заканчивается после ссылки
+_TRAILING_PUNCTUATION = ".,;:!?"
+
+
+def _normalize_percent(part: str) -> str:
+    """
+    Нормализация процентного кодирования
+
+    Закодированные unreserved-символы декодируются (%7E -> ~), остальные
+    коды - в верхнем регистре, не-ASCII символы кодируются в UTF-8:
+    /путь, /%d0%bf%d1%83%d1%82%d1%8c и /%D0%BF%D1%83%D1%82%D1%8C совпадают.
+    """
+    def replace(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in _UNRESERVED else "%" + match.group(1).upper()
+
+    return quote(_PERCENT_RE.sub(replace, part), safe=_SAFE_CHARS)
+
+
+def _is_tracking(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def _idna_host(host: str) -> str:
+    """Имя хоста в нижнем регистре, метки с не-ASCII символами - в punycode"""
+    labels = []
+    for label in host.lower().rstrip(".").split("."):
+        if label.isascii():
+            labels.append(label)
+            continue
+        try:
+            labels.append(label.encode("idna").decode("ascii"))
+        except UnicodeError:
+            labels.append(label)
+    return ".".join(labels)
+
+
+def canonicalize_url(url: str) -> str:
+    """
+    Канонический вид URL
+
+    Схема и хост в нижнем регистре, международные домены в punycode,
+    порт по умолчанию убран, процентное кодирование нормализовано,
+    параметры отслеживания (utm_*, fbclid, ...) и фрагмент удалены,
+    пустой путь - "/". Варианты одной ссылки дают одну строку, поэтому
+    вердикт и модерация нужны один раз.
+    """
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url  # Некорректный порт или адрес - оставляем как есть
+
+    scheme = parts.scheme.lower()
+    host = _idna_host(parts.hostname or "")
+    if ":" in host:
+        host = f"[{host}]"  # IPv6
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    if parts.username is not None:
+        userinfo = parts.netloc.rpartition("@")[0]
+        host = f"{userinfo}@{host}"
+
+    path = _normalize_percent(parts.path) or "/"
+
+    query = "&".join(
+        _normalize_percent(param) for param in parts.query.split("&")
+        if param and not _is_tracking(param.split("=", 1)[0])
+    )
+
+    return f"{scheme}://{host}{path}" + (f"?{query}" if query else "")
+
+
+def split_url(url: str) -> Tuple[str, str]:
+    """Хост (без порта и учётных данных) и путь канонического URL"""
+    try:
+        parts = urlsplit(url)
+        return parts.hostname or "", parts.path or "/"
+    except ValueError:
+        return "", "/"
+
+
+def _strip_trailing(url: str) -> str:
+    """Убрать знаки препинания после ссылки и непарную закрывающую скобку"""
+    while url:
+        if url[-1] in _TRAILING_PUNCTUATION:
+            url = url[:-1]
+        elif url[-1] == ")" and url.count(")") > url.count("("):
+            url = url[:-1]
+        else:
+            break
+    return url
 
 
 class URLAnalyzer:
     """Анализатор URL в сообщениях"""
 
     def __init__(self):
-        # Паттерн для поиска URL
+        # Паттерн для поиска URL: один класс символов вместо пересекающихся
+        # альтернатив (набор символов тот же, но без катастрофического отката)
+        # \w - буквы международных доменов и путей (https://пример.рф/страница)
         self.url_pattern = re.compile(
-            r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+            r'http[s]?://[\w$-_@.&+!*\\(),%]+'
         )
 
-    def extract_urls(self, text: str) -> List[str]:
-        """Извлечение всех URL из текста"""
-        urls = self.url_pattern.findall(text)
-        return list(set(urls))  # Убираем дубликаты
+    def extract_urls(self, text: str, deadline: Optional[float] = None) -> List[str]:
+        """
+        Извлечение всех URL из текста в каноническом виде (см. canonicalize_url)
+
+        ScanTimeout - при превышении deadline
+        """
+        urls = []
+        try:
+            for match in finditer(self.url_pattern, text, deadline):
+                urls.append(canonicalize_url(_strip_trailing(match.group())))
+        except ScanTimeout:
+            raise ScanTimeout(list(dict.fromkeys(urls)))
+        return list(dict.fromkeys(urls))  # Убираем дубликаты
 
-    def analyze(self, text: str) -> Dict:
+    def analyze(self, text: str, deadline: Optional[float] = None) -> Dict:
         """
         Анализ текста на наличие URL
 
@@ -24,22 +146,30 @@ class URLAnalyzer:
         {
             "has_urls": True/False,
             "urls": [...],
-            "message": "..."
+            "message": "...",
+            "timed_out": True - поиск остановлен по лимиту времени
         }
         """
-        urls = self.extract_urls(text)
+        timed_out = False
+        try:
+            urls = self.extract_urls(text, deadline)
+        except ScanTimeout as e:
+            urls = e.matches
+            timed_out = True
 
         if urls:
             return {
                 "has_urls": True,
                 "urls": urls,
                 "url_count": len(urls),
-                "message": f"Обнаружено ссылок: {len(urls)}"
+                "message": f"Обнаружено ссылок: {len(urls)}",
+                "timed_out": timed_out
             }
 
         return {
             "has_urls": False,
             "urls": [],
             "url_count": 0,
-            "message": "Ссылки не обнаружены"
+            "message": "Ссылки не обнаружены",
+            "timed_out": timed_out
         }
\ No newline at end of file
@@ -0,0 +1,211 @@
+import re
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from app.dlp.morphology import fold
+
+
+# Слово - последовательность Unicode-букв и цифр, поэтому границы слов
+# корректны и для кириллицы (в отличие от ASCII-границ flashtext)
+_TOKEN_RE = re.compile(r"\w+")
+
+# Ключ конца ключевой фразы в узле префиксного дерева (пустой токен невозможен)
+_END = ""
+# Префикс ключа знаков препинания ключевой фразы ("e-mail", "c++", ".net")
+_SEP = "\x00"
+
+
+# Слово текста: приведённая форма и смещения
+Token = Tuple[str, int, int]
+
+
+class KeywordMatch(NamedTuple):
+    """
+    Найденное ключевое слово: исходное слово, найденная форма и смещения
+
+    first_token / last_token - номера первого и следующего за последним
+    слов фразы в тексте (для правил близости)
+    """
+    lemma: str
+    form: str
+    start: int
+    end: int
+    first_token: int = 0
+    last_token: int = 0
+
+
+def _punctuation(gap: str) -> str:
+    """Знаки между словами без пробелов"""
+    return "".join(gap.split())
+
+
+def _skip(text: str, position: int, count: int, step: int) -> int:
+    """Смещение после count непробельных символов от position (step = 1 вперёд, -1 назад)"""
+    while count:
+        if step < 0:
+            position -= 1
+        if not text[position].isspace():
+            count -= 1
+        if step > 0:
+            position += 1
+    return position
+
+
+def split_keyword(keyword: str) -> Tuple[List[str], List[str]]:
+    """
+    Разбиение ключевой фразы так же, как разбивается текст
+
+    Возвращает слова и знаки препинания вокруг них: перед первым словом,
+    между словами и после последнего (на один элемент больше, чем слов).
+    "c++" -> (["c"], ["", "++"]), "e-mail" -> (["e", "mail"], ["", "-", ""])
+    """
+    words, seps = [], []
+    position = 0
+    for m in _TOKEN_RE.finditer(keyword):
+        seps.append(fold(_punctuation(keyword[position:m.start()])))
+        words.append(fold(m.group()))
+        position = m.end()
+    seps.append(fold(_punctuation(keyword[position:])))
+    return words, seps
+
+
+class KeywordAutomaton:
+    """
+    Неизменяемый автомат поиска ключевых фраз
+
+    Префиксное дерево построено по словам ключевых фраз в начальной форме,
+    а формы каждого слова хранятся один раз в индексе {форма: слова}, поэтому
+    размер автомата - сумма, а не произведение числа форм слов фразы.
+    Поиск - один проход по словам текста без стемминга: форма слова текста
+    переводится индексом в слова фраз, по ним идёт переход в дереве.
+
+    Знаки препинания ключевой фразы - отдельные переходы дерева, они
+    сравниваются с символами между словами текста (без пробелов): "e-mail"
+    требует дефиса, а "e mail" совпадает с любыми знаками между словами.
+    Знаки перед первым словом и после последнего могут быть частью более
+    длинной последовательности знаков в тексте ("c++," совпадает с "c++").
+    """
+
+    def __init__(self, keywords: Iterable[str], word_forms: Callable[[str], Set[str]]):
+        root = {}
+        words_of: Dict[str, Set[str]] = {}
+        max_sep = 0
+        for keyword in keywords:
+            words, seps = split_keyword(keyword)
+            if not words:
+                continue
+            node = root
+            for word, sep in zip(words, seps):
+                if sep:
+                    node = node.setdefault(_SEP + sep, {})
+                    max_sep = max(max_sep, len(sep))
+                node = node.setdefault(word, {})
+                for form in word_forms(word):
+                    words_of.setdefault(form, set()).add(word)
+            if seps[-1]:
+                node = node.setdefault(_SEP + seps[-1], {})
+                max_sep = max(max_sep, len(seps[-1]))
+            node.setdefault(_END, keyword)
+
+        self._root = root
+        self._words = {form: tuple(sorted(words)) for form, words in words_of.items()}
+        self._max_sep = max_sep
+        self.size = len(self._words)
+
+    @staticmethod
+    def tokenize(text: str) -> List[Token]:
+        """Разбиение текста на слова"""
+        return [(fold(m.group()), m.start(), m.end()) for m in _TOKEN_RE.finditer(text)]
+
+    def _gap(self, text: str, tokens: List[Token], j: int) -> str:
+        """Знаки перед словом j (j == len(tokens) - после последнего слова)"""
+        if not self._max_sep:
+            return ""
+        start = tokens[j - 1][2] if j else 0
+        end = tokens[j][1] if j < len(tokens) else len(text)
+        return fold(_punctuation(text[start:end]))
+
+    def find(self, text: str, tokens: Optional[List[Token]] = None) -> List[KeywordMatch]:
+        """
+        Поиск всех ключевых фраз (самое длинное совпадение, без перекрытий)
+
+        tokens - уже разбитый на слова текст (см. tokenize), если он есть
+        """
+        root = self._root
+        if not root:
+            return []
+
+        if tokens is None:
+            tokens = self.tokenize(text)
+        matches = []
+
+        i = 0
+        count = len(tokens)
+        while i < count:
+            words = self._words.get(tokens[i][0])
+            if words is None:
+                i += 1
+                continue
+
+            # Фраза со знаками перед первым словом (".net")
+            starts = [(root, tokens[i][1])]
+            gap = self._gap(text, tokens, i)
+            for length in range(1, min(len(gap), self._max_sep) + 1):
+                node = root.get(_SEP + gap[-length:])
+                if node is not None:
+                    starts.append((node, _skip(text, tokens[i][1], length, -1)))
+
+            best = None
+            for node, start in starts:
+                found = self._walk(node, text, tokens, i, words)
+                if found is not None and (best is None or found[:2] > best[:2]):
+                    best = found + (start,)
+
+            if best is None:
+                i += 1
+                continue
+
+            last, end, lemma, start = best
+            matches.append(KeywordMatch(lemma, text[start:end], start, end, i, last))
+            i = last
+
+        return matches
+
+    def _walk(self, node: Dict, text: str, tokens: List[Token], i: int,
+              words: Tuple[str, ...]) -> Optional[Tuple[int, int, str]]:
+        """
+        Самая длинная фраза из узла node, начинающаяся словом i
+
+        Возвращает (номер слова после фразы, конец фразы в тексте, ключевое слово)
+        """
+        count = len(tokens)
+        nodes = [child for child in (node.get(word) for word in words) if child is not None]
+        longest = None
+        j = i + 1
+        while nodes:
+            word_end = tokens[j - 1][2]
+            gap = self._gap(text, tokens, j)
+            for current in nodes:
+                if _END in current and (longest is None or longest[0] < j):
+                    longest = (j, word_end, current[_END])
+                # Знаки после последнего слова фразы ("c++")
+                for length in range(min(len(gap), self._max_sep), 0, -1):
+                    tail = current.get(_SEP + gap[:length])
+                    if tail is not None and _END in tail:
+                        end = _skip(text, word_end, length, 1)
+                        if longest is None or longest[:2] < (j, end):
+                            longest = (j, end, tail[_END])
+                        break
+
+            if j >= count:
+                break
+            next_words = self._words.get(tokens[j][0])
+            if next_words is None:
+                break
+            # Фраза без знаков между словами допускает любые знаки в тексте
+            if gap:
+                nodes = [child for current in nodes for child in (current.get(_SEP + gap),)
+                         if child is not None] + nodes
+            nodes = [child for current in nodes for child in (current.get(word) for word in next_words)
+                     if child is not None]
+            j += 1
+
+        return longest
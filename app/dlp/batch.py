@@ -0,0 +1,156 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from app.dlp.analyzers.url_analyzer import URLAnalyzer
+from app.dlp.normalizer import fold, normalize
+from app.dlp.guard import ScanBudget, deadline_after
+from app.dlp.edm import edm_registry
+from app.dlp.policy import ExecutionPlan, compile_policy
+
+
+# Состояние процесса-воркера: собственная скомпилированная копия анализаторов
+_worker_plan: Optional[ExecutionPlan] = None
+_worker_url_analyzer: Optional[URLAnalyzer] = None
+
+
+def _init_worker(rules: List[Dict], version: int, budget: ScanBudget, edm_path: Optional[str]):
+    """Компиляция политики в процессе-воркере (один раз на процесс)"""
+    global _worker_plan, _worker_url_analyzer
+    if edm_path:
+        # Файл индекса отображается в память, страницы общие с родителем
+        edm_registry.load(edm_path)
+    _worker_plan = compile_policy(rules, version, budget=budget)
+    _worker_url_analyzer = URLAnalyzer()
+
+
+def evaluate_texts(plan: ExecutionPlan, url_analyzer: URLAnalyzer,
+                   texts: List[str]) -> List[Tuple[Dict, Dict]]:
+    """CPU-часть проверки: план политики и поиск URL для каждого текста"""
+    results = []
+    for text in texts:
+        normalized = normalize(text)
+        # Ссылки - без замены похожих букв: омоглиф в домене - это другой домен
+        url_result = url_analyzer.analyze(fold(text), deadline_after(plan.budget.budget_ms))
+        results.append((plan.execute(text, normalized=normalized), url_result))
+    return results
+
+
+def _evaluate_chunk(texts: List[str]) -> List[Tuple[Dict, Dict]]:
+    """Проверка пачки текстов в процессе-воркере"""
+    return evaluate_texts(_worker_plan, _worker_url_analyzer, texts)
+
+
+class BatchEvaluator:
+    """
+    Пакетная CPU-проверка текстов в пуле процессов
+
+    Тексты делятся на пачки по CHUNK_SIZE, каждая пачка проверяется
+    целиком в одном воркере, поэтому цикл событий не блокируется.
+    Небольшие пакеты проверяются в текущем процессе - передача между
+    процессами стоит дороже самой проверки. Пул пересоздаётся при смене
+    версии политики или перезагрузке индекса EDM.
+    """
+
+    CHUNK_SIZE = 64  # Текстов в одной задаче воркера
+    INLINE_MAX_CHARS = 20000  # Пакеты меньше этого размера проверяются без пула
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_version: Optional[Tuple[int, int]] = None
+
+    def _get_pool(self, plan: ExecutionPlan) -> ProcessPoolExecutor:
+        """Пул процессов, скомпилированный под версию плана и индекса EDM"""
+        version = (plan.version, edm_registry.version)
+        if self._pool is None or self._pool_version != version:
+            if self._pool is not None:
+                # Старый пул доделывает уже отправленные пачки и завершается сам
+                self._pool.shutdown(wait=False)
+            edm_index = edm_registry.index
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(list(plan.rules.values()), plan.version, plan.budget,
+                          edm_index.path if edm_index else None)
+            )
+            self._pool_version = version
+        return self._pool
+
+    async def evaluate(self, plan: ExecutionPlan, url_analyzer: URLAnalyzer,
+                       texts: List[str]) -> List[Tuple[Dict, Dict]]:
+        """Проверка текстов: [(результат плана, результат URLAnalyzer), ...]"""
+        if len(texts) < 2 or sum(len(text) for text in texts) < self.INLINE_MAX_CHARS:
+            return evaluate_texts(plan, url_analyzer, texts)
+
+        pool = self._get_pool(plan)
+        loop = asyncio.get_running_loop()
+        chunks = [texts[i:i + self.CHUNK_SIZE] for i in range(0, len(texts), self.CHUNK_SIZE)]
+
+        results = await asyncio.gather(*(
+            loop.run_in_executor(pool, _evaluate_chunk, chunk) for chunk in chunks
+        ))
+        return [item for chunk_result in results for item in chunk_result]
+
+    def shutdown(self):
+        """Остановить пул процессов"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._pool_version = None
+
+
+class MessageBatcher:
+    """
+    Объединение одновременных проверок в пакеты
+
+    Если проверок в работе нет, сообщение проверяется сразу. Пока идёт
+    проверка пакета, новые сообщения накапливаются и уходят следующим
+    пакетом через DLPEngine.check_messages - при всплеске нагрузки
+    проверки автоматически группируются без задержки в простое.
+    """
+
+    MAX_BATCH = 256
+
+    def __init__(self, engine, session_factory):
+        self.engine = engine
+        self.session_factory = session_factory
+        self._queue: List[Tuple[str, str, asyncio.Future]] = []
+        self._running = False
+
+    async def check(self, text: str, user: str) -> Dict:
+        """Проверить сообщение (в составе ближайшего пакета)"""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append((text, user, future))
+
+        if not self._running:
+            self._running = True
+            asyncio.create_task(self._drain())
+
+        return await future
+
+    async def _drain(self):
+        try:
+            while self._queue:
+                items = self._queue[:self.MAX_BATCH]
+                self._queue = self._queue[self.MAX_BATCH:]
+
+                try:
+                    async with self.session_factory() as db:
+                        results = await self.engine.check_messages(
+                            [text for text, _, _ in items],
+                            user=items[0][1] if len(items) == 1 else "batch",
+                            db_session=db
+                        )
+                except Exception as e:
+                    for _, _, future in items:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+
+                for (_, _, future), result in zip(items, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self._running = False
@@ -0,0 +1,281 @@
+import gzip
+import hashlib
+import math
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, Optional
+from app.dlp.analyzers.url_analyzer import canonicalize_url, split_url
+from app.dlp.edm import sorted_unique_hashes
+
+
+# Формат файла: заголовок (сигнатура, число доменов, размер фильтра Блума
+# в битах, число хэш-функций), затем биты фильтра и отсортированный массив
+# 64-битных хэшей доменов
+INDEX_MAGIC = b"DLPBLK1\0"
+HEADER_SIZE = len(INDEX_MAGIC) + 3 * 8
+
+# Фильтр Блума: 10 бит на домен и 7 хэш-функций - около 1% ложных срабатываний
+BLOOM_BITS_PER_ENTRY = 10
+BLOOM_HASHES = 7
+
+# Адреса, на которые hosts-файлы перенаправляют заблокированные домены
+_HOSTS_ADDRESSES = {"0.0.0.0", "127.0.0.1", "::", "::1"}
+_SKIP_DOMAINS = {"localhost", "localhost.localdomain", "local", "broadcasthost"}
+# Обычное ASCII-имя хоста - основная масса строк фидов, канонизация URL для него не нужна
+_PLAIN_HOST_RE = re.compile(r'[a-z0-9_\-]+(?:\.[a-z0-9_\-]+)*')
+
+
+def domain_hash(domain: str) -> int:
+    """64-битный хэш домена, записанного метками справа налево (com.example.www)"""
+    reversed_domain = ".".join(reversed(domain.split(".")))
+    return int.from_bytes(
+        hashlib.blake2b(reversed_domain.encode("utf-8"), digest_size=8).digest(),
+        "little"
+    )
+
+
+def parse_feed_line(line: str) -> Optional[str]:
+    """
+    Домен из строки фида угроз (None - комментарий или пустая строка)
+
+    Понимает списки доменов, hosts-файлы (0.0.0.0 domain), списки URL
+    и правила вида ||domain^. Домен приводится к каноническому виду
+    (нижний регистр, punycode), как хосты в URLAnalyzer.
+    """
+    line = line.strip()
+    if not line or line[0] in "#!;":
+        return None
+
+    tokens = line.split()
+    token = tokens[1] if len(tokens) > 1 and tokens[0] in _HOSTS_ADDRESSES else tokens[0]
+    if token.startswith("||"):
+        token = token[2:].split("^", 1)[0]
+    if token.startswith("*."):
+        token = token[2:]
+
+    token = token.lower().rstrip(".")
+    if _PLAIN_HOST_RE.fullmatch(token):
+        domain = token
+    else:
+        if "://" not in token:
+            token = "http://" + token
+        domain = split_url(canonicalize_url(token))[0].strip(".")
+    if not domain or domain in _SKIP_DOMAINS:
+        return None
+    return domain
+
+
+def iter_feeds(paths: Iterable[str]) -> Iterator[str]:
+    """Домены из файлов фидов (.gz читаются без распаковки на диск)"""
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                domain = parse_feed_line(line)
+                if domain:
+                    yield domain
+
+
+def _bloom_positions(key: int, bits: int, hashes: int) -> Iterator[int]:
+    """Позиции битов ключа (двойное хэширование по половинам 64-битного хэша)"""
+    h1 = key & 0xFFFFFFFF
+    h2 = (key >> 32) | 1
+    for i in range(hashes):
+        yield (h1 + i * h2) % bits
+
+
+def build_blocklist(domains: Iterable[str], path: str) -> int:
+    """
+    Построение файла блоклиста из доменов
+
+    Хэши сортируются внешней сортировкой (память не зависит от размера
+    фидов), затем по готовому массиву строится фильтр Блума. Файл
+    пишется рядом и атомарно заменяет старый. Возвращает число доменов.
+    """
+    fd, hashes_path = tempfile.mkstemp(suffix=".blkhashes")
+    try:
+        count = 0
+        with os.fdopen(fd, "wb") as f:
+            out = array("Q")
+            for key in sorted_unique_hashes(domain_hash(domain) for domain in domains):
+                out.append(key)
+                if len(out) >= 65536:
+                    out.tofile(f)
+                    count += len(out)
+                    out = array("Q")
+            out.tofile(f)
+            count += len(out)
+
+        # Размер фильтра кратен 64 битам, чтобы массив хэшей был выровнен
+        bits = max(64, -(-count * BLOOM_BITS_PER_ENTRY // 64) * 64)
+        bloom = bytearray(bits // 8)
+        with open(hashes_path, "rb") as f:
+            while True:
+                chunk = array("Q")
+                try:
+                    chunk.fromfile(f, 65536)
+                except EOFError:
+                    pass
+                if not chunk:
+                    break
+                for key in chunk:
+                    for position in _bloom_positions(key, bits, BLOOM_HASHES):
+                        bloom[position >> 3] |= 1 << (position & 7)
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(INDEX_MAGIC + count.to_bytes(8, "little") + bits.to_bytes(8, "little")
+                    + BLOOM_HASHES.to_bytes(8, "little"))
+            f.write(bloom)
+            with open(hashes_path, "rb") as hashes_file:
+                shutil.copyfileobj(hashes_file, f)
+
+        os.replace(tmp_path, path)
+        return count
+    finally:
+        os.remove(hashes_path)
+
+
+class BlocklistIndex:
+    """
+    Блоклист доменов из фидов угроз
+
+    Файл отображается в память: страницы общие для всех процессов и не
+    занимают кучу Python. Проверка хоста - это проверка его самого и всех
+    родительских доменов (домен из фида блокирует и поддомены): сначала
+    фильтром Блума (7 битов, без ложных пропусков), и только при его
+    срабатывании - двоичным поиском по отсортированному массиву хэшей.
+    Чистые ссылки почти всегда отсекаются фильтром.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"Файл {path} не является блоклистом доменов")
+
+        header = self._mmap[len(INDEX_MAGIC):HEADER_SIZE]
+        self.size = int.from_bytes(header[0:8], "little")
+        self.bloom_bits = int.from_bytes(header[8:16], "little")
+        self.bloom_hashes = int.from_bytes(header[16:24], "little")
+
+        bloom_end = HEADER_SIZE + self.bloom_bits // 8
+        self._bloom = memoryview(self._mmap)[HEADER_SIZE:bloom_end]
+        self._hashes = memoryview(self._mmap)[bloom_end:bloom_end + self.size * 8].cast("Q")
+        self.loaded_at = time.time()
+
+        self.lookups = 0
+        self.hits = 0
+        self.bloom_rejects = 0  # Проверки, отсечённые фильтром
+        self.bloom_false_positives = 0  # Фильтр пропустил, массив не подтвердил
+        self.lookup_seconds = 0.0
+
+    def _contains(self, domain: str) -> bool:
+        key = domain_hash(domain)
+        bloom = self._bloom
+        for position in _bloom_positions(key, self.bloom_bits, self.bloom_hashes):
+            if not bloom[position >> 3] & (1 << (position & 7)):
+                self.bloom_rejects += 1
+                return False
+
+        index = bisect_left(self._hashes, key)
+        if index < self.size and self._hashes[index] == key:
+            return True
+        self.bloom_false_positives += 1
+        return False
+
+    def match_host(self, host: str) -> Optional[str]:
+        """Домен из фида, под который попадает хост (сам хост или родительский), или None"""
+        started = time.perf_counter()
+        labels = host.strip(".").split(".")
+        # Домен верхнего уровня отдельно не проверяется
+        last = max(1, len(labels) - 1)
+        found = None
+        for i in range(last):
+            domain = ".".join(labels[i:])
+            if self._contains(domain):
+                found = domain
+                break
+
+        self.lookups += 1
+        if found:
+            self.hits += 1
+        self.lookup_seconds += time.perf_counter() - started
+        return found
+
+    def stats(self) -> Dict:
+        bloom_bytes = self.bloom_bits // 8
+        hashes_bytes = self.size * 8
+        fill = 1 - math.exp(-self.bloom_hashes * self.size / self.bloom_bits) if self.bloom_bits else 0.0
+        return {
+            "path": self.path,
+            "domains": self.size,
+            "memory_bytes": HEADER_SIZE + bloom_bytes + hashes_bytes,
+            "bloom_bytes": bloom_bytes,
+            "hashes_bytes": hashes_bytes,
+            "bloom_hashes": self.bloom_hashes,
+            "bloom_false_positive_rate": round(fill ** self.bloom_hashes, 5),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "bloom_rejects": self.bloom_rejects,
+            "bloom_false_positives": self.bloom_false_positives,
+            "avg_lookup_us": round(self.lookup_seconds / self.lookups * 1e6, 2) if self.lookups else None,
+            "loaded_at": self.loaded_at
+        }
+
+
+class BlocklistRegistry:
+    """
+    Текущий блоклист процесса
+
+    Перезагрузка - открытие нового файла и замена ссылки одним
+    присваиванием, проверки в работе дочитывают старый блоклист.
+    """
+
+    def __init__(self):
+        self.index: Optional[BlocklistIndex] = None
+        self.version = 0  # Растёт при каждой загрузке
+
+    def load(self, path: str) -> BlocklistIndex:
+        """Загрузить блоклист из файла. Бросает ValueError / OSError"""
+        index = BlocklistIndex(path)
+        self.index = index
+        self.version += 1
+        return index
+
+    def match_host(self, host: str) -> Optional[str]:
+        """Домен из фида для хоста (None, если не найден или блоклист не загружен)"""
+        index = self.index
+        return index.match_host(host) if index is not None else None
+
+    def stats(self) -> Dict:
+        index = self.index
+        if index is None:
+            return {"loaded": False, "version": self.version}
+        return {"loaded": True, "version": self.version, **index.stats()}
+
+
+# Глобальный блоклист процесса
+blocklist_registry = BlocklistRegistry()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Построение блоклиста доменов из фидов угроз")
+    parser.add_argument("feeds", nargs="+", help="Файлы фидов: домены, hosts-файлы, URL (.gz допускается)")
+    parser.add_argument("-o", "--output", required=True, help="Файл блоклиста")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    total = build_blocklist(iter_feeds(args.feeds), args.output)
+    print(f"✅ Блоклист построен: {total} доменов за {time.perf_counter() - started:.1f} с -> {args.output}")
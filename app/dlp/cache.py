@@ -0,0 +1,78 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для ключа кэша: пробельные символы схлопываются"""
+    return " ".join(text.split())
+
+
+class VerdictCache:
+    """
+    Ограниченный LRU-кэш результатов DLP проверки с временем жизни записей
+
+    Ключ - хэш нормализованного текста вместе с версией политики и версией
+    вердиктов URL. Смена любой версии делает старые записи недостижимыми,
+    а clear() сразу освобождает память.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[float, str, Dict]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def make_key(self, text: str, *versions) -> Tuple:
+        """Ключ записи: хэш нормализованного текста и версии"""
+        digest = hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).digest()
+        return (digest,) + versions
+
+    def get(self, key: Tuple, text: str) -> Optional[Dict]:
+        """Получить результат или None"""
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        stored_at, stored_text, result = entry
+        # Маскированный текст привязан к смещениям исходного текста
+        masked = "redacted_text" in result or "sanitized_text" in result
+        if time.monotonic() - stored_at > self.ttl or (masked and stored_text != text):
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(result)
+
+    def put(self, key: Tuple, text: str, result: Dict):
+        """Сохранить результат"""
+        self._entries[key] = (time.monotonic(), text, dict(result))
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Очистить кэш (при смене политики или вердиктов URL)"""
+        self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Счётчики для подбора размера кэша"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
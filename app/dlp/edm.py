@@ -0,0 +1,219 @@
+import hashlib
+import heapq
+import mmap
+import os
+import secrets
+import tempfile
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+
+# Формат файла индекса: заголовок (сигнатура, соль, число записей),
+# затем отсортированный массив 64-битных хэшей
+INDEX_MAGIC = b"DLPEDM1\0"
+SALT_SIZE = 16
+HEADER_SIZE = len(INDEX_MAGIC) + SALT_SIZE + 8
+
+# Хэшей в одной отсортированной серии при построении индекса
+BUILD_RUN_SIZE = 1_000_000
+
+
+def canonical_value(data_type: str, value: str) -> str:
+    """Приведение значения к каноническому виду перед хэшированием"""
+    if data_type == "email":
+        return value.strip().lower()
+    digits = "".join(c for c in value if c.isdigit())
+    if data_type == "phone":
+        # +7 (999) ... и 8 999 ... - один и тот же номер
+        return digits[-10:]
+    return digits
+
+
+def hash_value(salt: bytes, data_type: str, value: str) -> int:
+    """Хэш значения с солью индекса (тип входит в хэш, чтобы типы не пересекались)"""
+    digest = hashlib.blake2b(
+        f"{data_type}:{canonical_value(data_type, value)}".encode("utf-8"),
+        digest_size=8, key=salt
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+class EDMIndex:
+    """
+    Индекс точного совпадения с реестром реальных идентификаторов клиентов
+
+    Хранит только солёные хэши, а не сами значения. Файл отображается
+    в память (mmap), поиск - двоичный по отсортированному массиву, O(log n).
+    Страницы файла общие для всех процессов, поэтому воркеры пула
+    не копируют индекс.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._mmap[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"Файл {path} не является индексом EDM")
+
+        self.salt = bytes(self._mmap[len(INDEX_MAGIC):len(INDEX_MAGIC) + SALT_SIZE])
+        self.size = int.from_bytes(self._mmap[HEADER_SIZE - 8:HEADER_SIZE], "little")
+        self._hashes = memoryview(self._mmap)[HEADER_SIZE:HEADER_SIZE + self.size * 8].cast("Q")
+        self.loaded_at = time.time()
+
+    def contains(self, data_type: str, value: str) -> bool:
+        """Есть ли значение в реестре"""
+        key = hash_value(self.salt, data_type, value)
+        position = bisect_left(self._hashes, key)
+        return position < self.size and self._hashes[position] == key
+
+
+def _write_run(hashes: array) -> str:
+    """Запись отсортированной серии хэшей во временный файл"""
+    fd, path = tempfile.mkstemp(suffix=".edmrun")
+    with os.fdopen(fd, "wb") as f:
+        array("Q", sorted(hashes)).tofile(f)
+    return path
+
+
+def _read_run(path: str, block: int = 65536) -> Iterator[int]:
+    """Чтение серии блоками"""
+    with open(path, "rb") as f:
+        while True:
+            chunk = array("Q")
+            try:
+                chunk.fromfile(f, block)
+            except EOFError:
+                pass
+            if not chunk:
+                return
+            yield from chunk
+
+
+def sorted_unique_hashes(hashes: Iterable[int]) -> Iterator[int]:
+    """
+    Внешняя сортировка 64-битных хэшей без повторов
+
+    Хэши сортируются сериями по BUILD_RUN_SIZE во временных файлах
+    и сливаются, поэтому память не зависит от числа хэшей.
+    """
+    runs = []
+    run = array("Q")
+
+    try:
+        for key in hashes:
+            run.append(key)
+            if len(run) >= BUILD_RUN_SIZE:
+                runs.append(_write_run(run))
+                run = array("Q")
+        if run:
+            runs.append(_write_run(run))
+
+        previous = None
+        for key in heapq.merge(*(_read_run(path) for path in runs)):
+            if key != previous:
+                previous = key
+                yield key
+    finally:
+        for path in runs:
+            os.remove(path)
+
+
+def build_index(records: Iterable[Tuple[str, str]], path: str, salt: Optional[bytes] = None) -> int:
+    """
+    Построение файла индекса из пар (тип, значение)
+
+    Хэши сортируются сериями по BUILD_RUN_SIZE и сливаются, поэтому
+    память при построении не зависит от размера реестра. Файл сначала
+    пишется рядом и затем атомарно заменяет старый - работающие процессы
+    дочитывают старый индекс до перезагрузки. Возвращает число записей.
+    """
+    salt = salt or secrets.token_bytes(SALT_SIZE)
+    hashes = (hash_value(salt, data_type, value) for data_type, value in records)
+
+    tmp_path = f"{path}.tmp"
+    count = 0
+    with open(tmp_path, "wb") as f:
+        f.write(INDEX_MAGIC + salt + bytes(8))
+        out = array("Q")
+        for key in sorted_unique_hashes(hashes):
+            out.append(key)
+            if len(out) >= 65536:
+                out.tofile(f)
+                count += len(out)
+                out = array("Q")
+        out.tofile(f)
+        count += len(out)
+
+        f.seek(HEADER_SIZE - 8)
+        f.write(count.to_bytes(8, "little"))
+
+    os.replace(tmp_path, path)
+    return count
+
+
+class EDMRegistry:
+    """
+    Текущий индекс EDM процесса
+
+    Перезагрузка - открытие нового файла и замена ссылки одним
+    присваиванием, проверки в работе дочитывают старый индекс.
+    """
+
+    def __init__(self):
+        self.index: Optional[EDMIndex] = None
+        self.version = 0  # Растёт при каждой загрузке
+
+    def load(self, path: str) -> EDMIndex:
+        """Загрузить индекс из файла. Бросает ValueError / OSError"""
+        index = EDMIndex(path)
+        self.index = index
+        self.version += 1
+        return index
+
+    def contains(self, data_type: str, value: str) -> bool:
+        """Есть ли значение в реестре (False, если индекс не загружен)"""
+        index = self.index
+        return index is not None and index.contains(data_type, value)
+
+    def stats(self) -> Dict:
+        index = self.index
+        if index is None:
+            return {"loaded": False, "version": self.version}
+        return {
+            "loaded": True,
+            "version": self.version,
+            "path": index.path,
+            "records": index.size,
+            "loaded_at": index.loaded_at
+        }
+
+
+# Глобальный реестр процесса
+edm_registry = EDMRegistry()
+
+
+def _read_csv(path: str) -> Iterator[Tuple[str, str]]:
+    """Чтение реестра из CSV: тип,значение (например bank_card,4111111111111111)"""
+    import csv
+
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) >= 2 and row[0] and not row[0].startswith("#"):
+                yield row[0].strip(), row[1]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Построение индекса EDM из CSV (тип,значение)")
+    parser.add_argument("source", help="CSV файл реестра")
+    parser.add_argument("index", help="Файл индекса")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    total = build_index(_read_csv(args.source), args.index)
+    print(f"✅ Индекс EDM построен: {total} записей за {time.perf_counter() - started:.1f} с -> {args.index}")
@@ -1,111 +1,298 @@
 from app.dlp.analyzers.text_analyzer import TextAnalyzer
-from app.dlp.analyzers.sensitive_data_analyzer import SensitiveDataAnalyzer
 from app.dlp.analyzers.url_analyzer import URLAnalyzer
-from typing import Dict
+from app.dlp.policy import ExecutionPlan, compile_policy, DEFAULT_RULES
+from app.dlp.pipeline import AnalyzerPipeline, AnalyzerPlugin, CheckContext
+from app.dlp.plugins import PolicyPlugin, SecretsPlugin, FingerprintPlugin, URLPlugin
+from app.dlp.analyzers.secrets_analyzer import SecretsAnalyzer
+from app.dlp.cache import VerdictCache
+from app.dlp.batch import BatchEvaluator
+from app.dlp.shadow import ShadowEvaluator
+from app.dlp.url_verdicts import URLVerdictIndex
+from app.dlp.edm import edm_registry
+from app.dlp.blocklist import blocklist_registry
+from app.dlp.fingerprint import fingerprint_index
+from typing import Dict, List, Optional
+import time
 
 
 class DLPEngine:
     """Главный движок DLP системы"""
 
+    CACHE_SIZE = 10000  # Максимум результатов в кэше
+    CACHE_TTL_SECONDS = 300  # Время жизни результата (ограничивает устаревание между воркерами)
+    SECRETS_ACTION = "block"  # Действие при найденном секрете: block, moderate, redact, warn
+
     def __init__(self):
         self.text_analyzer = TextAnalyzer()
-        self.sensitive_data_analyzer = SensitiveDataAnalyzer()
         self.url_analyzer = URLAnalyzer()
+        self.cache = VerdictCache(self.CACHE_SIZE, self.CACHE_TTL_SECONDS)
+        # Растёт при каждом изменении вердикта по URL
+        self.url_verdict_version = 0
+        # Вердикты по проверенным URL (загружается при старте, см. main.lifespan)
+        self.url_verdicts = URLVerdictIndex(on_change=self.bump_url_verdict_version)
+        # Проверки, остановленные по лимиту времени анализа
+        self.scan_timeouts = 0
+        self.batch = BatchEvaluator()
+        # Кандидатная политика в теневом режиме (загружает PolicyService)
+        self.shadow = ShadowEvaluator()
+        self.load_plan(compile_policy(DEFAULT_RULES, 0, self.text_analyzer))
+
+        # Конвейер анализаторов
+        self.pipeline = AnalyzerPipeline()
+        self.register_plugin(PolicyPlugin())
+        self.register_plugin(SecretsPlugin(SecretsAnalyzer(), self.SECRETS_ACTION))
+        self.register_plugin(FingerprintPlugin(fingerprint_index))
+        self.register_plugin(URLPlugin(self))
+
+    def register_plugin(self, plugin: AnalyzerPlugin):
+        """Подключить анализатор к конвейеру"""
+        self.pipeline.register(plugin)
+
+    def load_plan(self, plan: ExecutionPlan):
+        """Атомарная замена скомпилированной политики"""
+        self.text_analyzer.swap(plan.keywords)
+        self.sensitive_data_analyzer = plan.sensitive_data_analyzer
+        self.plan = plan
+        self.cache.clear()
+
+    def load_edm(self, path: str) -> Dict:
+        """
+        Загрузка (перезагрузка) индекса EDM
+
+        Бросает OSError / ValueError, если файл не открылся - тогда
+        продолжает работать прежний индекс.
+        """
+        edm_registry.load(path)
+        # Вердикты зависят от содержимого реестра
+        self.cache.clear()
+        return edm_registry.stats()
+
+    def load_blocklist(self, path: str) -> Dict:
+        """
+        Загрузка (перезагрузка) блоклиста доменов из фидов угроз
 
-    async def check_message(self, text: str, user: str, db_session=None) -> Dict:
+        Бросает OSError / ValueError, если файл не открылся - тогда
+        продолжает работать прежний блоклист.
+        """
+        blocklist_registry.load(path)
+        # Вердикты по ссылкам зависят от содержимого блоклиста
+        self.bump_url_verdict_version()
+        return blocklist_registry.stats()
+
+    def bump_url_verdict_version(self):
+        """Вердикт по URL изменился - результаты со ссылками устарели"""
+        self.url_verdict_version += 1
+        self.cache.clear()
+
+    def update_url_verdict(self, url: str, status: str, created_at, check_id: int):
+        """
+        Вердикт проверки URL вынесен (модератор или VirusTotal) - применить к индексу
+
+        Если вердикт по URL изменился, индекс сам сбрасывает кэш результатов.
+        """
+        self.url_verdicts.update(url, status, created_at, check_id)
+
+    async def check_message(self, text: str, user: str, db_session=None, explain: bool = False) -> Dict:
         """
         Проверка сообщения через DLP
+
+        Плагины выполняются конвейером по возрастанию стоимости, проверка
+        ссылок в БД идёт параллельно с остальными стадиями, а блокировка
+        останавливает конвейер (см. AnalyzerPipeline).
+
+        Повторные сообщения отдаются из кэша, пока не изменились политика
+        и вердикты по URL.
+
+        explain=True - проверка в обход кэша с объяснением в result["explain"]:
+        время каждого плагина и стадии плана, число кандидатов, совпадения
+        со смещениями, запросы к БД и решающее правило.
+        """
+        plan = self.plan
+        if explain:
+            return await self._explain(text, user, db_session, plan)
+
+        # Теневая проверка только ставится в очередь - вердикт её не ждёт
+        self.shadow.submit(text, plan)
+
+        cache_key = self.cache.make_key(text, plan.version, self.url_verdict_version, db_session is not None)
+        cached = self.cache.get(cache_key, text)
+        if cached is not None:
+            return cached
+
+        result = await self._check(text, user, db_session, plan)
+        self.cache.put(cache_key, text, result)
+        return result
+
+    async def check_messages(self, texts: List[str], user: str = "batch", db_session=None) -> List[Dict]:
+        """
+        Пакетная проверка сообщений
+
+        CPU-часть (ключевые слова, персональные данные, контрольные суммы,
+        поиск URL) выполняется пачками в пуле процессов, вердикты по всем
+        ссылкам пакета загружаются одним запросом. Результаты совпадают
+        с check_message для каждого текста.
+        """
+        plan = self.plan
+        url_version = self.url_verdict_version
+        results: List[Optional[Dict]] = [None] * len(texts)
+        keys = [self.cache.make_key(text, plan.version, url_version, db_session is not None) for text in texts]
+
+        missing = []
+        for i, (text, key) in enumerate(zip(texts, keys)):
+            self.shadow.submit(text, plan)
+            results[i] = self.cache.get(key, text)
+            if results[i] is None:
+                missing.append(i)
+
+        if not missing:
+            return results
+
+        evaluated = await self.evaluate_messages([texts[i] for i in missing], plan, user, db_session)
+        for i, result in zip(missing, evaluated):
+            results[i] = result
+            self.cache.put(keys[i], texts[i], result)
+
+        return results
+
+    async def evaluate_messages(self, texts: List[str], plan: ExecutionPlan, user: str = "batch",
+                                db_session=None, evaluator: Optional[BatchEvaluator] = None) -> List[Dict]:
         """
-        # 1. Проверяем на запрещённые слова (блокируем всегда)
-        keyword_result = self.text_analyzer.analyze(text)
-
-        if keyword_result["status"] == "block":
-            return {
-                "allowed": False,
-                "status": "block",
-                "reason": keyword_result["message"],
-                "found_keywords": keyword_result.get("found_keywords", []),
-                "sensitive_data": None,
-                "urls": None,
-                "register_violation": False
-            }
-
-        # 2. Проверяем на наличие URL (БЛОКИРУЕМ до модерации)
-        url_result = self.url_analyzer.analyze(text)
-
-        if url_result["has_urls"]:
-            # Проверяем, есть ли URL в белом/черном списке
-            if db_session:
-                url_status = await self._check_urls_in_database(url_result["urls"], db_session)
-
-                # Если все URL в белом списке - разрешаем
-                if url_status["all_safe"]:
-                    # Продолжаем проверку дальше
-                    pass
-                # Если хотя бы один URL в черном списке - блокируем
-                elif url_status["has_malicious"]:
-                    return {
-                        "allowed": False,
-                        "status": "block",
-                        "reason": "❌ Обнаружены заблокированные ссылки",
-                        "found_keywords": [],
-                        "sensitive_data": None,
-                        "urls": url_result,
-                        "register_violation": False
-                    }
-                # Если есть неизвестные URL - блокируем и отправляем на модерацию
-                elif url_status["has_unknown"]:
-                    return {
-                        "allowed": False,
-                        "status": "url_moderation_required",
-                        "reason": "🔗 Сообщение отправлено на модерацию (содержит ссылки)",
-                        "found_keywords": [],
-                        "sensitive_data": None,
-                        "urls": url_result,
-                        "register_violation": False
-                    }
-            else:
-                # Если нет доступа к БД - блокируем по умолчанию
-                return {
-                    "allowed": False,
-                    "status": "url_moderation_required",
-                    "reason": "🔗 Сообщение отправлено на модерацию (содержит ссылки)",
-                    "found_keywords": [],
-                    "sensitive_data": None,
-                    "urls": url_result,
-                    "register_violation": False
+        Пакетная проверка сообщений заданным планом в обход кэша
+
+        evaluator - свой пул процессов (по умолчанию общий пул движка):
+        фоновые задачи не должны занимать воркеры живого трафика.
+        """
+        evaluated = await (evaluator or self.batch).evaluate(plan, self.url_analyzer, texts)
+
+        url_verdicts = None
+        if db_session:
+            urls = {url for _, url_result in evaluated for url in url_result["urls"]}
+            url_verdicts = await self._load_url_verdicts(urls, db_session) if urls else {}
+
+        results = []
+        for text, (verdict, url_result) in zip(texts, evaluated):
+            context = CheckContext(text, user, db_session, plan)
+            context.verdict = verdict
+            context.urls = url_result
+            context.url_verdicts = url_verdicts
+            results.append(await self._run_pipeline(context))
+
+        return results
+
+    async def _check(self, text: str, user: str, db_session, plan: ExecutionPlan) -> Dict:
+        """Проверка сообщения конвейером плагинов"""
+        return await self._run_pipeline(CheckContext(text, user, db_session, plan))
+
+    async def _explain(self, text: str, user: str, db_session, plan: ExecutionPlan) -> Dict:
+        """Проверка с замерами стадий (режим объяснения)"""
+        context = CheckContext(text, user, db_session, plan)
+        context.explain = {"plugins": [], "stages": [], "db_lookups": []}
+
+        started = time.perf_counter()
+        result = await self._run_pipeline(context)
+        total_ms = round((time.perf_counter() - started) * 1000, 3)
+
+        verdict = context.verdict or {}
+        result["explain"] = {
+            "total_ms": total_ms,
+            "policy_version": plan.version,
+            "cache": "bypassed",
+            "decided_by": {
+                "plugin": result.get("plugin"),
+                "rule": result["rule"] if result.get("plugin") == "policy" else None,
+                "status": result["status"]
+            },
+            "matched_rules": [
+                {
+                    "id": rule_id,
+                    "action": plan.rules[rule_id]["action"],
+                    "severity": plan.rules[rule_id]["severity"]
                 }
+                for rule_id in verdict.get("rules", [])
+            ],
+            "matches": verdict.get("spans", []),
+            "urls": context.urls["urls"] if context.urls else [],
+            **context.explain
+        }
+        return result
 
-        # 3. Проверяем на конфиденциальные данные
-        sensitive_result = self.sensitive_data_analyzer.analyze(text)
-
-        if sensitive_result["has_sensitive_data"]:
-            # РАЗРЕШАЕМ отправку, но регистрируем нарушение
-            return {
-                "allowed": True,
-                "status": "warning",
-                "reason": f"⚠️ {sensitive_result['message']}",
-                "found_keywords": [],
-                "sensitive_data": sensitive_result,
-                "urls": None,
-                "register_violation": True
-            }
+    async def _run_pipeline(self, context: CheckContext) -> Dict:
+        """Выполнение конвейера и формирование результата"""
+        finding = await self.pipeline.run(context)
+
+        if any(stage and stage.get("timed_out") for stage in (context.verdict, context.urls, context.secrets)):
+            self.scan_timeouts += 1
+            print(f"⏱️ DLP: превышено время анализа сообщения от {context.user} "
+                  f"({len(context.text)} символов), всего: {self.scan_timeouts}")
+
+        if finding is None:
+            result = self._result(True, "allow", "Сообщение разрешено", context.verdict)
+            self._add_sanitized_text(result, context)
+            return result
+
+        result = self._result(
+            finding["allowed"],
+            finding["status"],
+            finding["reason"],
+            finding.get("verdict"),
+            urls=finding.get("urls"),
+            register_violation=finding["register_violation"]
+        )
+        if "redacted_text" in finding:
+            result["redacted_text"] = finding["redacted_text"]
+        if "fingerprint" in finding:
+            result["fingerprint"] = finding["fingerprint"]
+        if "secrets" in finding:
+            result["secrets"] = finding["secrets"]
+        result["plugin"] = finding["plugin"]
+        self._add_sanitized_text(result, context)
+        return result
+
+    def _add_sanitized_text(self, result: Dict, context: CheckContext):
+        """Текст с замаскированными персональными данными и секретами - для записи в журналы"""
+        spans = []
+        verdict = context.verdict
+        if verdict and verdict["sensitive_result"]["has_sensitive_data"]:
+            spans.extend(verdict["spans"])
+        if context.secrets and context.secrets["has_secrets"]:
+            # value секрета уже замаскировано - маска плана оставляет его как есть
+            spans.extend(context.secrets["found_secrets"])
+        if spans:
+            result["sanitized_text"] = context.plan.sanitize(context.text, spans)
+
+    def _result(self, allowed: bool, status: str, reason: str, verdict: Optional[Dict] = None,
+                urls: Optional[Dict] = None, register_violation: bool = False) -> Dict:
+        """Формирование результата проверки"""
+        found_keywords = []
+        sensitive_data = None
+
+        if verdict:
+            found_keywords = verdict["keyword_result"]["found_keywords"]
+            if verdict["sensitive_result"]["has_sensitive_data"]:
+                sensitive_data = verdict["sensitive_result"]
 
         return {
-            "allowed": True,
-            "status": "allow",
-            "reason": "Сообщение разрешено",
-            "found_keywords": [],
-            "sensitive_data": None,
-            "urls": None,
-            "register_violation": False
+            "allowed": allowed,
+            "status": status,
+            "reason": reason,
+            "found_keywords": found_keywords,
+            "sensitive_data": sensitive_data,
+            "urls": urls,
+            "register_violation": register_violation,
+            "rule": verdict["rule"] if verdict else None,
+            "policy_version": verdict["version"] if verdict else self.plan.version
         }
 
     async def _check_urls_in_database(self, urls: list, db_session) -> dict:
-        """Проверка URL в базе белых/черных списков"""
-        from sqlalchemy import select
-        from app.models.url_check import URLCheck
+        """Проверка URL по белым/черным спискам (индекс вердиктов, промахи - одним запросом)"""
+        return self._url_status(urls, await self.url_verdicts.resolve(urls, db_session))
+
+    async def _load_url_verdicts(self, urls, db_session) -> Dict[str, str]:
+        """Последние вердикты по набору URL (индекс вердиктов, промахи - одним запросом)"""
+        return await self.url_verdicts.resolve(urls, db_session)
 
+    def _url_status(self, urls: list, verdicts: Dict[str, str]) -> dict:
+        """Сводка по URL сообщения на основе загруженных вердиктов"""
         result = {
             "all_safe": True,
             "has_malicious": False,
@@ -113,24 +300,11 @@ class DLPEngine:
         }
 
         for url in urls:
-            # Ищем URL в базе
-            db_result = await db_session.execute(
-                select(URLCheck)
-                .where(URLCheck.url == url)
-                .where(URLCheck.is_reviewed == True)
-                .order_by(URLCheck.created_at.desc())
-            )
-            url_check = db_result.scalar_one_or_none()
-
-            if url_check:
-                if url_check.status == "malicious":
-                    result["has_malicious"] = True
-                    result["all_safe"] = False
-                elif url_check.status != "safe":
-                    result["all_safe"] = False
-                    result["has_unknown"] = True
-            else:
-                # URL не найден в базе - неизвестный
+            url_status = verdicts.get(url)
+            if url_status == "malicious":
+                result["has_malicious"] = True
+                result["all_safe"] = False
+            elif url_status != "safe":
                 result["all_safe"] = False
                 result["has_unknown"] = True
 
@@ -138,4 +312,4 @@ class DLPEngine:
 
 
 # Создаём глобальный экземпляр DLP движка
-dlp_engine = DLPEngine()
\ No newline at end of file
+dlp_engine = DLPEngine()
@@ -0,0 +1,278 @@
+import hashlib
+import re
+from array import array
+from typing import IO, Dict, List, Optional, Set, Tuple, Union
+from app.dlp.normalizer import normalize
+
+
+# Шингл - последовательность из SHINGLE_WORDS слов
+SHINGLE_WORDS = 5
+# Документ нарезается на фрагменты по CHUNK_WORDS слов с шагом CHUNK_STEP,
+# чтобы вставленный абзац сравнивался с фрагментом, а не со всем документом
+CHUNK_WORDS = 50
+CHUNK_STEP = 25
+# Сообщения короче не проверяются: короткие фразы слишком общие
+MIN_WORDS = 12
+
+# Сигнатура: NUM_BINS минимумов, индекс LSH - BANDS полос по ROWS значений.
+# Две строки в полосе дают кандидата уже при сходстве ~0.3, кандидаты
+# затем проверяются по полной сигнатуре
+NUM_BINS = 64
+ROWS = 2
+BANDS = NUM_BINS // ROWS
+# Доля шинглов сообщения, найденных во фрагменте документа, для срабатывания
+MATCH_CONTAINMENT = 0.5
+
+_BIN_BITS = 6  # log2(NUM_BINS)
+_VALUE_BITS = 52
+_VALUE_MASK = (1 << _VALUE_BITS) - 1
+
+_WORD_RE = re.compile(r"\w+")
+
+Signature = Tuple[int, ...]
+ChunkKey = Tuple[int, int]  # (id документа, номер фрагмента)
+
+
+def extract_docx(source: Union[str, IO[bytes]]) -> Tuple[List[Dict], List[List[List[str]]]]:
+    """
+    Текст Word документа (путь или файловый объект): абзацы и таблицы
+
+    Возвращает ([{"text", "style"}, ...], [[[ячейка, ...], ...], ...]).
+    Пустые абзацы пропускаются.
+    """
+    from docx import Document
+
+    doc = Document(source)
+
+    paragraphs = []
+    for para in doc.paragraphs:
+        if para.text.strip():
+            paragraphs.append({
+                "text": para.text,
+                "style": para.style.name if para.style else "Normal"
+            })
+
+    tables = []
+    for table in doc.tables:
+        tables.append([[cell.text for cell in row.cells] for row in table.rows])
+
+    return paragraphs, tables
+
+
+def docx_text(source: Union[str, IO[bytes]]) -> str:
+    """Весь текст Word документа одной строкой (абзацы, затем таблицы)"""
+    paragraphs, tables = extract_docx(source)
+    lines = [para["text"] for para in paragraphs]
+    for table in tables:
+        lines.extend(" ".join(row) for row in table)
+    return "\n".join(lines)
+
+
+def words(text: str) -> List[str]:
+    """Слова нормализованного текста в нижнем регистре (ё = е)"""
+    return _WORD_RE.findall(normalize(text).text.lower().replace("ё", "е"))
+
+
+def _shingle_hashes(tokens: List[str]) -> Set[int]:
+    """64-битные хэши шинглов (стабильны между процессами и перезапусками)"""
+    if len(tokens) < SHINGLE_WORDS:
+        tokens = tokens + [""] * (SHINGLE_WORDS - len(tokens))
+    return {
+        int.from_bytes(
+            hashlib.blake2b(" ".join(tokens[i:i + SHINGLE_WORDS]).encode("utf-8"), digest_size=8).digest(),
+            "little"
+        )
+        for i in range(len(tokens) - SHINGLE_WORDS + 1)
+    }
+
+
+def signature(hashes: Set[int]) -> Signature:
+    """
+    Сигнатура MinHash за один проход по шинглам
+
+    Вместо NUM_BINS независимых перестановок (NUM_BINS хэшей на шингл)
+    шингл по младшим битам хэша попадает в одну корзину, и в корзине
+    хранится минимум (one permutation hashing). Пустые корзины берут
+    значение ближайшей непустой справа со сдвигом на расстояние
+    (densification), чтобы у коротких текстов сигнатура была полной.
+    Вероятность совпадения значений в позиции - сходство Жаккара.
+    """
+    empty = 1 << 64
+    bins = [empty] * NUM_BINS
+    for h in hashes:
+        b = h & (NUM_BINS - 1)
+        value = (h >> _BIN_BITS) & _VALUE_MASK
+        if value < bins[b]:
+            bins[b] = value
+
+    if empty in bins:
+        for i in range(NUM_BINS):
+            if bins[i] != empty:
+                continue
+            for distance in range(1, NUM_BINS):
+                value = bins[(i + distance) % NUM_BINS]
+                if value != empty and value <= _VALUE_MASK:
+                    bins[i] = value | (distance << _VALUE_BITS)
+                    break
+
+    return tuple(bins)
+
+
+def similarity(first: Signature, second: Signature) -> float:
+    """Оценка сходства Жаккара по сигнатурам"""
+    return sum(a == b for a, b in zip(first, second)) / NUM_BINS
+
+
+def _windows(tokens: List[str]) -> List[List[str]]:
+    """Фрагменты по CHUNK_WORDS слов с шагом CHUNK_STEP (последний - до конца текста)"""
+    if len(tokens) <= CHUNK_WORDS:
+        return [tokens]
+    windows = [tokens[i:i + CHUNK_WORDS] for i in range(0, len(tokens) - CHUNK_WORDS + 1, CHUNK_STEP)]
+    if (len(tokens) - CHUNK_WORDS) % CHUNK_STEP:
+        windows.append(tokens[-CHUNK_WORDS:])
+    return windows
+
+
+def fingerprint_text(text: str) -> List[Tuple[int, Signature]]:
+    """Отпечаток текста: (число шинглов, сигнатура) для каждого фрагмента"""
+    result = []
+    for window in _windows(words(text)):
+        hashes = _shingle_hashes(window)
+        result.append((len(hashes), signature(hashes)))
+    return result
+
+
+def pack_fingerprint(chunks: List[Tuple[int, Signature]]) -> bytes:
+    """Отпечаток в байты для хранения в БД"""
+    values = array("Q")
+    for count, chunk_signature in chunks:
+        values.append(count)
+        values.extend(chunk_signature)
+    return values.tobytes()
+
+
+def unpack_fingerprint(data: bytes) -> List[Tuple[int, Signature]]:
+    """Отпечаток из байтов БД"""
+    values = array("Q")
+    values.frombytes(data)
+    step = NUM_BINS + 1
+    return [
+        (values[i], tuple(values[i + 1:i + step]))
+        for i in range(0, len(values), step)
+    ]
+
+
+class FingerprintIndex:
+    """
+    Индекс LSH отпечатков конфиденциальных документов
+
+    Сигнатура фрагмента разбита на BANDS полос, в каждой полосе словарь
+    "значения полосы -> фрагменты". Фрагменты, совпавшие с запросом хотя бы
+    в одной полосе, - кандидаты, они проверяются по полной сигнатуре.
+    Поиск не зависит от числа документов, добавление и удаление документа
+    меняют только его записи - индекс не перестраивается.
+    """
+
+    def __init__(self):
+        self._bands: List[Dict[Signature, Set[ChunkKey]]] = [{} for _ in range(BANDS)]
+        self._chunks: Dict[ChunkKey, Tuple[int, Signature]] = {}
+        self._documents: Dict[int, Dict] = {}
+
+    def __contains__(self, document_id: int) -> bool:
+        return document_id in self._documents
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    @property
+    def document_ids(self) -> Set[int]:
+        return set(self._documents)
+
+    def add(self, document_id: int, name: str, chunks: List[Tuple[int, Signature]]):
+        """Добавить документ (документ с тем же id заменяется)"""
+        self.remove(document_id)
+        for number, (count, chunk_signature) in enumerate(chunks):
+            key = (document_id, number)
+            self._chunks[key] = (count, chunk_signature)
+            for band in range(BANDS):
+                band_key = chunk_signature[band * ROWS:(band + 1) * ROWS]
+                self._bands[band].setdefault(band_key, set()).add(key)
+        self._documents[document_id] = {"name": name, "chunks": len(chunks)}
+
+    def remove(self, document_id: int) -> bool:
+        """Удалить документ. Возвращает False, если его не было"""
+        document = self._documents.pop(document_id, None)
+        if document is None:
+            return False
+        for number in range(document["chunks"]):
+            key = (document_id, number)
+            _, chunk_signature = self._chunks.pop(key)
+            for band in range(BANDS):
+                band_key = chunk_signature[band * ROWS:(band + 1) * ROWS]
+                bucket = self._bands[band].get(band_key)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._bands[band][band_key]
+        return True
+
+    def query(self, count: int, query_signature: Signature) -> Optional[Dict]:
+        """
+        Фрагмент документа, содержащий текст с данной сигнатурой
+
+        Сравнивается доля шинглов запроса, найденных во фрагменте
+        (|A∩B| / |A|, выводится из оценки Жаккара и размеров), - так
+        абзац, вставленный в сообщение целиком, находится и в большом
+        фрагменте. Возвращает лучшее совпадение не ниже MATCH_CONTAINMENT.
+        """
+        candidates: Set[ChunkKey] = set()
+        for band in range(BANDS):
+            bucket = self._bands[band].get(query_signature[band * ROWS:(band + 1) * ROWS])
+            if bucket:
+                candidates.update(bucket)
+
+        best = None
+        for key in candidates:
+            chunk = self._chunks.get(key)
+            document = self._documents.get(key[0])
+            if chunk is None or document is None:
+                continue  # Документ удалён во время поиска
+            jaccard = similarity(query_signature, chunk[1])
+            containment = min(1.0, jaccard * (count + chunk[0]) / ((1 + jaccard) * count))
+            if containment >= MATCH_CONTAINMENT and (best is None or containment > best["containment"]):
+                best = {
+                    "document_id": key[0],
+                    "name": document["name"],
+                    "chunk": key[1],
+                    "similarity": round(jaccard, 3),
+                    "containment": round(containment, 3)
+                }
+        return best
+
+    def match_text(self, text: str) -> Optional[Dict]:
+        """Лучшее совпадение фрагмента текста с зарегистрированными документами"""
+        if not self._documents:
+            return None
+
+        tokens = words(text)
+        if len(tokens) < MIN_WORDS:
+            return None
+
+        best = None
+        for window in _windows(tokens):
+            hashes = _shingle_hashes(window)
+            match = self.query(len(hashes), signature(hashes))
+            if match and (best is None or match["containment"] > best["containment"]):
+                best = match
+        return best
+
+    def stats(self) -> Dict:
+        return {
+            "documents": len(self._documents),
+            "chunks": len(self._chunks),
+            "buckets": sum(len(band) for band in self._bands)
+        }
+
+
+# Глобальный индекс процесса
+fingerprint_index = FingerprintIndex()
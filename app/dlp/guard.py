@@ -0,0 +1,183 @@
+import re
+import time
+from typing import Iterator, List, NamedTuple, Optional
+
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:  # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+
+# Размер окна сканирования и перекрытие окон: совпадение длиннее
+# перекрытия на границе окна обрезается
+CHUNK_SIZE = 4096
+CHUNK_OVERLAP = 256
+
+
+class ScanBudget(NamedTuple):
+    """Лимит времени анализа одного сообщения и реакция на его превышение"""
+    budget_ms: float
+    fail_closed: bool  # True - блокировать сообщение, False - пропустить непроверенную часть
+
+
+DEFAULT_BUDGET = ScanBudget(50.0, True)
+
+
+class ScanTimeout(Exception):
+    """Время анализа сообщения исчерпано"""
+
+    def __init__(self, matches: List):
+        super().__init__("Превышено время анализа сообщения")
+        self.matches = matches  # Совпадения, найденные до остановки
+
+
+def deadline_after(budget_ms: float) -> float:
+    """Момент (perf_counter), после которого анализ прекращается"""
+    return time.perf_counter() + budget_ms / 1000
+
+
+def finditer(pattern: re.Pattern, text: str, deadline: Optional[float] = None) -> Iterator[re.Match]:
+    """
+    Поиск совпадений окнами по CHUNK_SIZE символов
+
+    Время одного вызова регулярного выражения ограничено размером окна,
+    поэтому даже квадратичный паттерн на длинном тексте работает линейно
+    по числу окон, а между окнами проверяется лимит времени. Просмотр
+    назад и \\b видят символы перед окном, совпадение, начавшееся в окне,
+    может продолжаться в перекрытии.
+    """
+    length = len(text)
+    if length <= CHUNK_SIZE:
+        yield from pattern.finditer(text)
+        return
+
+    position = 0
+    while position < length:
+        if deadline is not None and time.perf_counter() > deadline:
+            raise ScanTimeout([])
+
+        window_end = min(position + CHUNK_SIZE, length)
+        next_position = window_end
+        for match in pattern.finditer(text, position, min(window_end + CHUNK_OVERLAP, length)):
+            if match.start() >= window_end:
+                break
+            yield match
+            next_position = max(next_position, match.end())
+        position = next_position
+
+
+# Проверка паттернов при загрузке политики
+
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+# Притяжательные квантификаторы и атомарные группы (Python 3.11+) не откатываются
+_NON_BACKTRACKING = {
+    getattr(sre_constants, name) for name in ("POSSESSIVE_REPEAT", "ATOMIC_GROUP")
+    if hasattr(sre_constants, name)
+}
+
+# Повторение с верхней границей больше этой считается неограниченным
+_UNBOUNDED_REPEAT = 32
+
+
+def _first_chars(subpattern) -> Optional[List[tuple]]:
+    """
+    Диапазоны символов, с которых может начаться совпадение
+
+    None - любой символ (класс \\w, точка, пустое совпадение и т.п.)
+    """
+    for op, av in subpattern:
+        if op == sre_constants.LITERAL:
+            return [(av, av)]
+        if op == sre_constants.IN:
+            ranges = []
+            for item_op, item_av in av:
+                if item_op == sre_constants.LITERAL:
+                    ranges.append((item_av, item_av))
+                elif item_op == sre_constants.RANGE:
+                    ranges.append(item_av)
+                else:
+                    # Отрицание и категории (\d, \w) - считаем любым символом
+                    return None
+            return ranges
+        if op == sre_constants.SUBPATTERN:
+            return _first_chars(av[-1])
+        if op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            continue
+        return None
+    return None
+
+
+def _overlap(first: Optional[List[tuple]], second: Optional[List[tuple]]) -> bool:
+    """Могут ли две альтернативы начаться с одного символа"""
+    if first is None or second is None:
+        return True
+    return any(a_lo <= b_hi and b_lo <= a_hi for a_lo, a_hi in first for b_lo, b_hi in second)
+
+
+def _walk(subpattern, inside_repeat: bool, problems: List[str]):
+    for op, av in subpattern:
+        if op in _REPEATS:
+            low, high, item = av
+            unbounded = high == sre_constants.MAXREPEAT or high > _UNBOUNDED_REPEAT
+            if unbounded and inside_repeat:
+                problems.append("вложенные квантификаторы, например (a+)+")
+            _walk(item, inside_repeat or unbounded, problems)
+        elif op in _NON_BACKTRACKING:
+            continue
+        elif op == sre_constants.SUBPATTERN:
+            _walk(av[-1], inside_repeat, problems)
+        elif op == sre_constants.BRANCH:
+            branches = av[1]
+            if inside_repeat:
+                firsts = [_first_chars(branch) for branch in branches]
+                for i in range(len(firsts)):
+                    if any(_overlap(firsts[i], firsts[j]) for j in range(i + 1, len(firsts))):
+                        problems.append("пересекающиеся альтернативы под квантификатором, например (a|ab)+")
+                        break
+            for branch in branches:
+                _walk(branch, inside_repeat, problems)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            _walk(av[1], inside_repeat, problems)
+
+
+def _has_backreference(subpattern) -> bool:
+    for op, av in subpattern:
+        if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            return True
+        items = av if isinstance(av, (list, tuple)) else [av]
+        for item in items:
+            if isinstance(item, sre_parse.SubPattern) and _has_backreference(item):
+                return True
+    return False
+
+
+def lint_embedding(pattern: str) -> List[str]:
+    """
+    Конструкции, ломающие паттерн внутри общего сканера (см. PatternScanner)
+
+    В общем выражении номера групп сдвигаются, а имена групп разных
+    паттернов могут совпасть, поэтому обратные ссылки (\\1, (?P=name),
+    (?(1)...)) и собственные именованные группы запрещены.
+    """
+    problems = []
+    parsed = sre_parse.parse(pattern)
+    if parsed.state.groupdict:
+        problems.append("именованные группы (?P<...>) не поддерживаются, используйте (?:...)")
+    if _has_backreference(parsed):
+        problems.append("обратные ссылки на группы (\\1, (?P=...)) не поддерживаются")
+    return problems
+
+
+def lint_pattern(pattern: str) -> List[str]:
+    """
+    Поиск конструкций с катастрофическим откатом
+
+    Возвращает список проблем (пустой - паттерн безопасен). Проверяются
+    вложенные неограниченные квантификаторы и пересекающиеся альтернативы
+    внутри неограниченного повторения.
+    """
+    problems: List[str] = []
+    _walk(sre_parse.parse(pattern), False, problems)
+    return list(dict.fromkeys(problems))
@@ -0,0 +1,93 @@
+from typing import Set
+
+try:
+    import pymorphy3
+except ImportError:  # pragma: no cover - необязательная зависимость
+    pymorphy3 = None
+
+
+_CYRILLIC = set("абвгдеёжзийклмнопрстуфхцчшщъыьэюя")
+
+# Окончания прилагательных (твёрдый и мягкий варианты, все падежи и числа)
+_ADJECTIVE_ENDINGS = (
+    "ый", "ий", "ой", "ая", "яя", "ое", "ее", "ые", "ие",
+    "ого", "его", "ому", "ему", "ым", "им", "ом", "ем",
+    "ую", "юю", "ей", "ых", "их", "ыми", "ими", "ою", "ею",
+)
+
+_ADJECTIVE_LEMMA_ENDINGS = ("ый", "ий", "ой", "ая", "яя", "ое", "ее")
+
+# Окончания существительных по конечной букве начальной формы
+_NOUN_ENDINGS = {
+    "а": ("а", "ы", "и", "е", "у", "ой", "ою", "ей", "ам", "ами", "ах", ""),
+    "я": ("я", "и", "е", "ю", "ей", "ею", "ям", "ями", "ях", "ь", "й"),
+    "о": ("о", "а", "у", "ом", "е", "ы", "ам", "ами", "ах", ""),
+    "е": ("е", "я", "ю", "ем", "и", "ей", "ям", "ями", "ях"),
+    "ь": ("ь", "я", "ю", "ем", "ём", "е", "и", "ей", "ям", "ями", "ях", "ью"),
+    "й": ("й", "я", "ю", "ем", "е", "и", "ев", "ям", "ями", "ях"),
+}
+_CONSONANT_ENDINGS = ("", "а", "у", "ом", "е", "ы", "и", "ов", "ей", "ам", "ами", "ах")
+
+_morph = None
+
+
+def fold(word: str) -> str:
+    """Приведение слова к виду, в котором хранятся ключевые слова"""
+    return word.lower().replace("ё", "е")
+
+
+def _heuristic_forms(word: str) -> Set[str]:
+    """Формы слова по таблицам окончаний (без словаря)"""
+    forms = {word}
+
+    if not _CYRILLIC.intersection(word):
+        # Латиница: только множественное число
+        forms.add(word + "s")
+        return forms
+
+    if word[-2:] in _ADJECTIVE_LEMMA_ENDINGS and len(word) > 4:
+        stem = word[:-2]
+        forms.update(stem + ending for ending in _ADJECTIVE_ENDINGS)
+        if word[-2:] != "ий":
+            return forms
+        # "-ий" бывает и у существительных (сценарий) - добавляем их формы
+
+    last = word[-1]
+    if last in _NOUN_ENDINGS:
+        stem = word[:-1]
+        forms.update(stem + ending for ending in _NOUN_ENDINGS[last])
+        if last == "о" and len(stem) > 3:
+            # Наречие на -о образовано от прилагательного: секретно -> секретного
+            forms.update(stem + ending for ending in _ADJECTIVE_ENDINGS)
+    elif last in _CYRILLIC and last not in "аеёиоуыэюяъ":
+        forms.update(word + ending for ending in _CONSONANT_ENDINGS)
+
+    return forms
+
+
+def _dictionary_forms(word: str) -> Set[str]:
+    """Формы слова из словаря pymorphy3, если он установлен"""
+    global _morph
+
+    if pymorphy3 is None:
+        return set()
+    if _morph is None:
+        _morph = pymorphy3.MorphAnalyzer()
+
+    forms = set()
+    for parse in _morph.parse(word):
+        if parse.normal_form == word:
+            forms.update(item.word for item in parse.lexeme)
+    return forms
+
+
+def word_forms(word: str) -> Set[str]:
+    """
+    Все словоформы одного слова
+
+    Формы фраз из нескольких слов не перемножаются: автомат ключевых слов
+    хранит формы каждого слова отдельно (см. KeywordAutomaton)
+    """
+    word = fold(word)
+    return {fold(form) for form in _heuristic_forms(word) | _dictionary_forms(word)}
+
@@ -0,0 +1,186 @@
+import re
+import sys
+import unicodedata
+from typing import Dict, List, NamedTuple, Sequence
+
+
+class NormalizedText(NamedTuple):
+    """
+    Нормализованный текст и карта смещений в исходный текст
+
+    starts[i] / ends[i] - начало и конец в исходном тексте символа,
+    из которого получен i-й символ нормализованного текста.
+    """
+    text: str
+    starts: Sequence[int]
+    ends: Sequence[int]
+
+    def span(self, start: int, end: int) -> tuple:
+        """Перевод смещений нормализованного текста в смещения исходного"""
+        if start >= end:
+            position = self.starts[start] if start < len(self.starts) else (self.ends[-1] if self.ends else 0)
+            return position, position
+        return self.starts[start], self.ends[end - 1]
+
+
+# Невидимые символы: удаляются целиком
+_INVISIBLE = (
+    "\u00ad"  # мягкий перенос
+    "\u034f\u061c\u115f\u1160\u17b4\u17b5\u180e"
+    "\u200b\u200c\u200d\u200e\u200f"  # нулевой ширины и метки направления
+    "\u202a\u202b\u202c\u202d\u202e"
+    "\u2060\u2061\u2062\u2063\u2064\u2066\u2067\u2068\u2069"
+    "\ufeff"
+)
+
+# Латиница, похожая на кириллицу, и наоборот
+_LATIN_TO_CYRILLIC = {
+    "a": "а", "c": "с", "e": "е", "o": "о", "p": "р", "x": "х", "y": "у", "k": "к",
+    "A": "А", "B": "В", "C": "С", "E": "Е", "H": "Н", "K": "К", "M": "М",
+    "O": "О", "P": "Р", "T": "Т", "X": "Х", "Y": "У",
+}
+_CYRILLIC_TO_LATIN = {cyrillic: latin for latin, cyrillic in _LATIN_TO_CYRILLIC.items()}
+
+# Составные символы из буквы и комбинируемого знака (й, ё, введённые двумя кодами)
+_COMPOSE = {
+    ("и", "\u0306"): "й", ("И", "\u0306"): "Й",
+    ("е", "\u0308"): "ё", ("Е", "\u0308"): "Ё",
+}
+
+
+def _build_table() -> Dict[str, str]:
+    """
+    Таблица замен символов (строится один раз при импорте)
+
+    Совместимые символы Unicode (полноширинные цифры и буквы, лигатуры,
+    верхние индексы, специальные пробелы, математические буквы и цифры
+    U+1D400-1D7FF) заменяются по NFKC, невидимые символы - пустой строкой.
+    """
+    table = {}
+    for code in range(0x80, sys.maxunicode + 1):
+        char = chr(code)
+        if unicodedata.category(char) in ("Cn", "Cs", "Co"):
+            continue
+        folded = unicodedata.normalize("NFKC", char)
+        if folded != char and len(folded) <= 3:
+            table[char] = folded
+
+    for char in _INVISIBLE:
+        table[char] = ""
+
+    # Пробелы любой ширины - обычный пробел
+    for code in (0x00a0, 0x1680, 0x2028, 0x2029, 0x202f, 0x205f, 0x3000, *range(0x2000, 0x200b)):
+        table[chr(code)] = " "
+
+    return table
+
+
+_TABLE = _build_table()
+# Символы, которые требуют посимвольного прохода (замена или сборка)
+_TABLE_KEYS = frozenset(_TABLE) | {combining for _, combining in _COMPOSE}
+
+
+_CYRILLIC_RE = re.compile(r"[\u0400-\u04ff]")
+_LATIN_RE = re.compile(r"[A-Za-z]")
+
+
+def _is_word_char(char: str) -> bool:
+    """Символ слова: буква, цифра или подчёркивание"""
+    return char.isalnum() or char == "_"
+
+
+def _unmix(out: List[str], start: int, cyrillic: int, latin: int):
+    """Замена похожих букв слова out[start:] на буквы основного алфавита (длина не меняется)"""
+    # Смешанное слово: приводим к алфавиту, которого в слове больше
+    mapping = _LATIN_TO_CYRILLIC if cyrillic >= latin else _CYRILLIC_TO_LATIN
+    for i in range(start, len(out)):
+        out[i] = mapping.get(out[i], out[i])
+
+
+def normalize(text: str) -> NormalizedText:
+    """
+    Нормализация текста перед анализом за один линейный проход
+
+    - совместимые символы (полноширинные, лигатуры) - по таблице NFKC
+    - невидимые символы удаляются
+    - "й" и "ё" из двух кодов собираются в один символ
+    - в словах из смешанных алфавитов похожие буквы заменяются
+      на буквы основного алфавита слова ("пaроль" -> "пароль")
+    """
+    if text.isascii():
+        # В ASCII-тексте нечего нормализовать, смещения совпадают
+        return NormalizedText(text, range(len(text)), range(1, len(text) + 1))
+
+    return _fold(text, unmix=True)
+
+
+def fold(text: str) -> str:
+    """
+    Нормализация без замены похожих букв - для поиска ссылок
+
+    Похожие буквы в домене - это другой домен (cоrp.example с кириллической
+    "о" - xn--crp-sed.example, а не corp.example), поэтому ссылки ищутся
+    в тексте, где заменены только совместимые и невидимые символы.
+    """
+    if text.isascii():
+        return text
+    return _fold(text).text
+
+
+def _fold(text: str, unmix: bool = False) -> NormalizedText:
+    """
+    Замена совместимых символов, удаление невидимых, сборка й и ё из двух кодов
+
+    unmix - заодно заменить похожие буквы в словах из смешанных алфавитов:
+    слово собирается в том же проходе и исправляется, когда оно закончилось
+    """
+    if unmix and not (_CYRILLIC_RE.search(text) and _LATIN_RE.search(text)):
+        # Нет обоих алфавитов - нет и смешанных слов
+        unmix = False
+    if not unmix and _TABLE_KEYS.isdisjoint(text):
+        # Частый случай: заменять нечего
+        return NormalizedText(text, range(len(text)), range(1, len(text) + 1))
+
+    table = _TABLE
+    out: List[str] = []
+    starts: List[int] = []
+    ends: List[int] = []
+
+    # Текущее слово: начало в out и число кириллических и латинских букв
+    word_start = 0
+    cyrillic = latin = 0
+
+    i = 0
+    length = len(text)
+    while i < length:
+        char = text[i]
+        end = i + 1
+
+        if end < length and (char, text[end]) in _COMPOSE:
+            replacement = _COMPOSE[(char, text[end])]
+            end += 1
+        else:
+            replacement = table.get(char, char)
+
+        for piece in replacement:
+            if unmix:
+                if _is_word_char(piece):
+                    if "\u0400" <= piece <= "\u04ff":
+                        cyrillic += 1
+                    elif piece.isascii() and piece.isalpha():
+                        latin += 1
+                else:
+                    if cyrillic and latin:
+                        _unmix(out, word_start, cyrillic, latin)
+                    word_start = len(out) + 1
+                    cyrillic = latin = 0
+            out.append(piece)
+            starts.append(i)
+            ends.append(end)
+
+        i = end
+
+    if cyrillic and latin:
+        _unmix(out, word_start, cyrillic, latin)
+
+    return NormalizedText("".join(out), starts, ends)
@@ -0,0 +1,339 @@
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import IO, Dict, Iterator, List, Optional
+from app.dlp.analyzers.secrets_analyzer import SecretsAnalyzer
+from app.dlp.analyzers.url_analyzer import URLAnalyzer
+from app.dlp.edm import edm_registry
+from app.dlp.fingerprint import docx_text
+from app.dlp.guard import ScanBudget, deadline_after
+from app.dlp.normalizer import fold, normalize
+from app.dlp.policy import ExecutionPlan, compile_policy
+
+
+# Файлы, которые читаются как текст
+TEXT_EXTENSIONS = {
+    ".txt", ".md", ".csv", ".tsv", ".log", ".json", ".xml", ".html", ".htm",
+    ".eml", ".sql", ".yaml", ".yml", ".ini", ".env"
+}
+# Выгрузки чатов: по документу {"id": ..., "text": "..."} на строку
+NDJSON_EXTENSIONS = {".ndjson", ".jsonl"}
+DOCX_EXTENSIONS = {".docx"}
+
+MAX_FILE_BYTES = 50 * 1024 * 1024
+MAX_LINE_BYTES = 1024 * 1024
+
+# Задач в работе на один воркер: пока воркер считает одну, следующая уже в очереди
+IN_FLIGHT_PER_WORKER = 2
+# Как часто сохраняется точка продолжения
+CHECKPOINT_SECONDS = 1.0
+
+# Порядок действий по строгости - итог документа по самому строгому
+ACTION_PRIORITY = {"allow": 0, "warn": 1, "redact": 2, "moderate": 3, "block": 4}
+
+
+def parse_ndjson_line(line: bytes, line_number: int, max_bytes: int = MAX_LINE_BYTES) -> Dict:
+    """Разбор одной строки NDJSON: {"id": ..., "text": "..."} или просто строка"""
+    if len(line) > max_bytes:
+        return {"line": line_number, "error": "Строка слишком длинная"}
+
+    try:
+        document = json.loads(line)
+    except ValueError as e:
+        return {"line": line_number, "error": f"Некорректный JSON: {e}"}
+
+    if isinstance(document, str):
+        return {"line": line_number, "id": line_number, "text": document}
+    if not isinstance(document, dict) or not isinstance(document.get("text"), str):
+        return {"line": line_number, "error": "Ожидается объект с полем 'text'"}
+
+    return {"line": line_number, "id": document.get("id", line_number), "text": document["text"]}
+
+
+def _ndjson_items(f: IO[bytes], source: str) -> Iterator[Dict]:
+    for line_number, line in enumerate(f, start=1):
+        if line.strip():
+            item = parse_ndjson_line(line, line_number)
+            item["source"] = source
+            yield item
+
+
+def _file_items(path: str) -> Iterator[Dict]:
+    extension = os.path.splitext(path)[1].lower()
+    if extension in NDJSON_EXTENSIONS:
+        with open(path, "rb") as f:
+            yield from _ndjson_items(f, path)
+    elif extension in TEXT_EXTENSIONS or extension in DOCX_EXTENSIONS:
+        yield {"id": path, "path": path}
+
+
+def iter_items(inputs: List[str]) -> Iterator[Dict]:
+    """
+    Документы для проверки в детерминированном порядке
+
+    Каталоги обходятся рекурсивно с сортировкой имён, поэтому при повторном
+    запуске порядок тот же и проверку можно продолжить с N-го документа.
+    "-" - NDJSON со стандартного ввода. Файлы неизвестных типов пропускаются.
+    """
+    for source in inputs:
+        if source == "-":
+            yield from _ndjson_items(sys.stdin.buffer, "stdin")
+        elif os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    yield from _file_items(os.path.join(root, name))
+        elif os.path.isfile(source):
+            yield from _file_items(source)
+        else:
+            yield {"id": source, "path": source, "error": "Файл не найден"}
+
+
+# Состояние процесса-воркера
+_worker_plan: Optional[ExecutionPlan] = None
+_worker_url_analyzer: Optional[URLAnalyzer] = None
+_worker_secrets: Optional[SecretsAnalyzer] = None
+_worker_secrets_action = "block"
+
+
+def _init_worker(rules: List[Dict], version: int, budget: ScanBudget,
+                 edm_path: Optional[str], secrets_action: str):
+    """Компиляция политики в процессе-воркере (один раз на процесс)"""
+    global _worker_plan, _worker_url_analyzer, _worker_secrets, _worker_secrets_action
+    # Остановку по Ctrl+C выполняет основной процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if edm_path:
+        edm_registry.load(edm_path)
+    _worker_plan = compile_policy(rules, version, budget=budget)
+    _worker_url_analyzer = URLAnalyzer()
+    _worker_secrets = SecretsAnalyzer()
+    _worker_secrets_action = secrets_action
+
+
+def _read_text(path: str) -> str:
+    """Текст файла: Word документ - через python-docx, остальное - как UTF-8"""
+    if os.path.getsize(path) > MAX_FILE_BYTES:
+        raise ValueError(f"Файл больше {MAX_FILE_BYTES // 1024 // 1024} MB")
+    if os.path.splitext(path)[1].lower() in DOCX_EXTENSIONS:
+        return docx_text(path)
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def scan_text(plan: ExecutionPlan, url_analyzer: URLAnalyzer, secrets: SecretsAnalyzer,
+              secrets_action: str, text: str) -> Dict:
+    """Проверка одного текста: план политики, секреты, ссылки (без обращения к БД)"""
+    normalized = normalize(text)
+    verdict = plan.execute(text, normalized=normalized)
+    url_result = url_analyzer.analyze(fold(text), deadline_after(plan.budget.budget_ms))
+
+    found_secrets = []
+    for match in secrets.scan(normalized.text):
+        start, end = normalized.span(match.start, match.end)
+        found_secrets.append({
+            "type": match.type,
+            "value": secrets.mask_value(text[start:end], match.type),
+            "start": start,
+            "end": end
+        })
+
+    action, rule, reason = verdict["action"], verdict["rule"], verdict["reason"]
+    if found_secrets and ACTION_PRIORITY[secrets_action] > ACTION_PRIORITY[action]:
+        action, rule, reason = secrets_action, "secrets", "Обнаружены секреты"
+
+    return {
+        "action": action,
+        "rule": rule,
+        "reason": reason,
+        "rules": verdict["rules"] + (["secrets"] if found_secrets else []),
+        "found_keywords": verdict["keyword_result"]["found_keywords"],
+        "sensitive_data": [
+            {"type": item["type"], "value": item["value"], "start": item["start"], "end": item["end"]}
+            for item in verdict["sensitive_result"].get("found_data", [])
+        ],
+        "secrets": found_secrets,
+        "urls": url_result["urls"],
+        "timed_out": verdict["timed_out"] or url_result["timed_out"]
+    }
+
+
+def _scan_chunk(items: List[Dict]) -> List[Dict]:
+    """Проверка пачки документов в процессе-воркере"""
+    results = []
+    for item in items:
+        result = {key: item[key] for key in ("id", "path", "source", "line") if key in item}
+        if "error" not in item:
+            try:
+                text = item["text"] if "text" in item else _read_text(item["path"])
+                result["chars"] = len(text)
+                result.update(scan_text(_worker_plan, _worker_url_analyzer, _worker_secrets,
+                                        _worker_secrets_action, text))
+            except Exception as e:
+                result["error"] = f"Ошибка чтения: {e}"
+        else:
+            result["error"] = item["error"]
+        results.append(result)
+    return results
+
+
+def _item_key(item: Dict) -> str:
+    """Ключ документа для проверки, что при продолжении вход не изменился"""
+    return f"{item.get('source', item.get('path'))}:{item.get('line', '')}:{item.get('id')}"
+
+
+class OfflineScanner:
+    """
+    Проверка файлов и выгрузок вне сервера теми же правилами
+
+    Документы идут пачками в пул процессов, каждый воркер один раз
+    компилирует политику. В работе не больше IN_FLIGHT_PER_WORKER пачек
+    на воркер, результаты пишутся в порядке входа - память ограничена,
+    а после остановки проверку можно продолжить: в файле состояния
+    хранится число записанных документов и размер файла результатов.
+    При продолжении файл результатов обрезается до сохранённого размера,
+    поэтому документы не дублируются и не теряются. Ctrl+C и SIGTERM
+    останавливают проверку после текущей пачки.
+    """
+
+    def __init__(self, rules: List[Dict], version: int = 0, budget: Optional[ScanBudget] = None,
+                 edm_path: Optional[str] = None, secrets_action: str = "block",
+                 workers: Optional[int] = None, batch_size: int = 32, only_violations: bool = False):
+        # Проверка правил в текущем процессе: ошибка видна до запуска пула
+        compile_policy(rules, version)
+        self.rules = rules
+        self.version = version
+        self.budget = budget or ScanBudget(10000.0, False)
+        self.edm_path = edm_path
+        self.secrets_action = secrets_action
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.only_violations = only_violations
+
+    def run(self, inputs: List[str], output: Optional[str] = None,
+            state_path: Optional[str] = None, resume: bool = False) -> Dict:
+        """Проверить документы. Возвращает статистику"""
+        state = self._load_state(state_path, inputs) if resume else None
+        skip = state["items"] if state else 0
+        if state and output and (state["output_bytes"] is None or not os.path.exists(output)):
+            raise ValueError(f"Нет файла результатов прошлого запуска: {output}")
+
+        if output:
+            out = open(output, "r+b" if state else "wb")
+            if state:
+                out.truncate(state["output_bytes"])
+                out.seek(state["output_bytes"])
+        else:
+            out = sys.stdout.buffer
+
+        stats = {
+            "documents": skip,
+            "violations": state["violations"] if state else 0,
+            "errors": state["errors"] if state else 0,
+            "resumed_from": skip
+        }
+        last_key = state["last_key"] if state else None
+        items = iter_items(inputs)
+        if skip:
+            skipped = list(islice(items, skip - 1))
+            last_item = next(items, None)
+            if len(skipped) != skip - 1 or last_item is None or _item_key(last_item) != last_key:
+                raise ValueError("Входные данные изменились с прошлого запуска - продолжение невозможно")
+
+        started = time.perf_counter()
+        checkpoint_at = time.monotonic()
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.rules, self.version, self.budget, self.edm_path, self.secrets_action)
+        )
+        in_flight = deque()
+
+        # Ctrl+C и SIGTERM не прерывают код посреди работы с пулом,
+        # а останавливают проверку между пачками
+        stop = []
+        handlers = {}
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                handlers[signum] = signal.signal(signum, lambda received, frame: stop.append(received))
+
+        def write(batch: List[Dict], results: List[Dict]):
+            nonlocal last_key
+            for item, result in zip(batch, results):
+                stats["documents"] += 1
+                if "error" in result:
+                    stats["errors"] += 1
+                elif result["action"] != "allow":
+                    stats["violations"] += 1
+                if self.only_violations and result.get("action", "error") == "allow":
+                    continue
+                out.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+            last_key = _item_key(batch[-1])
+
+        try:
+            while not stop:
+                batch = list(islice(items, self.batch_size))
+                if batch:
+                    in_flight.append((batch, pool.submit(_scan_chunk, batch)))
+                if in_flight and (not batch or len(in_flight) >= self.workers * IN_FLIGHT_PER_WORKER):
+                    done_batch, future = in_flight.popleft()
+                    write(done_batch, future.result())
+                    if time.monotonic() - checkpoint_at >= CHECKPOINT_SECONDS:
+                        self._save_state(state_path, inputs, stats, last_key, out, output)
+                        checkpoint_at = time.monotonic()
+                if not batch and not in_flight:
+                    break
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            self._save_state(state_path, inputs, stats, last_key, out, output)
+            if output:
+                out.close()
+            else:
+                out.flush()
+
+        elapsed = time.perf_counter() - started
+        stats["seconds"] = round(elapsed, 3)
+        stats["per_second"] = round((stats["documents"] - skip) / elapsed, 1) if elapsed else 0.0
+        stats["interrupted"] = bool(stop)
+        return stats
+
+    @staticmethod
+    def _load_state(state_path: Optional[str], inputs: List[str]) -> Optional[Dict]:
+        if not state_path or not os.path.exists(state_path):
+            return None
+        with open(state_path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("inputs") != [os.path.abspath(source) for source in inputs]:
+            raise ValueError("Файл состояния относится к другим входным данным")
+        return state if state.get("items") else None
+
+    @staticmethod
+    def _save_state(state_path: Optional[str], inputs: List[str], stats: Dict,
+                    last_key: Optional[str], out, output: Optional[str]):
+        """Точка продолжения: сначала сбрасываются результаты, затем атомарно пишется состояние"""
+        if not state_path:
+            return
+        out.flush()
+        if output:
+            os.fsync(out.fileno())
+        state = {
+            "inputs": [os.path.abspath(source) for source in inputs],
+            "items": stats["documents"],
+            "violations": stats["violations"],
+            "errors": stats["errors"],
+            "last_key": last_key,
+            "output_bytes": out.tell() if output else None
+        }
+        tmp_path = f"{state_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, state_path)
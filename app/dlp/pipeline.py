@@ -0,0 +1,174 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+from app.dlp.normalizer import NormalizedText, normalize
+
+
+# Приоритет статусов: при нескольких находках итог определяет самая строгая
+STATUS_PRIORITY = {
+    "allow": 0,
+    "warning": 50,
+    "redact": 60,
+    "moderation_required": 70,
+    "url_moderation_required": 80,
+    "block": 100,
+}
+
+
+class CheckContext:
+    """Состояние одной проверки сообщения, общее для всех плагинов"""
+
+    def __init__(self, text: str, user: str, db_session=None, plan=None):
+        self.text = text
+        self.user = user
+        self.db_session = db_session
+        self.plan = plan
+        self.verdict: Optional[Dict] = None  # Результат плана политики
+        self.urls: Optional[Dict] = None  # Результат URLAnalyzer
+        self.secrets: Optional[Dict] = None  # Результат SecretsAnalyzer
+        # Заранее загруженные вердикты URL {url: статус} (пакетная проверка)
+        self.url_verdicts: Optional[Dict[str, str]] = None
+        # Режим объяснения: {"plugins": [...], "stages": [...], "db_lookups": [...]}
+        self.explain: Optional[Dict] = None
+        self._normalized: Optional[NormalizedText] = None
+
+    @property
+    def normalized(self) -> NormalizedText:
+        """Нормализованный текст (вычисляется один раз на проверку)"""
+        if self._normalized is None:
+            self._normalized = normalize(self.text)
+        return self._normalized
+
+    def trace(self, section: str, entry: Dict):
+        """Записать замер в объяснение (если режим объяснения включён)"""
+        if self.explain is not None:
+            self.explain[section].append(entry)
+
+
+class AnalyzerPlugin:
+    """
+    Базовый класс плагина-анализатора
+
+    cost - относительная стоимость: плагины выполняются по возрастанию
+    is_async - плагин ждёт ввода-вывода (БД, сеть) и выполняется конкурентно
+    can_short_circuit - блокирующая находка плагина окончательна,
+    остальные плагины после неё не выполняются
+    """
+
+    name = "plugin"
+    cost = 100
+    is_async = False
+    can_short_circuit = False
+
+    def run(self, context: CheckContext) -> Optional[Dict]:
+        """Анализ сообщения. Возвращает находку или None"""
+        raise NotImplementedError
+
+
+def make_finding(plugin: AnalyzerPlugin, status: str, allowed: bool, reason: str,
+                 register_violation: bool = False, **extra) -> Dict:
+    """Находка плагина в едином формате"""
+    finding = {
+        "plugin": plugin.name,
+        "status": status,
+        "allowed": allowed,
+        "reason": reason,
+        "register_violation": register_violation,
+    }
+    finding.update(extra)
+    return finding
+
+
+def _trace_plugin(context: CheckContext, plugin: AnalyzerPlugin, started: float,
+                  finding: Optional[Dict], outcome: str = "done"):
+    """Замер выполнения плагина для режима объяснения"""
+    context.trace("plugins", {
+        "plugin": plugin.name,
+        "cost": plugin.cost,
+        "async": plugin.is_async,
+        "time_ms": round((time.perf_counter() - started) * 1000, 3),
+        "outcome": outcome,
+        "status": finding["status"] if finding else "allow"
+    })
+
+
+def _stricter(current: Optional[Dict], finding: Optional[Dict]) -> Optional[Dict]:
+    """Более строгая из двух находок (при равенстве остаётся первая)"""
+    if finding is None:
+        return current
+    if current is None or STATUS_PRIORITY[finding["status"]] > STATUS_PRIORITY[current["status"]]:
+        return finding
+    return current
+
+
+class AnalyzerPipeline:
+    """
+    Реестр плагинов и порядок их выполнения
+
+    Сначала запускаются задачами асинхронные плагины (по возрастанию
+    стоимости), чтобы их запросы к БД и сети уже выполнялись, пока идёт
+    CPU-работа. Затем по возрастанию стоимости выполняются синхронные
+    плагины, после чего ожидаются асинхронные. Как только плагин
+    с can_short_circuit возвращает блокировку, оставшиеся стадии отменяются.
+    """
+
+    def __init__(self):
+        self._plugins: List[AnalyzerPlugin] = []
+
+    @property
+    def plugins(self) -> List[AnalyzerPlugin]:
+        return list(self._plugins)
+
+    def register(self, plugin: AnalyzerPlugin):
+        """Добавить плагин (плагин с тем же именем заменяется)"""
+        plugins = [p for p in self._plugins if p.name != plugin.name]
+        plugins.append(plugin)
+        self._plugins = sorted(plugins, key=lambda p: p.cost)
+
+    def unregister(self, name: str):
+        """Удалить плагин по имени"""
+        self._plugins = [p for p in self._plugins if p.name != name]
+
+    async def run(self, context: CheckContext) -> Optional[Dict]:
+        """Выполнить плагины. Возвращает самую строгую находку или None"""
+        decisive = None
+        pending = {}
+        started = time.perf_counter()
+
+        try:
+            for plugin in self._plugins:
+                if plugin.is_async:
+                    pending[asyncio.create_task(plugin.run(context))] = plugin
+            if pending:
+                # Даём стадиям отправить запросы до начала CPU-работы
+                await asyncio.sleep(0)
+
+            for plugin in self._plugins:
+                if plugin.is_async:
+                    continue
+                plugin_started = time.perf_counter()
+                finding = plugin.run(context)
+                _trace_plugin(context, plugin, plugin_started, finding)
+                decisive = _stricter(decisive, finding)
+                if plugin.can_short_circuit and finding and finding["status"] == "block":
+                    return decisive
+
+            while pending:
+                done, _ = await asyncio.wait(pending.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    plugin = pending.pop(task)
+                    finding = task.result()
+                    # Асинхронные плагины стартуют вместе, время - от общего старта
+                    _trace_plugin(context, plugin, started, finding)
+                    decisive = _stricter(decisive, finding)
+                    if plugin.can_short_circuit and finding and finding["status"] == "block":
+                        return decisive
+
+            return decisive
+        finally:
+            for task, plugin in pending.items():
+                task.cancel()
+                _trace_plugin(context, plugin, started, None, outcome="cancelled")
+            if pending:
+                # Дожидаемся отмены: сессия БД не должна закрыться посреди запроса
+                await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,192 @@
+import time
+from typing import Dict, Optional
+from app.dlp.pipeline import AnalyzerPlugin, CheckContext, make_finding
+from app.dlp.guard import ScanTimeout, deadline_after
+from app.dlp.fingerprint import FingerprintIndex
+from app.dlp.analyzers.secrets_analyzer import SecretsAnalyzer
+from app.dlp.scanner import ScanMatch
+from app.dlp.redaction import redact
+from app.dlp.normalizer import fold
+
+
+class PolicyPlugin(AnalyzerPlugin):
+    """Ключевые слова и персональные данные: один проход плана политики"""
+
+    name = "policy"
+    cost = 10
+    is_async = False
+    can_short_circuit = True
+
+    def run(self, context: CheckContext) -> Optional[Dict]:
+        plan = context.plan
+        # При пакетной проверке план уже выполнен в пуле процессов
+        verdict = context.verdict or plan.execute(
+            context.text, context.explain["stages"] if context.explain is not None else None,
+            normalized=context.normalized
+        )
+        context.verdict = verdict
+
+        action = verdict["action"]
+        reason = verdict["reason"]
+
+        if action == "block":
+            return make_finding(self, "block", False, reason, verdict=verdict)
+
+        if action == "moderate":
+            # Не публикуем, нарушение уходит на проверку администратору
+            return make_finding(self, "moderation_required", False, f"🕵️ {reason}",
+                                register_violation=True, verdict=verdict)
+
+        if action == "redact":
+            # Публикуем замаскированный текст и регистрируем нарушение
+            return make_finding(self, "redact", True, f"✂️ {reason}",
+                                register_violation=True, verdict=verdict,
+                                redacted_text=plan.redact(context.text, verdict["spans"]))
+
+        if action == "warn":
+            # РАЗРЕШАЕМ отправку, но регистрируем нарушение
+            return make_finding(self, "warning", True, f"⚠️ {reason}",
+                                register_violation=True, verdict=verdict)
+
+        return None
+
+
+class SecretsPlugin(AnalyzerPlugin):
+    """Секреты: ключи API, токены, закрытые ключи, пароли"""
+
+    name = "secrets"
+    cost = 15
+    is_async = False
+    can_short_circuit = True
+
+    ACTIONS = ("block", "moderate", "redact", "warn")
+
+    def __init__(self, analyzer: SecretsAnalyzer, action: str = "block"):
+        if action not in self.ACTIONS:
+            raise ValueError(f"Недопустимое действие для секретов: {action}")
+        self.analyzer = analyzer
+        self.action = action
+
+    def run(self, context: CheckContext) -> Optional[Dict]:
+        normalized = context.normalized
+        timed_out = False
+        try:
+            matches = self.analyzer.scan(normalized.text, deadline_after(context.plan.budget.budget_ms))
+        except ScanTimeout as e:
+            matches = e.matches
+            timed_out = True
+
+        # Смещения нормализованного текста -> смещения исходного
+        original = []
+        for match in matches:
+            start, end = normalized.span(match.start, match.end)
+            original.append(ScanMatch(match.type, context.text[start:end], start, end))
+
+        report = self.analyzer.report(original)
+        report["timed_out"] = timed_out
+        context.secrets = report
+
+        if not report["has_secrets"]:
+            if timed_out and context.plan.budget.fail_closed:
+                return make_finding(self, "moderation_required", False,
+                                    "⏱️ Сообщение отправлено на модерацию (превышено время поиска секретов)",
+                                    register_violation=True, secrets=report)
+            return None
+
+        reason = report["message"]
+
+        if self.action == "block":
+            return make_finding(self, "block", False, f"🔑 {reason}", register_violation=True, secrets=report)
+
+        if self.action == "moderate":
+            return make_finding(self, "moderation_required", False, f"🕵️ {reason}",
+                                register_violation=True, secrets=report)
+
+        if self.action == "redact":
+            return make_finding(self, "redact", True, f"✂️ {reason}", register_violation=True, secrets=report,
+                                redacted_text=redact(context.text, report["found_secrets"], lambda s: s["value"]))
+
+        return make_finding(self, "warning", True, f"⚠️ {reason}", register_violation=True, secrets=report)
+
+
+class FingerprintPlugin(AnalyzerPlugin):
+    """Фрагменты зарегистрированных конфиденциальных документов (MinHash/LSH)"""
+
+    name = "fingerprints"
+    cost = 20
+    is_async = False
+    can_short_circuit = True
+
+    def __init__(self, index: FingerprintIndex):
+        self.index = index
+
+    def run(self, context: CheckContext) -> Optional[Dict]:
+        match = self.index.match_text(context.text)
+        if match is None:
+            return None
+
+        return make_finding(self, "block", False,
+                            f"📄 Сообщение содержит фрагмент конфиденциального документа «{match['name']}»",
+                            register_violation=True, fingerprint=match)
+
+
+class URLPlugin(AnalyzerPlugin):
+    """Ссылки: поиск URL и проверка по белым/чёрным спискам в БД"""
+
+    name = "urls"
+    cost = 50
+    is_async = True
+    can_short_circuit = True
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def run(self, context: CheckContext) -> Optional[Dict]:
+        # Ссылки - без замены похожих букв: омоглиф в домене - это другой домен
+        url_result = context.urls or self.engine.url_analyzer.analyze(
+            fold(context.text), deadline_after(context.plan.budget.budget_ms)
+        )
+        context.urls = url_result
+
+        if url_result.get("timed_out") and context.plan.budget.fail_closed:
+            # Ссылки найдены не все - решение за модератором
+            return make_finding(self, "url_moderation_required", False,
+                                "⏱️ Сообщение отправлено на модерацию (превышено время анализа ссылок)",
+                                urls=url_result)
+
+        if not url_result["has_urls"]:
+            return None
+
+        if context.url_verdicts is not None:
+            # Вердикты уже загружены одним запросом на весь пакет
+            url_status = self.engine._url_status(url_result["urls"], context.url_verdicts)
+        elif not context.db_session:
+            # Если нет доступа к БД - блокируем по умолчанию
+            return make_finding(self, "url_moderation_required", False,
+                                "🔗 Сообщение отправлено на модерацию (содержит ссылки)",
+                                urls=url_result)
+        else:
+            started = time.perf_counter()
+            queries = self.engine.url_verdicts.db_queries
+            url_status = await self.engine._check_urls_in_database(url_result["urls"], context.db_session)
+            context.trace("db_lookups", {
+                "table": "url_checks",
+                "urls": url_result["urls"],
+                "queries": self.engine.url_verdicts.db_queries - queries,
+                "time_ms": round((time.perf_counter() - started) * 1000, 3),
+                "result": url_status
+            })
+
+        # Если хотя бы один URL в черном списке - блокируем
+        if url_status["has_malicious"]:
+            return make_finding(self, "block", False, "❌ Обнаружены заблокированные ссылки",
+                                urls=url_result)
+
+        # Если есть неизвестные URL - блокируем и отправляем на модерацию
+        if url_status["has_unknown"]:
+            return make_finding(self, "url_moderation_required", False,
+                                "🔗 Сообщение отправлено на модерацию (содержит ссылки)",
+                                urls=url_result)
+
+        # Все URL в белом списке
+        return None
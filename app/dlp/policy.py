@@ -0,0 +1,579 @@
+import re
+import time
+from bisect import bisect_left, bisect_right
+from collections import deque
+from heapq import merge
+from typing import Dict, List, Optional
+from app.dlp.analyzers.text_analyzer import TextAnalyzer, DEFAULT_KEYWORDS
+from app.dlp.analyzers.sensitive_data_analyzer import SensitiveDataAnalyzer, DEFAULT_PATTERNS
+from app.dlp.validators import VALIDATORS, CONFIDENCE_LEVELS
+from app.dlp.redaction import redact
+from app.dlp.normalizer import NormalizedText, normalize
+from app.dlp.scanner import ScanMatch
+from app.dlp.automaton import KeywordAutomaton, split_keyword
+from app.dlp.edm import edm_registry
+from app.dlp.guard import DEFAULT_BUDGET, ScanBudget, ScanTimeout, deadline_after, lint_embedding, lint_pattern
+
+
+# Действия в порядке возрастания приоритета: при нескольких сработавших
+# правилах решение принимает правило с самым строгим действием
+ACTIONS = ["warn", "redact", "moderate", "block"]
+SEVERITIES = ["low", "medium", "high"]
+RULE_KINDS = ["keywords", "regex", "proximity"]
+
+# Правило ключевых слов, список которых хранится в таблице forbidden_keywords
+KEYWORD_STORE_SOURCE = "forbidden_keywords"
+
+# Псевдоправило вердикта при превышении лимита времени анализа
+SCAN_TIMEOUT_RULE = "scan_timeout"
+
+
+def _elapsed_ms(started: float) -> float:
+    """Время с момента started (perf_counter) в миллисекундах"""
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+# Детекторы, которые без контекста дают слишком много ложных срабатываний
+# (любые 10 цифр похожи на паспорт): срабатывают только рядом с этими словами
+DEFAULT_PROXIMITY = {
+    "passport": {
+        "anchors": ["паспорт", "серия", "выдан", "номер паспорта"],
+        "window": 6
+    }
+}
+
+
+# Типы, для которых есть правила точного совпадения с реестром клиентов
+EDM_TYPES = ["bank_card", "inn", "snils"]
+
+
+def _default_rules() -> List[Dict]:
+    """Правила по умолчанию: запрещённые слова и детекторы персональных данных"""
+    rules = [{
+        "id": "forbidden_keywords",
+        "name": "Запрещённые слова",
+        "kind": "keywords",
+        "source": KEYWORD_STORE_SOURCE,
+        "keywords": list(DEFAULT_KEYWORDS),
+        "severity": "high",
+        "action": "block"
+    }]
+
+    for data_type, info in DEFAULT_PATTERNS.items():
+        if data_type in DEFAULT_PROXIMITY:
+            continue
+        rule = {
+            "id": data_type,
+            "name": info["name"],
+            "kind": "regex",
+            "detector": data_type,
+            "pattern": info["regex"],
+            "severity": info["severity"],
+            # Критичные данные (карты, документы) маскируются, остальные - предупреждение
+            "action": "redact" if info["severity"] == "high" else "warn",
+            "min_confidence": "medium"
+        }
+        for key in ("validator", "fallback", "fallback_confidence", "prefilter"):
+            if key in info:
+                rule[key] = info[key]
+        rules.append(rule)
+
+    for data_type, context in DEFAULT_PROXIMITY.items():
+        info = DEFAULT_PATTERNS[data_type]
+        rule = {
+            "id": data_type,
+            "name": info["name"],
+            "kind": "proximity",
+            "detector": data_type,
+            "pattern": info["regex"],
+            "anchors": context["anchors"],
+            "window": context["window"],
+            "severity": info["severity"],
+            "action": "redact",
+            "min_confidence": "low"
+        }
+        if "prefilter" in info:
+            rule["prefilter"] = info["prefilter"]
+        rules.append(rule)
+
+    # Реальные идентификаторы клиентов из реестра EDM (срабатывают,
+    # только если загружен индекс и значение в нём есть)
+    for data_type in EDM_TYPES:
+        info = DEFAULT_PATTERNS[data_type]
+        rule = {
+            "id": f"customer_{data_type}",
+            "name": f"{info['name']} клиента",
+            "kind": "regex",
+            "detector": data_type,
+            "pattern": info["regex"],
+            "severity": "high",
+            "action": "block",
+            "min_confidence": "medium",
+            "edm": True,
+            "message": f"Обнаружены данные клиента из реестра: {info['name']}"
+        }
+        for key in ("validator", "fallback", "fallback_confidence", "prefilter"):
+            if key in info:
+                rule[key] = info[key]
+        rules.append(rule)
+
+    # Номер карты вместе с CVV в одном сообщении - полные реквизиты карты
+    rules.append({
+        "id": "bank_card_cvv",
+        "name": "Номер карты и CVV",
+        "kind": "proximity",
+        "detector": "bank_card",
+        "anchors": ["cvv", "cvc", "cvv2", "cvc2"],
+        "window": None,
+        "severity": "high",
+        "action": "block",
+        "message": "Обнаружены реквизиты банковской карты (номер и CVV)"
+    })
+
+    return rules
+
+
+DEFAULT_RULES = _default_rules()
+
+
+def check_phrases(phrases: List[str]):
+    """
+    Проверка ключевых фраз: в каждой должно быть хотя бы одно слово
+
+    Текст разбивается на слова из букв и цифр, поэтому фраза из одних
+    знаков ("!!!", "++") никогда не была бы найдена
+    """
+    for phrase in phrases:
+        if not isinstance(phrase, str) or not split_keyword(phrase)[0]:
+            raise ValueError(f"Ключевая фраза '{phrase}' должна содержать буквы или цифры")
+
+
+def validate_rule(rule: Dict):
+    """Проверка описания правила. Бросает ValueError при ошибке"""
+    for key in ("id", "name", "kind", "severity", "action"):
+        if not rule.get(key):
+            raise ValueError(f"Не указано поле '{key}'")
+
+    if rule["kind"] not in RULE_KINDS:
+        raise ValueError(f"Недопустимый тип правила: {rule['kind']}. Разрешены: {', '.join(RULE_KINDS)}")
+    if rule["action"] not in ACTIONS:
+        raise ValueError(f"Недопустимое действие: {rule['action']}. Разрешены: {', '.join(ACTIONS)}")
+    if rule["severity"] not in SEVERITIES:
+        raise ValueError(f"Недопустимая критичность: {rule['severity']}")
+
+    if not isinstance(rule.get("edm", False), bool):
+        raise ValueError("'edm' - true (только значения из реестра EDM) или false")
+
+    if rule["kind"] == "keywords":
+        if rule.get("source") != KEYWORD_STORE_SOURCE and not rule.get("keywords"):
+            raise ValueError("Правило ключевых слов должно содержать 'keywords'")
+        check_phrases(rule.get("keywords", []))
+        return
+
+    if rule["kind"] == "proximity":
+        anchors = rule.get("anchors")
+        if not anchors or not isinstance(anchors, list) or not all(isinstance(a, str) and a.strip() for a in anchors):
+            raise ValueError("Правило близости должно содержать непустой список 'anchors'")
+        check_phrases(anchors)
+        window = rule.get("window")
+        if window is not None and (not isinstance(window, int) or window < 0):
+            raise ValueError("'window' - число слов (>= 0) или null для всего сообщения")
+        if not rule.get("pattern"):
+            # Ссылка на детектор другого правила (проверяется при компиляции плана)
+            if not rule.get("detector"):
+                raise ValueError("Правило близости должно содержать 'detector' или 'pattern'")
+            if rule.get("min_confidence", "low") not in CONFIDENCE_LEVELS:
+                raise ValueError(f"Недопустимая уверенность: {rule['min_confidence']}")
+            return
+    elif not rule.get("pattern"):
+        raise ValueError("Правило regex должно содержать 'pattern'")
+
+    try:
+        re.compile(rule["pattern"])
+    except re.error as e:
+        raise ValueError(f"Ошибка в регулярном выражении: {e}")
+    problems = lint_pattern(rule["pattern"])
+    if problems:
+        raise ValueError(f"Регулярное выражение может выполняться экспоненциально долго: {'; '.join(problems)}")
+    problems = lint_embedding(rule["pattern"])
+    if problems:
+        raise ValueError(f"Недопустимое регулярное выражение: {'; '.join(problems)}")
+    if rule.get("validator") and rule["validator"] not in VALIDATORS:
+        raise ValueError(f"Неизвестный валидатор: {rule['validator']}")
+    if rule.get("min_confidence", _default_confidence(rule)) not in CONFIDENCE_LEVELS:
+        raise ValueError(f"Недопустимая уверенность: {rule['min_confidence']}")
+    if rule.get("fallback_confidence", "low") not in CONFIDENCE_LEVELS:
+        raise ValueError(f"Недопустимая уверенность: {rule['fallback_confidence']}")
+
+
+def _default_confidence(rule: Dict) -> str:
+    """
+    Минимальная уверенность по умолчанию
+
+    Для правил близости контекст сам по себе подтверждает находку,
+    поэтому достаточно низкой уверенности.
+    """
+    return "low" if rule["kind"] == "proximity" else "medium"
+
+
+def _exact_match(span: Dict) -> bool:
+    """
+    Есть ли значение находки в реестре EDM
+
+    Поиск по индексу выполняется один раз на находку, результат
+    сохраняется в span["exact_match"].
+    """
+    if "exact_match" not in span:
+        span["exact_match"] = edm_registry.contains(span["type"], span["value"])
+    return span["exact_match"]
+
+
+class ExecutionPlan:
+    """
+    Скомпилированная DLP политика
+
+    Все правила ключевых слов собраны в один автомат, все regex-детекторы -
+    в один сканер, поэтому проверка сообщения - это два прохода по тексту
+    независимо от числа правил. Совпадения сопоставляются с правилами через
+    индексы {ключевое слово: правила} и {детектор: правила}, так что на каждое
+    сообщение обрабатываются только сработавшие правила.
+
+    Слова-якоря правил близости ищутся тем же автоматом, что и ключевые
+    слова, а условие "детектор рядом с якорем" проверяется одним проходом
+    по уже найденным совпадениям (см. _match_proximity).
+    """
+
+    def __init__(self, rules: List[Dict], version: int = 0,
+                 text_analyzer: Optional[TextAnalyzer] = None,
+                 budget: Optional[ScanBudget] = None):
+        self.version = version
+        self.budget = budget or DEFAULT_BUDGET
+        self.rules = {rule["id"]: rule for rule in rules}
+
+        # Индекс ключевых слов и слов-якорей правил близости
+        self._keyword_rules: Dict[str, List[Dict]] = {}
+        self._anchor_rules: Dict[str, List[Dict]] = {}
+        for rule in rules:
+            if rule["kind"] == "keywords":
+                for keyword in rule.get("keywords", []):
+                    self._keyword_rules.setdefault(keyword.lower(), []).append(rule)
+            elif rule["kind"] == "proximity":
+                for anchor in rule["anchors"]:
+                    self._anchor_rules.setdefault(anchor.lower(), []).append(rule)
+
+        analyzer = text_analyzer or TextAnalyzer()
+        self.keywords = analyzer.build_snapshot(self._keyword_rules.keys(), version, self._anchor_rules.keys())
+
+        # Детекторы: правила с одинаковым детектором разделяют один паттерн
+        patterns = {}
+        self._detector_rules: Dict[str, List[Dict]] = {}
+        self._proximity_rules: Dict[str, List[Dict]] = {}
+        for rule in rules:
+            if rule["kind"] == "keywords":
+                continue
+            detector = rule.get("detector") or rule["id"]
+            if rule["kind"] == "proximity":
+                self._proximity_rules.setdefault(detector, []).append(rule)
+                if not rule.get("pattern"):
+                    continue
+            else:
+                self._detector_rules.setdefault(detector, []).append(rule)
+            if detector not in patterns:
+                patterns[detector] = {
+                    "regex": rule["pattern"],
+                    "name": rule["name"],
+                    "severity": rule["severity"]
+                }
+                for key in ("validator", "fallback", "fallback_confidence", "prefilter"):
+                    if rule.get(key):
+                        patterns[detector][key] = rule[key]
+
+        for detector, proximity_rules in self._proximity_rules.items():
+            if detector not in patterns:
+                raise ValueError(f"Правило '{proximity_rules[0]['id']}': неизвестный детектор '{detector}'")
+
+        # fallback-тип без собственного правила недоступен
+        for info in patterns.values():
+            if info.get("fallback") not in patterns:
+                info.pop("fallback", None)
+
+        self.sensitive_data_analyzer = SensitiveDataAnalyzer(patterns)
+
+    def execute(self, text: str, profile: Optional[List[Dict]] = None,
+                normalized: Optional[NormalizedText] = None) -> Dict:
+        """
+        Проверка текста по всем правилам политики
+
+        Анализаторы работают с нормализованным текстом (см. normalizer),
+        смещения в результате указывают в исходный текст.
+
+        profile - список, в который добавляются замеры стадий
+        (режим объяснения, см. DLPEngine.check_message)
+        normalized - уже нормализованный текст, если он есть у вызывающего
+
+        Возвращает:
+        {
+            "action": "allow" | "warn" | "redact" | "moderate" | "block",
+            "rule": id решающего правила или None,
+            "version": версия политики,
+            "reason": "...",
+            "rules": [id всех сработавших правил],
+            "keyword_result": {...},
+            "sensitive_result": {...},
+            "spans": [{"start", "end", "type", "value", "rules"}, ...],
+            "timed_out": True, если сканирование остановлено по лимиту времени
+        }
+        """
+        hits: Dict[str, Dict] = {}
+        deadline = deadline_after(self.budget.budget_ms)
+        timed_out = False
+
+        # Проход 1: ключевые слова
+        found_keywords = []
+        keyword_matches = []
+        spans = []
+        if normalized is None:
+            started = time.perf_counter()
+            normalized = normalize(text)
+            if profile is not None:
+                profile.append({
+                    "stage": "normalize",
+                    "time_ms": _elapsed_ms(started),
+                    "changed": normalized.text != text
+                })
+        source = normalized.text
+        changed = source != text
+
+        started = time.perf_counter()
+        # Номера слов нужны только правилам близости
+        tokens = KeywordAutomaton.tokenize(source) if self._proximity_rules else None
+        automaton_matches = self.keywords.automaton.find(source, tokens)
+        if profile is not None:
+            profile.append({
+                "stage": "keywords",
+                "time_ms": _elapsed_ms(started),
+                "candidates": len(automaton_matches),
+                "automaton_size": self.keywords.automaton.size
+            })
+
+        anchors = []
+        for match in automaton_matches:
+            if match.lemma in self._anchor_rules:
+                anchors.append(match)
+            rules = self._keyword_rules.get(match.lemma)
+            if not rules:
+                continue
+
+            if changed:
+                start, end = normalized.span(match.start, match.end)
+                match = match._replace(form=text[start:end], start=start, end=end)
+            for rule in rules:
+                hits[rule["id"]] = rule
+            spans.append({
+                "start": match.start, "end": match.end, "type": "keyword",
+                "value": match.form, "rules": [rule["id"] for rule in rules]
+            })
+            if match.lemma not in found_keywords:
+                found_keywords.append(match.lemma)
+            keyword_matches.append({
+                "keyword": match.lemma, "form": match.form,
+                "start": match.start, "end": match.end
+            })
+
+        # Проход 2: все regex-детекторы + пакетная проверка контрольных сумм
+        analyzer = self.sensitive_data_analyzer
+        sensitive = []
+        started = time.perf_counter()
+        try:
+            candidates = analyzer.scan(source, deadline)
+        except ScanTimeout as e:
+            candidates = e.matches
+            timed_out = True
+
+        # Номера слов кандидатов (до пересчёта смещений в исходный текст)
+        token_positions = {}
+        if tokens is not None:
+            token_starts = [start for _, start, _ in tokens]
+            token_ends = [end for _, _, end in tokens]
+            token_positions = {
+                i: (bisect_right(token_ends, m.start), bisect_left(token_starts, m.end))
+                for i, m in enumerate(candidates)
+            }
+
+        if changed:
+            # Значение остаётся нормализованным (для контрольных сумм), смещения - исходные
+            candidates = [ScanMatch(m.type, m.value, *normalized.span(m.start, m.end)) for m in candidates]
+        if profile is not None:
+            profile.append({
+                "stage": "regex",
+                "time_ms": _elapsed_ms(started),
+                "candidates": len(candidates),
+                "prefiltered": bool(analyzer.scanner.prefilter) and not analyzer.scanner.prefilter.search(source),
+                "timed_out": timed_out
+            })
+
+        started = time.perf_counter()
+        validated = analyzer.validate(candidates)
+        if profile is not None:
+            profile.append({
+                "stage": "validate",
+                "time_ms": _elapsed_ms(started),
+                "candidates": len(candidates),
+                "accepted": len(validated)
+            })
+
+        candidate_index = {id(m): i for i, m in enumerate(candidates)}
+        detected = []
+        for match, data_type, confidence in validated:
+            level = CONFIDENCE_LEVELS.index(confidence)
+            span = {
+                "start": match.start, "end": match.end, "type": data_type,
+                "value": match.value, "rules": []
+            }
+            for rule in self._detector_rules.get(data_type, ()):
+                if level < CONFIDENCE_LEVELS.index(rule.get("min_confidence", "medium")):
+                    continue
+                if rule.get("edm") and not _exact_match(span):
+                    continue
+                hits[rule["id"]] = rule
+                span["rules"].append(rule["id"])
+            detected.append((match, data_type, confidence, span, token_positions.get(candidate_index[id(match)])))
+
+        if anchors and self._proximity_rules:
+            self._match_proximity(anchors, detected, hits)
+
+        for match, data_type, confidence, span, _ in detected:
+            if span["rules"]:
+                sensitive.append((match, data_type, confidence))
+                spans.append(span)
+
+        sensitive_result = analyzer.report(sensitive)
+        keyword_result = {
+            "found_keywords": found_keywords,
+            "matches": keyword_matches,
+            "message": f"Обнаружены запрещённые слова: {', '.join(found_keywords)}"
+        }
+
+        if timed_out and self.budget.fail_closed:
+            # Непроверенную часть сообщения не пропускаем
+            return self._verdict("block", SCAN_TIMEOUT_RULE, "⏱️ Превышено время анализа сообщения",
+                                 hits, keyword_result, sensitive_result, spans, timed_out)
+
+        if not hits:
+            return self._verdict("allow", None, "Сообщение разрешено",
+                                 hits, keyword_result, sensitive_result, spans, timed_out)
+
+        decisive = max(
+            hits.values(),
+            key=lambda r: (ACTIONS.index(r["action"]), SEVERITIES.index(r["severity"]))
+        )
+        if decisive.get("message"):
+            reason = decisive["message"]
+        elif decisive["kind"] == "keywords":
+            reason = keyword_result["message"]
+        else:
+            reason = sensitive_result["message"]
+
+        return self._verdict(decisive["action"], decisive["id"], reason,
+                             hits, keyword_result, sensitive_result, spans, timed_out)
+
+    def _match_proximity(self, anchors: List, detected: List, hits: Dict[str, Dict]):
+        """
+        Правила близости: один проход по якорям и находкам детекторов
+
+        Якоря и находки уже упорядочены по положению в тексте, они сливаются
+        в один поток. Для каждого правила помнится конец последнего якоря
+        (для находок после него) и очередь находок, ещё ждущих якоря справа.
+        Находки, отставшие от очередного якоря больше чем на window слов,
+        из очереди выбрасываются - следующие якоря будут только дальше.
+        """
+        events = merge(
+            ((anchor.first_token, 0, anchor) for anchor in anchors),
+            ((item[4][0], 1, item) for item in detected if item[4]),
+            key=lambda event: (event[0], event[1])
+        )
+
+        last_anchor: Dict[str, int] = {}
+        waiting: Dict[str, deque] = {}
+
+        def satisfy(rule, span):
+            hits[rule["id"]] = rule
+            if rule["id"] not in span["rules"]:
+                span["rules"].append(rule["id"])
+
+        for _, kind, item in events:
+            if kind == 0:
+                for rule in self._anchor_rules[item.lemma]:
+                    window = rule.get("window")
+                    last_anchor[rule["id"]] = max(last_anchor.get(rule["id"], 0), item.last_token)
+                    queue = waiting.get(rule["id"])
+                    while queue:
+                        first, last, span = queue.popleft()
+                        if window is None or item.first_token - last <= window:
+                            satisfy(rule, span)
+                continue
+
+            _, data_type, confidence, span, (first, last) = item
+            level = CONFIDENCE_LEVELS.index(confidence)
+            for rule in self._proximity_rules.get(data_type, ()):
+                if level < CONFIDENCE_LEVELS.index(rule.get("min_confidence", "low")):
+                    continue
+                if rule.get("edm") and not _exact_match(span):
+                    continue
+                window = rule.get("window")
+                anchor_end = last_anchor.get(rule["id"])
+                if anchor_end is not None and (window is None or first - anchor_end <= window):
+                    satisfy(rule, span)
+                else:
+                    waiting.setdefault(rule["id"], deque()).append((first, last, span))
+
+    def _verdict(self, action: str, rule_id: Optional[str], reason: str, hits: Dict[str, Dict],
+                 keyword_result: Dict, sensitive_result: Dict, spans: List[Dict], timed_out: bool) -> Dict:
+        """Результат выполнения плана"""
+        return {
+            "action": action,
+            "rule": rule_id,
+            "version": self.version,
+            "reason": reason,
+            "rules": list(hits.keys()),
+            "keyword_result": keyword_result,
+            "sensitive_result": sensitive_result,
+            "spans": spans,
+            "timed_out": timed_out
+        }
+
+    def redact(self, text: str, spans: List[Dict]) -> str:
+        """Замена фрагментов правил с действием redact на маску (один проход)"""
+        return redact(
+            text, spans, self._mask,
+            select=lambda span: any(self.rules[rule_id]["action"] == "redact" for rule_id in span["rules"])
+        )
+
+    def sanitize(self, text: str, spans: List[Dict]) -> str:
+        """
+        Маскирование всех найденных персональных данных
+
+        Используется для текста, который сохраняется в журналы нарушений
+        и очередь модерации: ключевые слова остаются видны администратору,
+        а номера карт и документов в БД не попадают.
+        """
+        return redact(text, spans, self._mask, select=lambda span: span["type"] != "keyword")
+
+    def _mask(self, span: Dict) -> str:
+        """Маска для найденного фрагмента"""
+        if span["type"] == "keyword":
+            return "*" * (span["end"] - span["start"])
+        return self.sensitive_data_analyzer.mask_value(span["value"], span["type"])
+
+
+def compile_policy(rules: List[Dict], version: int = 0,
+                   text_analyzer: Optional[TextAnalyzer] = None,
+                   budget: Optional[ScanBudget] = None) -> ExecutionPlan:
+    """Компиляция описаний правил в план выполнения. Бросает ValueError при ошибке"""
+    for rule in rules:
+        validate_rule(rule)
+    try:
+        return ExecutionPlan(rules, version, text_analyzer, budget)
+    except re.error as e:
+        # Паттерны, корректные по отдельности, не собираются в общий сканер
+        raise ValueError(f"Ошибка компиляции политики: {e}")
@@ -0,0 +1,31 @@
+from typing import Callable, Dict, List, Optional
+
+
+def redact(text: str, spans: List[Dict], mask: Callable[[Dict], str],
+           select: Optional[Callable[[Dict], bool]] = None) -> str:
+    """
+    Замена фрагментов текста масками за один проход
+
+    spans - [{"start", "end", ...}, ...] со смещениями в исходном тексте,
+    mask(span) - текст маски, select(span) - маскировать ли фрагмент.
+    Текст собирается из кусков между отсортированными смещениями,
+    перекрывающиеся фрагменты пропускаются (побеждает начавшийся раньше).
+    """
+    parts = []
+    position = 0
+
+    for span in sorted(spans, key=lambda s: s["start"]):
+        if span["start"] < position:
+            continue
+        if select is not None and not select(span):
+            continue
+
+        parts.append(text[position:span["start"]])
+        parts.append(mask(span))
+        position = span["end"]
+
+    if not parts:
+        return text
+
+    parts.append(text[position:])
+    return "".join(parts)
@@ -0,0 +1,60 @@
+import re
+from typing import Dict, List, NamedTuple, Optional
+from app.dlp.guard import ScanTimeout, finditer
+
+
+class ScanMatch(NamedTuple):
+    """Найденное совпадение: тип паттерна, значение и смещения в тексте"""
+    type: str
+    value: str
+    start: int
+    end: int
+
+
+class PatternScanner:
+    """
+    Однопроходный сканер по набору паттернов
+
+    Все паттерны компилируются в одно регулярное выражение с именованными
+    группами r0, r1, ... (тип паттерна может не быть допустимым именем
+    группы, например id правила my-rule), поэтому текст просматривается
+    ровно один раз. Паттерны не должны содержать своих именованных групп
+    и обратных ссылок (см. guard.lint_embedding). Перед сканированием
+    выполняется дешёвый префильтр: если в тексте нет ни одного символа,
+    с которого может начаться совпадение, сканирование пропускается.
+    """
+
+    def __init__(self, patterns: Dict[str, str], prefilter: Optional[str] = None):
+        """
+        patterns - {тип: регулярное выражение}, порядок задаёт приоритет
+        при совпадении нескольких паттернов в одной позиции
+        prefilter - регулярное выражение, без совпадения с которым
+        текст считается чистым
+        """
+        self.types = list(patterns.keys())
+        self._group_types = {f"r{i}": name for i, name in enumerate(self.types)}
+        # Без паттернов (все правила выключены) сканировать нечего
+        self.pattern = re.compile(
+            "|".join(f"(?P<r{i}>{regex})" for i, regex in enumerate(patterns.values()))
+        ) if patterns else None
+        self.prefilter = re.compile(prefilter) if prefilter else None
+
+    def scan(self, text: str, deadline: Optional[float] = None) -> List[ScanMatch]:
+        """
+        Поиск всех совпадений за один проход
+
+        deadline - момент (time.perf_counter), после которого сканирование
+        прекращается с ScanTimeout (в исключении - найденные до этого совпадения)
+        """
+        if self.pattern is None:
+            return []
+        if self.prefilter is not None and not self.prefilter.search(text):
+            return []
+
+        matches = []
+        try:
+            for m in finditer(self.pattern, text, deadline):
+                matches.append(ScanMatch(self._group_types[m.lastgroup], m.group(), m.start(), m.end()))
+        except ScanTimeout:
+            raise ScanTimeout(matches)
+        return matches
@@ -0,0 +1,305 @@
+import asyncio
+import multiprocessing
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from app.dlp.normalizer import normalize
+from app.dlp.guard import ScanBudget
+from app.dlp.edm import edm_registry
+from app.dlp.policy import ExecutionPlan, compile_policy
+from app.dlp.redaction import redact
+
+
+# Стадии плана, время которых сравнивается (см. ExecutionPlan.execute)
+STAGES = ("keywords", "regex", "validate")
+
+# Состояние процесса-воркера: активный и кандидатный планы
+_worker_plans: Optional[Tuple[ExecutionPlan, ExecutionPlan]] = None
+
+
+def _init_worker(active_rules: List[Dict], active_version: int, candidate_rules: List[Dict],
+                 budget: ScanBudget, edm_path: Optional[str]):
+    """Компиляция обоих планов в процессе-воркере (один раз на процесс)"""
+    global _worker_plans
+    if edm_path:
+        edm_registry.load(edm_path)
+    _worker_plans = (
+        compile_policy(active_rules, active_version, budget=budget),
+        compile_policy(candidate_rules, active_version, budget=budget)
+    )
+
+
+def _run_plan(plan: ExecutionPlan, text: str, normalized) -> Tuple[Dict, float, Dict[str, float]]:
+    """Выполнение плана с замером: (вердикт, мс, {стадия: мс})"""
+    profile = []
+    started = time.perf_counter()
+    verdict = plan.execute(text, profile, normalized)
+    elapsed = (time.perf_counter() - started) * 1000
+    return verdict, elapsed, {item["stage"]: item["time_ms"] for item in profile}
+
+
+def _sanitize(active: ExecutionPlan, candidate: ExecutionPlan, text: str,
+              active_verdict: Dict, candidate_verdict: Dict) -> str:
+    """Текст расхождения для журнала: данные, найденные любым из планов, замаскированы"""
+    def mask(span):
+        plan = active if span in active_verdict["spans"] else candidate
+        return plan._mask(span)
+
+    return redact(text, active_verdict["spans"] + candidate_verdict["spans"], mask,
+                  select=lambda span: span["type"] != "keyword")
+
+
+def compare_texts(active: ExecutionPlan, candidate: ExecutionPlan, texts: List[str]) -> List[Dict]:
+    """
+    Проверка текстов активным и кандидатным планами
+
+    Оба плана получают один и тот же нормализованный текст и выполняются
+    подряд в одном процессе, поэтому времена сравнимы.
+    """
+    results = []
+    for text in texts:
+        normalized = normalize(text)
+        active_verdict, active_ms, active_stages = _run_plan(active, text, normalized)
+        candidate_verdict, candidate_ms, candidate_stages = _run_plan(candidate, text, normalized)
+
+        agree = (active_verdict["action"], active_verdict["rule"]) == \
+                (candidate_verdict["action"], candidate_verdict["rule"])
+        results.append({
+            "agree": agree,
+            "active": {"action": active_verdict["action"], "rule": active_verdict["rule"],
+                       "rules": active_verdict["rules"], "ms": active_ms, "stages": active_stages},
+            "candidate": {"action": candidate_verdict["action"], "rule": candidate_verdict["rule"],
+                          "rules": candidate_verdict["rules"], "ms": candidate_ms, "stages": candidate_stages},
+            "text": None if agree else _sanitize(active, candidate, text, active_verdict, candidate_verdict)
+        })
+    return results
+
+
+def _compare_chunk(texts: List[str]) -> List[Dict]:
+    """Сравнение пачки текстов в процессе-воркере"""
+    return compare_texts(*_worker_plans, texts)
+
+
+class ShadowEvaluator:
+    """
+    Теневая проверка кандидатной политики на живом трафике
+
+    Проверка сообщения только кладёт текст в ограниченную очередь
+    (с вероятностью sample_rate) и не ждёт теневой проверки. Отдельная
+    задача забирает тексты пачками и сравнивает активный и кандидатный
+    планы в собственном пуле процессов, вне цикла событий. При
+    переполнении очереди тексты отбрасываются (счётчик dropped), а не
+    задерживают проверку.
+
+    Расхождения вердиктов записываются в dlp_shadow_disagreements,
+    сводка (матрица переходов действий, срабатывания правил, время
+    стадий обоих планов) копится в памяти процесса до смены кандидата.
+    """
+
+    QUEUE_SIZE = 1000  # Максимум текстов в очереди
+    BATCH_SIZE = 32  # Текстов в одной задаче воркера
+    WORKERS = 1
+    LATENCY_SAMPLES = 1000  # Замеров для перцентилей времени
+
+    def __init__(self):
+        self.candidate: Optional[ExecutionPlan] = None
+        self.shadow_id: Optional[int] = None
+        self.sample_rate = 0.0
+        self._active: Optional[ExecutionPlan] = None
+        self._queue: deque = deque()
+        self._consumer: Optional[asyncio.Task] = None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_version: Optional[Tuple] = None
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.samples = 0
+        self.dropped = 0
+        self.disagreements = 0
+        self.errors = 0
+        self.started_at = time.time()
+        self._transitions: Dict[str, int] = {}
+        self._rule_hits: Dict[str, List[int]] = {}  # правило -> [активный, кандидат]
+        self._stage_ms = {"active": dict.fromkeys(STAGES, 0.0), "candidate": dict.fromkeys(STAGES, 0.0)}
+        self._latency: deque = deque(maxlen=self.LATENCY_SAMPLES)  # (активный мс, кандидат мс)
+
+    def load(self, candidate: ExecutionPlan, shadow_id: int, sample_rate: float):
+        """Загрузить кандидатную политику (сводка начинается заново при смене кандидата)"""
+        if shadow_id != self.shadow_id:
+            self._reset_stats()
+            self._queue.clear()
+        self.candidate = candidate
+        self.shadow_id = shadow_id
+        self.sample_rate = sample_rate
+
+    def clear(self):
+        """Выключить теневую проверку"""
+        self.candidate = None
+        self.shadow_id = None
+        self.sample_rate = 0.0
+        self._queue.clear()
+        self._shutdown_pool()
+
+    def submit(self, text: str, active: ExecutionPlan):
+        """Отобрать сообщение для теневой проверки (не блокирует и не бросает исключений)"""
+        if self.candidate is None or random.random() >= self.sample_rate:
+            return
+        if len(self._queue) >= self.QUEUE_SIZE:
+            self.dropped += 1
+            return
+
+        self._active = active
+        self._queue.append(text)
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.get_running_loop().create_task(self._drain())
+
+    def _get_pool(self, active: ExecutionPlan, candidate: ExecutionPlan) -> ProcessPoolExecutor:
+        """Пул процессов под версии активного плана, кандидата и индекса EDM"""
+        version = (active.version, self.shadow_id, edm_registry.version)
+        if self._pool is None or self._pool_version != version:
+            if self._pool is not None:
+                # Старый пул доделывает уже отправленные пачки и завершается сам
+                self._pool.shutdown(wait=False)
+            edm_index = edm_registry.index
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(list(active.rules.values()), active.version, list(candidate.rules.values()),
+                          active.budget, edm_index.path if edm_index else None)
+            )
+            self._pool_version = version
+        return self._pool
+
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+            self._pool_version = None
+
+    async def _drain(self):
+        """Теневая проверка накопленных текстов пачками"""
+        loop = asyncio.get_running_loop()
+        while self._queue and self.candidate is not None:
+            texts = [self._queue.popleft() for _ in range(min(self.BATCH_SIZE, len(self._queue)))]
+            shadow_id, active, candidate = self.shadow_id, self._active, self.candidate
+
+            try:
+                results = await loop.run_in_executor(self._get_pool(active, candidate), _compare_chunk, texts)
+            except Exception as e:
+                self.errors += 1
+                print(f"⚠️ Ошибка теневой проверки DLP: {e}")
+                continue
+
+            if shadow_id != self.shadow_id:
+                continue  # Кандидат сменился, пока шла проверка
+            self._record(results)
+
+            disagreements = [result for result in results if not result["agree"]]
+            if disagreements:
+                try:
+                    await self._save_disagreements(shadow_id, active.version, disagreements)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"⚠️ Ошибка записи расхождений теневой проверки: {e}")
+
+    def _record(self, results: List[Dict]):
+        """Добавить результаты сравнения в сводку"""
+        for result in results:
+            active, candidate = result["active"], result["candidate"]
+            self.samples += 1
+            if not result["agree"]:
+                self.disagreements += 1
+                transition = f"{active['action']}->{candidate['action']}"
+                self._transitions[transition] = self._transitions.get(transition, 0) + 1
+
+            for rule_id in active["rules"]:
+                self._rule_hits.setdefault(rule_id, [0, 0])[0] += 1
+            for rule_id in candidate["rules"]:
+                self._rule_hits.setdefault(rule_id, [0, 0])[1] += 1
+
+            for stage in STAGES:
+                self._stage_ms["active"][stage] += active["stages"].get(stage, 0.0)
+                self._stage_ms["candidate"][stage] += candidate["stages"].get(stage, 0.0)
+            self._latency.append((active["ms"], candidate["ms"]))
+
+    async def _save_disagreements(self, shadow_id: int, active_version: int, results: List[Dict]):
+        """Запись расхождений в БД"""
+        from app.database import AsyncSessionLocal
+        from app.models.dlp_policy import ShadowDisagreement
+
+        async with AsyncSessionLocal() as db:
+            db.add_all([
+                ShadowDisagreement(
+                    shadow_id=shadow_id,
+                    active_version=active_version,
+                    active_action=result["active"]["action"],
+                    active_rule=result["active"]["rule"],
+                    candidate_action=result["candidate"]["action"],
+                    candidate_rule=result["candidate"]["rule"],
+                    active_ms=round(result["active"]["ms"], 3),
+                    candidate_ms=round(result["candidate"]["ms"], 3),
+                    message_text=result["text"]
+                )
+                for result in results
+            ])
+            await db.commit()
+
+    def stats(self) -> Dict:
+        """Сводка теневой проверки в этом процессе"""
+        samples = self.samples or 1
+
+        def percentile(values: List[float], q: float) -> float:
+            if not values:
+                return 0.0
+            values = sorted(values)
+            return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+        active_ms = [a for a, _ in self._latency]
+        candidate_ms = [c for _, c in self._latency]
+        return {
+            "enabled": self.candidate is not None,
+            "shadow_id": self.shadow_id,
+            "sample_rate": self.sample_rate,
+            "samples": self.samples,
+            "queued": len(self._queue),
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "disagreements": self.disagreements,
+            "agreement": round(1 - self.disagreements / samples, 4) if self.samples else None,
+            "transitions": dict(sorted(self._transitions.items(), key=lambda item: -item[1])),
+            "rules": {
+                rule_id: {"active": hits[0], "candidate": hits[1], "delta": hits[1] - hits[0]}
+                for rule_id, hits in sorted(self._rule_hits.items())
+            },
+            "timing_ms": {
+                "active": {"p50": percentile(active_ms, 0.5), "p95": percentile(active_ms, 0.95),
+                           "p99": percentile(active_ms, 0.99)},
+                "candidate": {"p50": percentile(candidate_ms, 0.5), "p95": percentile(candidate_ms, 0.95),
+                              "p99": percentile(candidate_ms, 0.99)},
+                "stages": {
+                    stage: {
+                        "active": round(self._stage_ms["active"][stage] / samples, 4),
+                        "candidate": round(self._stage_ms["candidate"][stage] / samples, 4),
+                        "delta": round((self._stage_ms["candidate"][stage] - self._stage_ms["active"][stage])
+                                       / samples, 4)
+                    }
+                    for stage in STAGES
+                }
+            },
+            "started_at": self.started_at
+        }
+
+    async def stop(self):
+        """Остановить теневую проверку (при остановке сервера)"""
+        self._queue.clear()
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+        self._shutdown_pool()
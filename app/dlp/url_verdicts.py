@@ -0,0 +1,318 @@
+import asyncio
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from app.dlp.analyzers.url_analyzer import canonicalize_url, split_url
+from app.dlp.blocklist import blocklist_registry
+
+
+# Порядок строк одного URL: побеждает последняя проверенная (created_at, затем id)
+VerdictKey = Tuple[datetime, int]
+
+URL_RULE_STATUSES = ("safe", "malicious")
+
+
+def parse_url_rule(pattern: str) -> Tuple[str, str]:
+    """
+    Домен и префикс пути из шаблона правила
+
+    "corp.example", "*.corp.example", "https://Corp.Example/wiki/" ->
+    ("corp.example", "/"), ("corp.example", "/"), ("corp.example", "/wiki/").
+    Схема не учитывается. Бросает ValueError, если домена нет.
+    """
+    pattern = pattern.strip()
+    if pattern.startswith("*."):
+        pattern = pattern[2:]
+    if "://" not in pattern:
+        pattern = "http://" + pattern
+
+    domain, path = split_url(canonicalize_url(pattern))
+    if not domain.strip("."):
+        raise ValueError(f"Некорректный домен в правиле: {pattern}")
+    return domain, path
+
+
+class _TrieNode:
+    __slots__ = ("children", "rules")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        # [(префикс пути, статус, id правила)], длинные префиксы первыми
+        self.rules: List[Tuple[str, str, int]] = []
+
+
+class URLRuleTrie:
+    """
+    Правила доменов и префиксов путей в дереве меток домена справа налево
+
+    wiki.corp.example хранится по пути example -> corp -> wiki, поэтому
+    правило домена покрывает все поддомены, а поиск - один проход по меткам
+    хоста, независимо от числа правил. Побеждает самый длинный совпавший
+    домен, в нём - самый длинный префикс пути (при равенстве - malicious).
+    """
+
+    def __init__(self):
+        self._root = _TrieNode()
+        self._rules: Dict[int, Tuple[str, str, str]] = {}  # id -> (домен, префикс, статус)
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def add(self, rule_id: int, domain: str, path_prefix: str, status: str):
+        """Добавить правило (правило с тем же id заменяется)"""
+        self.remove(rule_id)
+        node = self._root
+        for label in reversed(domain.split(".")):
+            node = node.children.setdefault(label, _TrieNode())
+        node.rules.append((path_prefix, status, rule_id))
+        node.rules.sort(key=lambda rule: (-len(rule[0]), rule[1] != "malicious"))
+        self._rules[rule_id] = (domain, path_prefix, status)
+
+    def remove(self, rule_id: int) -> bool:
+        """Удалить правило. Возвращает False, если его не было"""
+        rule = self._rules.pop(rule_id, None)
+        if rule is None:
+            return False
+
+        path = [self._root]
+        for label in reversed(rule[0].split(".")):
+            path.append(path[-1].children[label])
+        path[-1].rules = [item for item in path[-1].rules if item[2] != rule_id]
+
+        # Пустые ветви удаляются
+        labels = list(reversed(rule[0].split(".")))
+        for depth in range(len(labels), 0, -1):
+            node = path[depth]
+            if node.rules or node.children:
+                break
+            del path[depth - 1].children[labels[depth - 1]]
+        return True
+
+    def match(self, host: str, path: str) -> Optional[Tuple[str, int]]:
+        """(статус, id правила) для хоста и пути или None"""
+        best = None
+        node = self._root
+        for label in reversed(host.split(".")):
+            node = node.children.get(label)
+            if node is None:
+                break
+            for prefix, status, rule_id in node.rules:
+                if path.startswith(prefix):
+                    best = (status, rule_id)
+                    break
+        return best
+
+
+class URLVerdictIndex:
+    """
+    Индекс вердиктов по проверенным URL в памяти процесса
+
+    Хранит последний вердикт (status последней проверенной строки url_checks)
+    для каждого канонического URL и правила доменов и префиксов путей
+    (url_rules) и отвечает без запроса к БД. Индекс загружается целиком
+    при старте, вердикты, вынесенные в этом процессе, применяются сразу
+    (update), а вердикты других воркеров подхватываются перезагрузкой раз
+    в REFRESH_SECONDS. URL, которых нет в индексе, запрашиваются одним
+    запросом IN на всё сообщение; не найденные в БД запоминаются до
+    следующей перезагрузки, чтобы не спрашивать о них снова.
+    """
+
+    REFRESH_SECONDS = 60.0  # Период перезагрузки (вердикты других воркеров)
+    MAX_MISSING = 100000  # Максимум запомненных URL без вердикта
+
+    def __init__(self, on_change: Optional[Callable[[], None]] = None):
+        self._verdicts: Dict[str, Tuple[str, VerdictKey]] = {}
+        self._missing: Set[str] = set()
+        self.rules = URLRuleTrie()
+        self.rule_hits = 0
+        self.blocklist_hits = 0
+        self.on_change = on_change
+        self.loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.db_queries = 0
+        self._refresher: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._verdicts)
+
+    def get(self, url: str) -> Optional[str]:
+        """Вердикт по URL из индекса и правил (None - неизвестен без запроса к БД)"""
+        return self._lookup(canonicalize_url(url))[1]
+
+    def _lookup(self, url: str) -> Tuple[bool, Optional[str]]:
+        """
+        (известен ли URL без БД, вердикт) для канонического URL
+
+        Правило malicious для домена или префикса сильнее вердикта по
+        отдельному URL, вердикт по URL сильнее правила safe, правило safe
+        сильнее блоклиста фидов угроз (исправление ложных срабатываний фида).
+        """
+        host, path = split_url(url)
+        rule = self.rules.match(host, path) if len(self.rules) else None
+        if rule is not None and rule[0] == "malicious":
+            self.rule_hits += 1
+            return True, "malicious"
+
+        verdict = self._verdicts.get(url)
+        if verdict is not None:
+            return True, verdict[0]
+        if rule is not None:
+            self.rule_hits += 1
+            return True, rule[0]
+        if blocklist_registry.match_host(host):
+            self.blocklist_hits += 1
+            return True, "malicious"
+        return url in self._missing, None
+
+    def update(self, url: str, status: str, created_at: datetime, check_id: int) -> bool:
+        """
+        Применить вердикт проверенной строки url_checks
+
+        Вердикт более старой строки не перекрывает более новый, как и
+        в БД. Возвращает True, если вердикт по URL изменился.
+        """
+        url = canonicalize_url(url)
+        key = (created_at, check_id)
+        current = self._verdicts.get(url)
+        if current is not None and current[1] > key:
+            return False
+
+        self._verdicts[url] = (status, key)
+        self._missing.discard(url)
+        changed = current is None or current[0] != status
+        if changed and self.on_change:
+            self.on_change()
+        return changed
+
+    async def resolve(self, urls: Iterable[str], db_session) -> Dict[str, str]:
+        """
+        Вердикты по набору URL: {url: status} только для проверенных
+
+        Известные URL отдаются из индекса, остальные запрашиваются
+        из БД одним запросом.
+        """
+        verdicts = {}
+        unknown = []
+        for url in urls:
+            known, verdict = self._lookup(url)
+            if not known:
+                unknown.append(url)
+                continue
+            self.hits += 1
+            if verdict is not None:
+                verdicts[url] = verdict
+
+        if unknown and db_session is not None:
+            self.misses += len(unknown)
+            found = await self._query(db_session, unknown)
+            for url in unknown:
+                if url in found:
+                    self._verdicts[url] = found[url]
+                    verdicts[url] = found[url][0]
+                else:
+                    if len(self._missing) >= self.MAX_MISSING:
+                        self._missing.clear()
+                    self._missing.add(url)
+
+        return verdicts
+
+    async def _query(self, db_session, urls) -> Dict[str, Tuple[str, VerdictKey]]:
+        """Последние вердикты по списку URL одним запросом"""
+        from sqlalchemy import select
+        from app.models.url_check import URLCheck
+
+        self.db_queries += 1
+        result = await db_session.execute(
+            select(URLCheck.url, URLCheck.status, URLCheck.created_at, URLCheck.id)
+            .where(URLCheck.url.in_(list(urls)))
+            .where(URLCheck.is_reviewed == True)
+            .order_by(URLCheck.created_at, URLCheck.id)
+        )
+        # Строки идут от старых к новым - в словаре остаётся последний вердикт
+        return {url: (url_status, (created_at, check_id)) for url, url_status, created_at, check_id in result.all()}
+
+    async def load(self, db_session) -> bool:
+        """
+        Загрузить все проверенные URL (замена индекса одним присваиванием)
+
+        Возвращает True, если вердикты отличаются от прежних.
+        """
+        from sqlalchemy import select
+        from app.models.url_check import URLCheck, URLRule
+
+        verdicts: Dict[str, Tuple[str, VerdictKey]] = {}
+        stream = await db_session.stream(
+            select(URLCheck.url, URLCheck.status, URLCheck.created_at, URLCheck.id)
+            .where(URLCheck.is_reviewed == True)
+            .order_by(URLCheck.created_at, URLCheck.id)
+            .execution_options(yield_per=10000)
+        )
+        async for url, url_status, created_at, check_id in stream:
+            # Строки до канонизации URL приводятся к тому же ключу
+            verdicts[canonicalize_url(url)] = (url_status, (created_at, check_id))
+
+        rules = URLRuleTrie()
+        result = await db_session.execute(select(URLRule).order_by(URLRule.id))
+        for rule in result.scalars().all():
+            rules.add(rule.id, rule.domain, rule.path_prefix, rule.status)
+
+        changed = self.loaded and (
+            {url: v[0] for url, v in verdicts.items()} != {url: v[0] for url, v in self._verdicts.items()}
+            or rules._rules != self.rules._rules
+        )
+        self._verdicts = verdicts
+        self.rules = rules
+        self._missing = set()
+        self.loaded = True
+        if changed and self.on_change:
+            self.on_change()
+        return changed
+
+    def add_rule(self, rule_id: int, domain: str, path_prefix: str, status: str):
+        """Применить новое правило домена или префикса"""
+        self.rules.add(rule_id, domain, path_prefix, status)
+        if self.on_change:
+            self.on_change()
+
+    def remove_rule(self, rule_id: int):
+        """Убрать правило домена или префикса"""
+        if self.rules.remove(rule_id) and self.on_change:
+            self.on_change()
+
+    async def _refresh(self, session_factory):
+        """Фоновая перезагрузка индекса"""
+        while True:
+            await asyncio.sleep(self.REFRESH_SECONDS)
+            try:
+                async with session_factory() as db:
+                    await self.load(db)
+            except Exception as e:
+                print(f"⚠️ Ошибка обновления индекса вердиктов URL: {e}")
+
+    def start(self, session_factory):
+        """Запустить фоновую перезагрузку"""
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh(session_factory))
+
+    async def stop(self):
+        """Остановить фоновую перезагрузку"""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    def stats(self) -> Dict:
+        return {
+            "loaded": self.loaded,
+            "urls": len(self._verdicts),
+            "rules": len(self.rules),
+            "missing": len(self._missing),
+            "rule_hits": self.rule_hits,
+            "blocklist_hits": self.blocklist_hits,
+            "hits": self.hits,
+            "misses": self.misses,
+            "db_queries": self.db_queries
+        }
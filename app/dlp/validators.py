@@ -0,0 +1,79 @@
+from typing import Callable, Dict, List
+
+
+# Уровни уверенности в порядке возрастания
+CONFIDENCE_LEVELS = ["low", "medium", "high"]
+
+_INN10_WEIGHTS = (2, 4, 10, 3, 5, 9, 4, 6, 8)
+_INN11_WEIGHTS = (7, 2, 4, 10, 3, 5, 9, 4, 6, 8)
+_INN12_WEIGHTS = (3, 7, 2, 4, 10, 3, 5, 9, 4, 6, 8)
+
+
+def digits_of(value: str) -> List[int]:
+    """Цифры значения без разделителей"""
+    return [ord(c) - 48 for c in value if "0" <= c <= "9"]
+
+
+def luhn_valid(digits: List[int]) -> bool:
+    """Проверка номера банковской карты по алгоритму Луна"""
+    if len(digits) < 12:
+        return False
+
+    total = 0
+    for i, d in enumerate(reversed(digits)):
+        if i % 2:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return total % 10 == 0
+
+
+def _inn_control(digits: List[int], weights: tuple) -> int:
+    return sum(d * w for d, w in zip(digits, weights)) % 11 % 10
+
+
+def inn_valid(digits: List[int]) -> bool:
+    """Проверка контрольных цифр ИНН (10 цифр - юрлица, 12 - физлица)"""
+    if len(digits) == 10:
+        return _inn_control(digits, _INN10_WEIGHTS) == digits[9]
+    if len(digits) == 12:
+        return (_inn_control(digits, _INN11_WEIGHTS) == digits[10]
+                and _inn_control(digits, _INN12_WEIGHTS) == digits[11])
+    return False
+
+
+def snils_valid(digits: List[int]) -> bool:
+    """Проверка контрольного числа СНИЛС"""
+    if len(digits) != 11:
+        return False
+
+    number = digits[:9]
+    # Контрольное число проверяется только для номеров больше 001-001-998
+    if int("".join(map(str, number))) <= 1001998:
+        return False
+
+    total = sum(d * w for d, w in zip(number, range(9, 0, -1)))
+    if total > 101:
+        total %= 101
+    control = 0 if total in (100, 101) else total
+    return control == digits[9] * 10 + digits[10]
+
+
+# Реестр валидаторов по имени (имя указывается в описании паттерна)
+VALIDATORS: Dict[str, Callable[[List[int]], bool]] = {
+    "luhn": luhn_valid,
+    "inn": inn_valid,
+    "snils": snils_valid,
+}
+
+
+def validate_batch(validator: str, values: List[str]) -> List[bool]:
+    """Проверка всех кандидатов одного типа за один вызов"""
+    check = VALIDATORS[validator]
+    return [check(digits_of(value)) for value in values]
+
+
+def max_confidence(levels: List[str]) -> str:
+    """Наибольший уровень уверенности из списка"""
+    return max(levels, key=CONFIDENCE_LEVELS.index, default="low")
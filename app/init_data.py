@@ -42,7 +42,16 @@ async def create_super_admin_if_not_exists(db: AsyncSession):
     return super_admin
 
 
+async def create_default_keywords_if_not_exists(db: AsyncSession):
+    """Заполнить запрещённые слова по умолчанию, если политика ещё пуста"""
+    from app.dlp.analyzers.text_analyzer import DEFAULT_KEYWORDS
+    from app.services.policy_service import policy_service
+
+    await policy_service.seed_defaults(db, DEFAULT_KEYWORDS)
+
+
 async def initialize_default_data(db: AsyncSession):
     """Инициализация начальных данных"""
     await create_super_admin_if_not_exists(db)
+    await create_default_keywords_if_not_exists(db)
     # Здесь можно добавить другие начальные данные
\ No newline at end of file
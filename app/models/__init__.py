@@ -2,6 +2,8 @@ from app.models.message import Message
 from app.models.user import User
 from app.models.violation import Violation
 from app.models.file import UploadedFile
-from app.models.url_check import URLCheck
+from app.models.url_check import URLCheck, URLRule, HeldMessage, HeldMessageURL
+from app.models.dlp_policy import ForbiddenKeyword, PolicyVersion, DLPRule, ConfidentialDocument, ShadowPolicy, ShadowDisagreement
+from app.models.dlp_backfill import BackfillJob, BackfillResult
 
-__all__ = ["Message", "User", "Violation", "UploadedFile", "URLCheck"]
\ No newline at end of file
+__all__ = ["Message", "User", "Violation", "UploadedFile", "URLCheck", "URLRule", "HeldMessage", "HeldMessageURL", "ForbiddenKeyword", "PolicyVersion", "DLPRule", "ConfidentialDocument", "ShadowPolicy", "ShadowDisagreement", "BackfillJob", "BackfillResult"]
\ No newline at end of file
@@ -0,0 +1,78 @@
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, Text
+from datetime import datetime
+import json
+from app.database import Base
+
+
+class BackfillJob(Base):
+    """Задача ретроспективной проверки истории сообщений версией политики"""
+    __tablename__ = "dlp_backfill_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    policy_version = Column(Integer, nullable=False)  # Версия политики, которой проверяется история
+    status = Column(String, default="running")  # running, paused, completed, cancelled, failed
+    max_message_id = Column(Integer, default=0)  # Верхняя граница: сообщения после запуска проверены вживую
+    last_message_id = Column(Integer, default=0)  # Контрольная точка: всё до неё проверено и записано
+    total = Column(Integer, default=0)  # Сообщений к проверке на момент запуска
+    processed = Column(Integer, default=0)
+    violations = Column(Integer, default=0)  # Сообщений с вердиктом, отличным от allow
+    rate_limit = Column(Float, nullable=True)  # Ограничение сообщений в секунду (None - без ограничения)
+    rows_per_second = Column(Float, default=0.0)  # Измеренная скорость (скользящее среднее)
+    owner = Column(String, nullable=True)  # Процесс, выполняющий задачу (контрольные точки пишет только он)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)  # Обновляется на каждой контрольной точке
+    finished_at = Column(DateTime, nullable=True)
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        remaining = max(0, self.total - self.processed)
+        return {
+            "id": self.id,
+            "policy_version": self.policy_version,
+            "status": self.status,
+            "max_message_id": self.max_message_id,
+            "last_message_id": self.last_message_id,
+            "total": self.total,
+            "processed": self.processed,
+            "violations": self.violations,
+            "progress": round(self.processed / self.total * 100, 2) if self.total else 100.0,
+            "rate_limit": self.rate_limit,
+            "rows_per_second": round(self.rows_per_second or 0.0, 1),
+            "eta_seconds": round(remaining / self.rows_per_second) if self.rows_per_second else None,
+            "error": self.error,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "updated_at": self.updated_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "finished_at": self.finished_at.strftime("%Y-%m-%d %H:%M:%S") if self.finished_at else None
+        }
+
+
+class BackfillResult(Base):
+    """Вердикт ретроспективной проверки (сохраняются только сообщения с нарушениями)"""
+    __tablename__ = "dlp_backfill_results"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, nullable=False, index=True)
+    message_id = Column(Integer, nullable=False, index=True)
+    user = Column(String, nullable=False)
+    status = Column(String, nullable=False)  # Вердикт политики: blocked, moderation_required, ...
+    allowed = Column(Boolean, default=False)
+    rule = Column(String, nullable=True)  # Решающее правило
+    reason = Column(Text, nullable=True)
+    details = Column(Text, nullable=True)  # JSON: найденные слова, типы данных, секреты (без значений)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        return {
+            "id": self.id,
+            "job_id": self.job_id,
+            "message_id": self.message_id,
+            "user": self.user,
+            "status": self.status,
+            "allowed": self.allowed,
+            "rule": self.rule,
+            "reason": self.reason,
+            "details": json.loads(self.details) if self.details else {},
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
@@ -0,0 +1,139 @@
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, LargeBinary, Float
+from datetime import datetime
+import json
+from app.database import Base
+
+
+class ForbiddenKeyword(Base):
+    """Модель запрещённого ключевого слова"""
+    __tablename__ = "forbidden_keywords"
+
+    id = Column(Integer, primary_key=True, index=True)
+    keyword = Column(String, unique=True, nullable=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        return {
+            "id": self.id,
+            "keyword": self.keyword,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+
+class PolicyVersion(Base):
+    """Версия DLP политики (растёт при каждом изменении правил)"""
+    __tablename__ = "dlp_policy_versions"
+
+    id = Column(Integer, primary_key=True, index=True)  # Номер версии
+    change = Column(String, nullable=True)  # Описание изменения
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        return {
+            "version": self.id,
+            "change": self.change,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+
+class DLPRule(Base):
+    """Модель правила DLP политики (описание правила хранится как JSON)"""
+    __tablename__ = "dlp_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    rule_id = Column(String, unique=True, nullable=False, index=True)
+    position = Column(Integer, default=0)  # Порядок детекторов при сканировании
+    definition = Column(Text, nullable=False)  # JSON описание правила
+    is_enabled = Column(Boolean, default=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        return {
+            "id": self.id,
+            "rule_id": self.rule_id,
+            "position": self.position,
+            "definition": json.loads(self.definition),
+            "is_enabled": self.is_enabled,
+            "updated_at": self.updated_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+
+class ConfidentialDocument(Base):
+    """Зарегистрированный конфиденциальный документ (хранится только отпечаток)"""
+    __tablename__ = "dlp_confidential_documents"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)  # Название для администраторов
+    filename = Column(String, nullable=True)  # Исходное имя файла
+    word_count = Column(Integer, default=0)
+    chunk_count = Column(Integer, default=0)
+    fingerprint = Column(LargeBinary, nullable=False)  # Сигнатуры фрагментов (app.dlp.fingerprint)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "filename": self.filename,
+            "word_count": self.word_count,
+            "chunk_count": self.chunk_count,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+
+class ShadowPolicy(Base):
+    """Кандидатная политика, проверяемая в теневом режиме на живом трафике"""
+    __tablename__ = "dlp_shadow_policies"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=True)
+    definition = Column(Text, nullable=False)  # JSON список описаний правил
+    sample_rate = Column(Float, default=0.1)  # Доля сообщений для теневой проверки
+    status = Column(String, default="active")  # active, promoted, discarded
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "rules": json.loads(self.definition),
+            "sample_rate": self.sample_rate,
+            "status": self.status,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "finished_at": self.finished_at.strftime("%Y-%m-%d %H:%M:%S") if self.finished_at else None
+        }
+
+
+class ShadowDisagreement(Base):
+    """Расхождение вердиктов активной и кандидатной политик"""
+    __tablename__ = "dlp_shadow_disagreements"
+
+    id = Column(Integer, primary_key=True, index=True)
+    shadow_id = Column(Integer, nullable=False, index=True)
+    active_version = Column(Integer, nullable=False)
+    active_action = Column(String, nullable=False)
+    active_rule = Column(String, nullable=True)
+    candidate_action = Column(String, nullable=False)
+    candidate_rule = Column(String, nullable=True)
+    active_ms = Column(Float, default=0.0)
+    candidate_ms = Column(Float, default=0.0)
+    message_text = Column(Text, nullable=True)  # Персональные данные замаскированы
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        return {
+            "id": self.id,
+            "shadow_id": self.shadow_id,
+            "active_version": self.active_version,
+            "active": {"action": self.active_action, "rule": self.active_rule, "ms": self.active_ms},
+            "candidate": {"action": self.candidate_action, "rule": self.candidate_rule, "ms": self.candidate_ms},
+            "message_text": self.message_text,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, Index
 from datetime import datetime
 from app.database import Base
 
@@ -31,4 +31,87 @@ class URLCheck(Base):
             "virustotal_result": self.virustotal_result,
             "is_reviewed": self.is_reviewed,
             "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S")
-        }
\ No newline at end of file
+        }
+
+class URLRule(Base):
+    """Правило для домена (со всеми поддоменами) или префикса пути: safe или malicious"""
+    __tablename__ = "url_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    domain = Column(String, nullable=False, index=True)  # Хост в каноническом виде (punycode)
+    path_prefix = Column(String, default="/")  # "/" - весь домен
+    status = Column(String, nullable=False)  # safe, malicious
+    comment = Column(String, nullable=True)
+    created_by = Column(Integer, nullable=True)  # ID администратора
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        return {
+            "id": self.id,
+            "domain": self.domain,
+            "path_prefix": self.path_prefix,
+            "pattern": self.domain + (self.path_prefix if self.path_prefix != "/" else ""),
+            "status": self.status,
+            "comment": self.comment,
+            "created_by": self.created_by,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S")
+        }
+
+
+class HeldMessage(Base):
+    """Сообщение со ссылками, задержанное до вердиктов по всем его URL"""
+    __tablename__ = "held_messages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, nullable=False)
+    username = Column(String, nullable=False)
+    display_name = Column(String, nullable=False)
+    message_text = Column(Text, nullable=False)  # Текст хранится один раз, ссылки - в held_message_urls
+    status = Column(String, default="held", index=True)  # held, published, rejected
+    pending_urls = Column(Integer, default=0)  # Ссылок без вердикта
+    manual_review = Column(Boolean, default=False)  # Анализ ссылок неполный - публикует только администратор
+    reason = Column(Text, nullable=True)  # Причина отклонения
+    message_id = Column(Integer, nullable=True)  # Опубликованное сообщение (messages.id)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    resolved_at = Column(DateTime, nullable=True)
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "username": self.username,
+            "display_name": self.display_name,
+            "message_text": self.message_text,
+            "status": self.status,
+            "pending_urls": self.pending_urls,
+            "manual_review": self.manual_review,
+            "reason": self.reason,
+            "message_id": self.message_id,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "resolved_at": self.resolved_at.strftime("%Y-%m-%d %H:%M:%S") if self.resolved_at else None
+        }
+
+
+class HeldMessageURL(Base):
+    """Ссылка задержанного сообщения и вердикт по ней"""
+    __tablename__ = "held_message_urls"
+    __table_args__ = (
+        # Вердикт по URL освобождает все ожидающие его сообщения одним запросом
+        Index("ix_held_message_urls_url_status", "url", "status"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    held_message_id = Column(Integer, nullable=False, index=True)
+    url = Column(String, nullable=False)  # Канонический URL
+    status = Column(String, default="pending")  # pending, safe, malicious
+
+    def to_dict(self):
+        """Преобразование в словарь"""
+        return {
+            "id": self.id,
+            "held_message_id": self.held_message_id,
+            "url": self.url,
+            "status": self.status
+        }
@@ -0,0 +1,339 @@
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, update
+from app.database import AsyncSessionLocal
+from app.dlp.batch import BatchEvaluator
+from app.dlp.engine import dlp_engine
+from app.dlp.policy import ExecutionPlan
+from app.models.message import Message
+from app.models.dlp_backfill import BackfillJob, BackfillResult
+
+
+class BackfillService:
+    """
+    Ретроспективная проверка истории сообщений новой версией политики
+
+    Таблица messages читается страницами по ключу (id > контрольной точки
+    ORDER BY id LIMIT PAGE_SIZE), каждая страница - потоковым курсором
+    пачками по BATCH_SIZE, так что в памяти не больше одной страницы и время
+    запроса не растёт к концу таблицы. Страница проверяется пачками
+    в собственном пуле процессов и записывается одной транзакцией вместе
+    с контрольной точкой: после остановки или падения задача продолжает
+    с первой незаписанной страницы, ничего не проверяя дважды.
+
+    Чтение страницы завершается до начала проверки - блокировка чтения
+    не держится во время анализа и не мешает записи новых сообщений.
+    Скорость ограничивается rate_limit (сообщений в секунду), чтобы
+    проверку можно было запускать в рабочее время.
+
+    Задача помечается процессом-владельцем (owner): контрольная точка
+    записывается условным UPDATE только владельцем задачи в статусе
+    running. Задачу, приостановленную другим воркером (при его запуске
+    или через API), владелец бросает на ближайшей контрольной точке,
+    не записывая страницу.
+    """
+
+    PAGE_SIZE = 2000  # Сообщений в странице (одна транзакция записи)
+    BATCH_SIZE = 250  # Сообщений в пачке чтения и проверки
+    WORKERS = 1  # Процессов в пуле задачи (общий пул движка остаётся живому трафику)
+    DEFAULT_RATE_LIMIT = 500.0  # Сообщений в секунду по умолчанию (0 - без ограничения)
+    RATE_SMOOTHING = 0.3  # Вес последней страницы в скользящей средней скорости
+    def __init__(self):
+        self.owner = uuid.uuid4().hex  # Метка этого процесса в задачах
+        self._tasks: Dict[int, asyncio.Task] = {}
+        # План, которым проверяется задача: смена политики во время проверки её не затрагивает
+        self._plans: Dict[int, ExecutionPlan] = {}
+        # Задачи, которые нужно остановить на ближайшей контрольной точке -> новый статус
+        self._stop_requests: Dict[int, str] = {}
+        self._evaluator = BatchEvaluator(max_workers=self.WORKERS)
+
+    async def get_jobs(self, db: AsyncSession) -> List[BackfillJob]:
+        """Задачи ретроспективной проверки, новые первыми"""
+        result = await db.execute(select(BackfillJob).order_by(BackfillJob.id.desc()))
+        return list(result.scalars().all())
+
+    async def get_job(self, db: AsyncSession, job_id: int) -> Optional[BackfillJob]:
+        """Задача по id"""
+        return await db.get(BackfillJob, job_id, populate_existing=True)
+
+    async def get_results(self, db: AsyncSession, job_id: int, after_id: int = 0,
+                          limit: int = 100) -> List[BackfillResult]:
+        """Найденные нарушения задачи, страница по ключу (id > after_id)"""
+        result = await db.execute(
+            select(BackfillResult)
+            .where(BackfillResult.job_id == job_id, BackfillResult.id > after_id)
+            .order_by(BackfillResult.id)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def start(self, db: AsyncSession, rate_limit: Optional[float] = None) -> BackfillJob:
+        """
+        Запустить проверку истории текущей версией политики
+
+        Проверяются сообщения, сохранённые до запуска. Бросает ValueError,
+        если другая задача уже выполняется.
+        """
+        if self._tasks:
+            raise ValueError(f"Уже выполняется проверка истории #{next(iter(self._tasks))}")
+
+        plan = dlp_engine.plan
+        max_message_id = (await db.execute(select(func.max(Message.id)))).scalar() or 0
+        total = (await db.execute(select(func.count(Message.id)))).scalar() or 0
+
+        job = BackfillJob(
+            policy_version=plan.version,
+            status="running",
+            owner=self.owner,
+            max_message_id=max_message_id,
+            total=total,
+            rate_limit=self.DEFAULT_RATE_LIMIT if rate_limit is None else rate_limit or None
+        )
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+
+        self._launch(job.id, plan)
+        print(f"🕰️ Проверка истории #{job.id} запущена: {total} сообщений, политика v{plan.version}")
+        return job
+
+    async def resume(self, db: AsyncSession, job_id: int) -> Optional[BackfillJob]:
+        """
+        Продолжить приостановленную задачу с контрольной точки
+
+        Бросает ValueError, если задача завершена или политика сменилась
+        после перезапуска сервера (план задачи уже не восстановить).
+        """
+        job = await self.get_job(db, job_id)
+        if job is None:
+            return None
+        if job_id in self._tasks:
+            raise ValueError(f"Проверка истории #{job_id} уже выполняется")
+        if job.status not in ("paused", "failed"):
+            raise ValueError(f"Проверку истории в статусе {job.status} продолжить нельзя")
+        if self._tasks:
+            raise ValueError(f"Уже выполняется проверка истории #{next(iter(self._tasks))}")
+
+        plan = self._plans.get(job_id)
+        if plan is None:
+            if dlp_engine.plan.version != job.policy_version:
+                raise ValueError(
+                    f"Политика изменилась (v{job.policy_version} -> v{dlp_engine.plan.version}), "
+                    f"запустите новую проверку истории"
+                )
+            plan = dlp_engine.plan
+
+        job.status = "running"
+        job.owner = self.owner
+        job.error = None
+        job.updated_at = datetime.utcnow()
+        await db.commit()
+
+        self._launch(job_id, plan)
+        return job
+
+    async def pause(self, db: AsyncSession, job_id: int) -> Optional[BackfillJob]:
+        """Приостановить задачу на ближайшей контрольной точке"""
+        return await self._stop(db, job_id, "paused")
+
+    async def cancel(self, db: AsyncSession, job_id: int) -> Optional[BackfillJob]:
+        """Отменить задачу (записанные результаты сохраняются)"""
+        return await self._stop(db, job_id, "cancelled")
+
+    async def _stop(self, db: AsyncSession, job_id: int, new_status: str) -> Optional[BackfillJob]:
+        """Остановка задачи: выполняющаяся дописывает текущую страницу"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            self._stop_requests[job_id] = new_status
+            await asyncio.shield(task)
+            return await self.get_job(db, job_id)
+
+        job = await self.get_job(db, job_id)
+        if job is None:
+            return None
+        if job.status in ("completed", "cancelled"):
+            raise ValueError(f"Проверка истории #{job_id} уже завершена ({job.status})")
+
+        job.status = new_status
+        job.updated_at = datetime.utcnow()
+        if new_status == "cancelled":
+            job.finished_at = datetime.utcnow()
+            self._plans.pop(job_id, None)
+        await db.commit()
+        return job
+
+    def _launch(self, job_id: int, plan: ExecutionPlan):
+        """Запуск задачи в цикле событий"""
+        self._plans[job_id] = plan
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id, plan))
+
+    async def _read_page(self, after_id: int, max_id: int) -> List[Tuple[int, str, str]]:
+        """Следующая страница сообщений после контрольной точки"""
+        async with AsyncSessionLocal() as reader:
+            stream = await reader.stream(
+                select(Message.id, Message.user, Message.text)
+                .where(Message.id > after_id, Message.id <= max_id)
+                .order_by(Message.id)
+                .limit(self.PAGE_SIZE)
+                .execution_options(yield_per=self.BATCH_SIZE)
+            )
+            rows = []
+            async for partition in stream.partitions():
+                rows.extend(tuple(row) for row in partition)
+            return rows
+
+    async def _check_page(self, db: AsyncSession, job_id: int, plan: ExecutionPlan,
+                          rows: List[Tuple[int, str, str]]) -> List[BackfillResult]:
+        """Проверка страницы пачками, результат - записи о нарушениях"""
+        results = []
+        for i in range(0, len(rows), self.BATCH_SIZE):
+            batch = rows[i:i + self.BATCH_SIZE]
+            verdicts = await dlp_engine.evaluate_messages(
+                [text for _, _, text in batch], plan, user="backfill",
+                db_session=db, evaluator=self._evaluator
+            )
+            for (message_id, user, _), verdict in zip(batch, verdicts):
+                if verdict["status"] != "allow":
+                    results.append(self._make_result(job_id, message_id, user, verdict))
+        return results
+
+    def _make_result(self, job_id: int, message_id: int, user: str, verdict: Dict) -> BackfillResult:
+        """Запись о нарушении: значения персональных данных и секретов - только замаскированные"""
+        details = {"found_keywords": verdict["found_keywords"]}
+        if verdict.get("sensitive_data"):
+            details["sensitive_data"] = [
+                f"{item['name']}: {item['value']}" for item in verdict["sensitive_data"]["found_data"]
+            ]
+        if verdict.get("secrets"):
+            details["secrets"] = [
+                f"{item['name']}: {item['value']}" for item in verdict["secrets"]["found_secrets"]
+            ]
+        if verdict.get("fingerprint"):
+            details["document"] = verdict["fingerprint"]["name"]
+        if verdict.get("urls"):
+            details["urls"] = verdict["urls"].get("urls", [])
+
+        return BackfillResult(
+            job_id=job_id,
+            message_id=message_id,
+            user=user,
+            status=verdict["status"],
+            allowed=verdict["allowed"],
+            rule=verdict.get("rule"),
+            reason=verdict["reason"],
+            details=json.dumps(details, ensure_ascii=False)
+        )
+
+    async def _run(self, job_id: int, plan: ExecutionPlan):
+        """Цикл задачи: страница -> проверка -> запись с контрольной точкой -> пауза по лимиту"""
+        try:
+            async with AsyncSessionLocal() as db:
+                job = await db.get(BackfillJob, job_id)
+                try:
+                    while True:
+                        new_status = self._stop_requests.pop(job_id, None)
+                        if new_status:
+                            job.status = new_status
+                            job.updated_at = datetime.utcnow()
+                            if new_status == "cancelled":
+                                job.finished_at = datetime.utcnow()
+                                self._plans.pop(job_id, None)
+                            await db.commit()
+                            print(f"⏸️ Проверка истории #{job_id}: {new_status} "
+                                  f"на сообщении {job.last_message_id} ({job.processed}/{job.total})")
+                            return
+
+                        started = time.perf_counter()
+                        rows = await self._read_page(job.last_message_id, job.max_message_id)
+                        if not rows:
+                            job.status = "completed"
+                            job.updated_at = job.finished_at = datetime.utcnow()
+                            self._plans.pop(job_id, None)
+                            await db.commit()
+                            print(f"✅ Проверка истории #{job_id} завершена: {job.processed} сообщений, "
+                                  f"нарушений: {job.violations}")
+                            return
+
+                        results = await self._check_page(db, job_id, plan, rows)
+
+                        # Задачу могли приостановить из другого процесса - страница не записывается
+                        claimed = await db.execute(
+                            update(BackfillJob)
+                            .where(BackfillJob.id == job_id, BackfillJob.status == "running",
+                                   BackfillJob.owner == self.owner)
+                            .values(owner=self.owner)
+                            .execution_options(synchronize_session=False)
+                        )
+                        if claimed.rowcount == 0:
+                            checkpoint = job.last_message_id
+                            await db.rollback()
+                            print(f"⏸️ Проверка истории #{job_id} остановлена другим процессом, "
+                                  f"страница после сообщения {checkpoint} не записана")
+                            return
+
+                        # Результаты и контрольная точка - одной транзакцией
+                        db.add_all(results)
+                        job.last_message_id = rows[-1][0]
+                        job.processed += len(rows)
+                        job.violations += len(results)
+                        job.updated_at = datetime.utcnow()
+                        rate = len(rows) / max(time.perf_counter() - started, 1e-6)
+                        job.rows_per_second = rate if not job.rows_per_second else (
+                            self.RATE_SMOOTHING * rate + (1 - self.RATE_SMOOTHING) * job.rows_per_second
+                        )
+                        await db.commit()
+
+                        # Ограничение скорости; без него - просто отдаём цикл событий
+                        delay = len(rows) / job.rate_limit - (time.perf_counter() - started) if job.rate_limit else 0
+                        await asyncio.sleep(max(0.0, delay))
+                except asyncio.CancelledError:
+                    # Остановка сервера: страница не записана, задача продолжит с контрольной точки
+                    await db.rollback()
+                    raise
+                except Exception as e:
+                    await db.rollback()
+                    job.status = "failed"
+                    job.error = str(e)
+                    job.updated_at = datetime.utcnow()
+                    await db.commit()
+                    print(f"❌ Проверка истории #{job_id} остановлена с ошибкой: {e}")
+        finally:
+            self._tasks.pop(job_id, None)
+            self._stop_requests.pop(job_id, None)
+            if not self._tasks:
+                self._evaluator.shutdown()
+
+    async def recover(self, db: AsyncSession):
+        """
+        Пометить прерванные задачи приостановленными (при старте сервера)
+
+        Только что запущенный процесс не выполняет ни одной задачи, поэтому
+        все задачи в статусе running приостанавливаются; их можно продолжить
+        через resume. Задачу живого соседнего воркера это тоже остановит -
+        на ближайшей контрольной точке, без повторной записи страницы.
+        """
+        result = await db.execute(select(BackfillJob).where(BackfillJob.status == "running"))
+        jobs = list(result.scalars().all())
+        for job in jobs:
+            job.status = "paused"
+            job.updated_at = datetime.utcnow()
+            print(f"⏸️ Проверка истории #{job.id} была прервана на сообщении {job.last_message_id}, "
+                  f"продолжить: POST /api/dlp/backfill/{job.id}/resume")
+        if jobs:
+            await db.commit()
+
+    async def stop(self):
+        """Приостановить выполняющиеся задачи (при остановке сервера)"""
+        for job_id in list(self._tasks):
+            self._stop_requests[job_id] = "paused"
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._evaluator.shutdown()
+
+
+backfill_service = BackfillService()
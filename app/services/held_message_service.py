@@ -0,0 +1,317 @@
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, insert
+from app.dlp.analyzers.url_analyzer import canonicalize_url
+from app.dlp.engine import dlp_engine
+from app.models.message import Message
+from app.models.url_check import URLCheck, HeldMessage, HeldMessageURL
+
+
+# Вердикты, которые решают судьбу ссылки (suspicious остаётся на проверке)
+DECIDED_STATUSES = ("safe", "malicious")
+
+
+class HeldMessageService:
+    """
+    Задержанные сообщения со ссылками
+
+    Текст сообщения хранится один раз (held_messages), его ссылки - строками
+    held_message_urls со своим вердиктом, а в held_messages.pending_urls -
+    число ссылок без вердикта. Вердикт по URL применяется ко всем ожидающим
+    его сообщениям одной транзакцией: ссылки переводятся в новый статус
+    одним UPDATE, сообщения с опасной ссылкой отклоняются сразу, а
+    сообщения, у которых не осталось ссылок без вердикта, публикуются.
+
+    Смена статуса сообщения - условный UPDATE ... WHERE status = 'held':
+    сообщение публикуется или отклоняется ровно один раз, даже если его
+    последние ссылки решаются одновременно в разных запросах или воркерах.
+    """
+
+    CHUNK_SIZE = 500  # id сообщений в одном запросе IN
+
+    async def hold(self, db: AsyncSession, user_id: int, username: str, display_name: str,
+                   text: str, urls: Iterable[str], manual_review: bool = False) -> HeldMessage:
+        """
+        Задержать сообщение до вердиктов по его ссылкам
+
+        Ссылки с уже известным вердиктом (индекс вердиктов, правила доменов,
+        блоклист, решённые проверки в url_checks) сразу получают статус. На
+        остальные ставится проверка URL, если её ещё нет в очереди (одна
+        непросмотренная строка url_checks на URL). manual_review=True -
+        анализ ссылок был неполным, сообщение публикует только администратор.
+        """
+        urls = list(dict.fromkeys(canonicalize_url(url) for url in urls))
+        statuses = {}
+        for url in urls:
+            verdict = dlp_engine.url_verdicts.get(url)
+            statuses[url] = verdict if verdict in DECIDED_STATUSES else "pending"
+
+        queued = set()
+        undecided = [url for url in urls if statuses[url] == "pending"]
+        if undecided:
+            # Последняя проверка каждого URL: в очереди, решена или нужна новая
+            result = await db.execute(
+                select(URLCheck.url, URLCheck.status, URLCheck.is_reviewed)
+                .where(URLCheck.url.in_(undecided))
+                .order_by(URLCheck.created_at, URLCheck.id)
+            )
+            latest = {}
+            for url, check_status, is_reviewed in result.all():
+                if check_status == "pending" and not is_reviewed:
+                    queued.add(url)
+                latest[url] = check_status if is_reviewed else None
+            for url in undecided:
+                if url not in queued and latest.get(url) in DECIDED_STATUSES:
+                    statuses[url] = latest[url]
+        pending = [url for url in urls if statuses[url] == "pending"]
+
+        held = HeldMessage(
+            user_id=user_id,
+            username=username,
+            display_name=display_name,
+            message_text=text,
+            pending_urls=len(pending),
+            manual_review=manual_review or not urls
+        )
+        if "malicious" in statuses.values():
+            # Вердикт вынесен, пока сообщение проверялось
+            held.status = "rejected"
+            held.reason = "Обнаружены опасные ссылки"
+            held.resolved_at = datetime.utcnow()
+        db.add(held)
+        await db.flush()
+
+        db.add_all([HeldMessageURL(held_message_id=held.id, url=url, status=statuses[url]) for url in urls])
+
+        if pending and held.status == "held":
+            # На проверку ставятся только URL, которых ещё нет в очереди
+            db.add_all([
+                URLCheck(url=url, user_id=user_id, username=username, display_name=display_name,
+                         message_text=text, status="pending")
+                for url in pending if url not in queued
+            ])
+
+        published = []
+        if held.status == "held" and not pending and not held.manual_review:
+            published = await self._publish(db, [held.id])
+        await db.commit()
+        await db.refresh(held)
+
+        await self._announce(published, [])
+        return held
+
+    async def resolve(self, db: AsyncSession, verdicts: Dict[str, str]) -> Dict:
+        """
+        Применить вердикты по URL ({url: status}) к задержанным сообщениям
+
+        Все затронутые сообщения решаются одной транзакцией, после неё
+        опубликованные рассылаются в чат. Возвращает списки опубликованных
+        и отклонённых сообщений.
+        """
+        by_status: Dict[str, List[str]] = {}
+        for url, url_status in verdicts.items():
+            if url_status in DECIDED_STATUSES:
+                by_status.setdefault(url_status, []).append(canonicalize_url(url))
+
+        # id сообщений по каждой решённой ссылке (сообщение повторяется столько раз, сколько ссылок решено)
+        decided: Dict[str, List[int]] = {}
+        for url_status, urls in by_status.items():
+            for chunk in self._chunks(urls):
+                result = await db.execute(
+                    update(HeldMessageURL)
+                    .where(HeldMessageURL.url.in_(chunk), HeldMessageURL.status == "pending")
+                    .values(status=url_status)
+                    .returning(HeldMessageURL.held_message_id)
+                    .execution_options(synchronize_session=False)
+                )
+                decided.setdefault(url_status, []).extend(result.scalars().all())
+
+        if not decided:
+            return {"published": [], "rejected": []}
+
+        resolved_at = datetime.utcnow()
+        rejected = []
+        for chunk in self._chunks(sorted(set(decided.get("malicious", [])))):
+            result = await db.execute(
+                update(HeldMessage)
+                .where(HeldMessage.id.in_(chunk), HeldMessage.status == "held")
+                .values(status="rejected", reason="Обнаружены опасные ссылки", resolved_at=resolved_at)
+                .returning(HeldMessage.id, HeldMessage.display_name, HeldMessage.created_at)
+                .execution_options(synchronize_session=False)
+            )
+            rejected.extend(
+                {"id": held_id, "display_name": display_name, "created_at": created_at}
+                for held_id, display_name, created_at in result.all()
+            )
+
+        # Счётчик ссылок без вердикта уменьшается на число решённых ссылок сообщения
+        counts: Dict[int, int] = {}
+        for held_id in decided.get("safe", []) + decided.get("malicious", []):
+            counts[held_id] = counts.get(held_id, 0) + 1
+        by_count: Dict[int, List[int]] = {}
+        for held_id, count in counts.items():
+            by_count.setdefault(count, []).append(held_id)
+        for count, ids in by_count.items():
+            for chunk in self._chunks(ids):
+                await db.execute(
+                    update(HeldMessage)
+                    .where(HeldMessage.id.in_(chunk))
+                    .values(pending_urls=HeldMessage.pending_urls - count)
+                    .execution_options(synchronize_session=False)
+                )
+
+        published = await self._publish(db, sorted(set(decided.get("safe", []))))
+        await db.commit()
+
+        await self._announce(published, rejected)
+        if published or rejected:
+            print(f"🔗 Задержанные сообщения: опубликовано {len(published)}, отклонено {len(rejected)}")
+        return {"published": published, "rejected": rejected}
+
+    async def resolve_pending(self, db: AsyncSession) -> Dict:
+        """
+        Применить текущие вердикты индекса ко всем ссылкам без вердикта
+
+        Нужно после изменений, которые решают сразу много URL: правила
+        домена или префикса, перезагрузки блоклиста.
+        """
+        result = await db.execute(
+            select(HeldMessageURL.url).where(HeldMessageURL.status == "pending").distinct()
+        )
+        verdicts = {}
+        for url in result.scalars().all():
+            verdict = dlp_engine.url_verdicts.get(url)
+            if verdict in DECIDED_STATUSES:
+                verdicts[url] = verdict
+        return await self.resolve(db, verdicts)
+
+    async def _publish(self, db: AsyncSession, held_ids: List[int]) -> List[Dict]:
+        """
+        Опубликовать сообщения без ссылок на проверке (в текущей транзакции)
+
+        Сообщения забираются условным UPDATE: уже решённые, ждущие других
+        ссылок и требующие ручной проверки не попадают в публикацию.
+        """
+        published = []
+        for chunk in self._chunks(held_ids):
+            result = await db.execute(
+                update(HeldMessage)
+                .where(HeldMessage.id.in_(chunk), HeldMessage.status == "held",
+                       HeldMessage.pending_urls <= 0, HeldMessage.manual_review == False)
+                .values(status="published", resolved_at=datetime.utcnow())
+                .returning(HeldMessage.id, HeldMessage.display_name, HeldMessage.message_text,
+                           HeldMessage.created_at)
+                .execution_options(synchronize_session=False)
+            )
+            published.extend(await self._insert_messages(db, result.all()))
+        return published
+
+    async def _insert_messages(self, db: AsyncSession, rows) -> List[Dict]:
+        """Запись опубликованных сообщений в messages и ссылок на них в held_messages"""
+        if not rows:
+            return []
+
+        result = await db.execute(
+            insert(Message).returning(Message.id, sort_by_parameter_order=True),
+            [{"user": display_name, "text": text} for _, display_name, text, _ in rows]
+        )
+        message_ids = result.scalars().all()
+        await db.execute(
+            update(HeldMessage),
+            [{"id": row[0], "message_id": message_id} for row, message_id in zip(rows, message_ids)]
+        )
+        return [
+            {"id": held_id, "message_id": message_id, "display_name": display_name,
+             "text": text, "created_at": created_at}
+            for (held_id, display_name, text, created_at), message_id in zip(rows, message_ids)
+        ]
+
+    async def _announce(self, published: List[Dict], rejected: List[Dict]):
+        """Рассылка решённых сообщений в чат (после фиксации транзакции)"""
+        if not published and not rejected:
+            return
+        from app.websocket.manager import manager
+
+        for item in published:
+            await manager.broadcast({
+                "type": "message",
+                "user": item["display_name"],
+                "text": item["text"],
+                "timestamp": item["created_at"].strftime("%H:%M:%S")
+            })
+        if published:
+            await manager.broadcast({
+                "type": "info",
+                "message": f"✅ Ссылки проверены, опубликовано сообщений: {len(published)}"
+            })
+        if rejected:
+            await manager.broadcast({
+                "type": "warning",
+                "message": f"⚠️ Заблокировано сообщений с опасными ссылками: {len(rejected)}"
+            })
+
+    async def publish(self, db: AsyncSession, held_id: int) -> Optional[HeldMessage]:
+        """Опубликовать задержанное сообщение решением администратора (None - уже решено)"""
+        result = await db.execute(
+            update(HeldMessage)
+            .where(HeldMessage.id == held_id, HeldMessage.status == "held")
+            .values(status="published", resolved_at=datetime.utcnow())
+            .returning(HeldMessage.id, HeldMessage.display_name, HeldMessage.message_text,
+                       HeldMessage.created_at)
+            .execution_options(synchronize_session=False)
+        )
+        published = await self._insert_messages(db, result.all())
+        await db.commit()
+        if not published:
+            return None
+
+        await self._announce(published, [])
+        return await db.get(HeldMessage, held_id, populate_existing=True)
+
+    async def reject(self, db: AsyncSession, held_id: int, reason: Optional[str] = None) -> Optional[HeldMessage]:
+        """Отклонить задержанное сообщение решением администратора (None - уже решено)"""
+        result = await db.execute(
+            update(HeldMessage)
+            .where(HeldMessage.id == held_id, HeldMessage.status == "held")
+            .values(status="rejected", reason=reason or "Отклонено администратором",
+                    resolved_at=datetime.utcnow())
+            .returning(HeldMessage.id)
+            .execution_options(synchronize_session=False)
+        )
+        rejected = result.scalar_one_or_none()
+        await db.commit()
+        if rejected is None:
+            return None
+        return await db.get(HeldMessage, held_id, populate_existing=True)
+
+    async def get_held(self, db: AsyncSession, message_status: str = "held", after_id: int = 0,
+                       limit: int = 100) -> List[Dict]:
+        """Задержанные сообщения со ссылками, страница по ключу (id > after_id)"""
+        result = await db.execute(
+            select(HeldMessage)
+            .where(HeldMessage.status == message_status, HeldMessage.id > after_id)
+            .order_by(HeldMessage.id)
+            .limit(limit)
+            .execution_options(populate_existing=True)
+        )
+        messages = list(result.scalars().all())
+        if not messages:
+            return []
+
+        result = await db.execute(
+            select(HeldMessageURL)
+            .where(HeldMessageURL.held_message_id.in_([message.id for message in messages]))
+            .order_by(HeldMessageURL.id)
+        )
+        urls: Dict[int, List[Dict]] = {}
+        for link in result.scalars().all():
+            urls.setdefault(link.held_message_id, []).append({"url": link.url, "status": link.status})
+        return [{**message.to_dict(), "urls": urls.get(message.id, [])} for message in messages]
+
+    def _chunks(self, items: List) -> Iterable[List]:
+        for start in range(0, len(items), self.CHUNK_SIZE):
+            yield items[start:start + self.CHUNK_SIZE]
+
+
+held_message_service = HeldMessageService()
@@ -0,0 +1,453 @@
+import asyncio
+import json
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, func
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.dlp.engine import dlp_engine
+from app.dlp.policy import check_phrases, compile_policy, validate_rule, DEFAULT_RULES, KEYWORD_STORE_SOURCE
+from app.dlp.guard import ScanBudget
+from app.dlp.fingerprint import fingerprint_index, fingerprint_text, pack_fingerprint, unpack_fingerprint, words
+from app.models.dlp_policy import (
+    ForbiddenKeyword, PolicyVersion, DLPRule, ConfidentialDocument, ShadowPolicy, ShadowDisagreement
+)
+
+
+class PolicyService:
+    """
+    Сервис хранения DLP политики
+
+    Ключевые слова и правила хранятся в БД, каждое изменение увеличивает номер
+    версии политики. Каждый воркер периодически читает только номер версии и,
+    если он изменился, компилирует новый план выполнения в отдельном потоке
+    и подменяет его одним присваиванием - проверка сообщений при этом
+    не останавливается.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.failed_version = 0  # Версия, которая не скомпилировалась (не перекомпилируется до следующей)
+        self._lock = asyncio.Lock()
+        self._poller: Optional[asyncio.Task] = None
+
+    async def get_version(self, db: AsyncSession) -> int:
+        """Текущая версия политики в БД"""
+        result = await db.execute(select(func.max(PolicyVersion.id)))
+        return result.scalar() or 0
+
+    async def get_keywords(self, db: AsyncSession) -> List[str]:
+        """Список запрещённых слов из БД"""
+        result = await db.execute(select(ForbiddenKeyword.keyword).order_by(ForbiddenKeyword.id))
+        return list(result.scalars().all())
+
+    async def get_rules(self, db: AsyncSession) -> List[DLPRule]:
+        """Все правила политики из БД в порядке сканирования"""
+        result = await db.execute(select(DLPRule).order_by(DLPRule.position, DLPRule.id))
+        return list(result.scalars().all())
+
+    async def get_policy_rules(self, db: AsyncSession) -> Tuple[List[Dict], List[str]]:
+        """
+        Описания включённых правил, готовые к компиляции, и список слов
+
+        Правилам со словами из хранилища подставляется текущий список слов.
+        Если все правила выключены, политика пуста (правила по умолчанию
+        создаются один раз, см. seed_defaults).
+        """
+        keywords = await self.get_keywords(db)
+        rules = [json.loads(rule.definition) for rule in await self.get_rules(db) if rule.is_enabled]
+        return self._with_keywords(rules, keywords), keywords
+
+    def _with_keywords(self, rules: List[Dict], keywords: List[str]) -> List[Dict]:
+        """Подстановка текущего списка слов в правила со словами из хранилища"""
+        for rule in rules:
+            if rule.get("source") == KEYWORD_STORE_SOURCE:
+                rule["keywords"] = keywords
+        return rules
+
+    async def load(self, db: AsyncSession):
+        """Загрузить политику из БД и атомарно подменить план выполнения"""
+        async with self._lock:
+            version = await self.get_version(db)
+            if version and version in (self.version, self.failed_version):
+                return
+
+            rules, keywords = await self.get_policy_rules(db)
+
+            # Компилируем план вне цикла событий, старый продолжает работать
+            try:
+                budget = ScanBudget(settings.DLP_SCAN_BUDGET_MS, settings.DLP_SCAN_FAIL_CLOSED)
+                plan = await asyncio.to_thread(compile_policy, rules, version, dlp_engine.text_analyzer, budget)
+            except (ValueError, re.error) as e:
+                # Остаётся прежний план (и прежний индекс отпечатков)
+                self.failed_version = version
+                print(f"⚠️ DLP политика v{version} не загружена: {e}")
+                return
+
+            await self._sync_fingerprints(db)
+            dlp_engine.load_plan(plan)
+            self.version = version
+
+            print(f"🛡️ DLP политика v{version} загружена: {len(rules)} правил, {len(keywords)} запрещённых слов")
+
+            await self._load_shadow(db, version, keywords, budget)
+
+    async def _load_shadow(self, db: AsyncSession, version: int, keywords: List[str], budget: ScanBudget):
+        """Загрузить кандидатную политику теневого режима (или выключить его)"""
+        shadow = await self.get_shadow(db)
+        if shadow is None:
+            dlp_engine.shadow.clear()
+            return
+
+        rules = self._with_keywords(json.loads(shadow.definition), keywords)
+        try:
+            candidate = await asyncio.to_thread(compile_policy, rules, version, None, budget)
+        except (ValueError, re.error) as e:
+            dlp_engine.shadow.clear()
+            print(f"⚠️ Кандидатная политика #{shadow.id} не загружена: {e}")
+            return
+
+        dlp_engine.shadow.load(candidate, shadow.id, shadow.sample_rate)
+        print(f"👥 Теневая проверка кандидатной политики #{shadow.id}: {len(rules)} правил, "
+              f"доля сообщений {shadow.sample_rate}")
+
+    async def _sync_fingerprints(self, db: AsyncSession):
+        """
+        Привести индекс отпечатков к списку документов в БД
+
+        Загружаются только новые документы и удаляются удалённые,
+        индекс не перестраивается.
+        """
+        result = await db.execute(select(ConfidentialDocument.id))
+        stored = set(result.scalars().all())
+
+        for document_id in fingerprint_index.document_ids - stored:
+            fingerprint_index.remove(document_id)
+
+        new_ids = stored - fingerprint_index.document_ids
+        if new_ids:
+            result = await db.execute(select(ConfidentialDocument).where(ConfidentialDocument.id.in_(new_ids)))
+            for document in result.scalars().all():
+                fingerprint_index.add(document.id, document.name, unpack_fingerprint(document.fingerprint))
+
+    async def _check_policy(self, db: AsyncSession):
+        """
+        Компиляция политики с изменениями текущей транзакции до их фиксации
+
+        Ошибка, которая проявляется только в полном наборе правил (ссылка
+        на удалённый детектор, конфликт паттернов в общем сканере), не
+        попадает в БД: транзакция откатывается, бросается ValueError.
+        """
+        await db.flush()
+        rules, _ = await self.get_policy_rules(db)
+        try:
+            await asyncio.to_thread(compile_policy, rules)
+        except (ValueError, re.error) as e:
+            await db.rollback()
+            raise ValueError(f"Политика с этим изменением не компилируется: {e}")
+
+    async def _bump_version(self, db: AsyncSession, change: str) -> PolicyVersion:
+        """Зафиксировать новую версию политики"""
+        policy_version = PolicyVersion(change=change)
+        db.add(policy_version)
+        await db.flush()
+        return policy_version
+
+    async def add_keyword(self, db: AsyncSession, keyword: str) -> bool:
+        """Добавить запрещённое слово. Возвращает False, если оно уже есть"""
+        keyword = keyword.strip().lower()
+        check_phrases([keyword])
+
+        result = await db.execute(select(ForbiddenKeyword).where(ForbiddenKeyword.keyword == keyword))
+        if result.scalar_one_or_none():
+            return False
+
+        db.add(ForbiddenKeyword(keyword=keyword))
+        await self._bump_version(db, f"add keyword: {keyword}")
+        await db.commit()
+
+        await self.load(db)
+        return True
+
+    async def remove_keyword(self, db: AsyncSession, keyword: str) -> bool:
+        """Удалить запрещённое слово. Возвращает False, если его не было"""
+        keyword = keyword.strip().lower()
+
+        result = await db.execute(delete(ForbiddenKeyword).where(ForbiddenKeyword.keyword == keyword))
+        if not result.rowcount:
+            await db.rollback()
+            return False
+
+        await self._bump_version(db, f"remove keyword: {keyword}")
+        await db.commit()
+
+        await self.load(db)
+        return True
+
+    async def put_rule(self, db: AsyncSession, rule: Dict) -> DLPRule:
+        """Создать или заменить правило. Бросает ValueError при ошибке в описании"""
+        validate_rule(rule)
+
+        result = await db.execute(select(DLPRule).where(DLPRule.rule_id == rule["id"]))
+        db_rule = result.scalar_one_or_none()
+
+        if db_rule:
+            db_rule.definition = json.dumps(rule, ensure_ascii=False)
+        else:
+            position = (await db.execute(select(func.max(DLPRule.position)))).scalar() or 0
+            db_rule = DLPRule(
+                rule_id=rule["id"],
+                position=position + 1,
+                definition=json.dumps(rule, ensure_ascii=False)
+            )
+            db.add(db_rule)
+
+        await self._check_policy(db)
+        await self._bump_version(db, f"put rule: {rule['id']}")
+        await db.commit()
+        await db.refresh(db_rule)
+
+        await self.load(db)
+        return db_rule
+
+    async def set_rule_enabled(self, db: AsyncSession, rule_id: str, enabled: bool) -> Optional[DLPRule]:
+        """Включить или выключить правило. Бросает ValueError, если политика без него не компилируется"""
+        result = await db.execute(select(DLPRule).where(DLPRule.rule_id == rule_id))
+        db_rule = result.scalar_one_or_none()
+        if not db_rule:
+            return None
+
+        db_rule.is_enabled = enabled
+        await self._check_policy(db)
+        await self._bump_version(db, f"{'enable' if enabled else 'disable'} rule: {rule_id}")
+        await db.commit()
+        await db.refresh(db_rule)
+
+        await self.load(db)
+        return db_rule
+
+    async def delete_rule(self, db: AsyncSession, rule_id: str) -> bool:
+        """
+        Удалить правило. Возвращает False, если его не было
+
+        Бросает ValueError, если на детектор правила ссылаются правила близости.
+        """
+        result = await db.execute(delete(DLPRule).where(DLPRule.rule_id == rule_id))
+        if not result.rowcount:
+            await db.rollback()
+            return False
+
+        await self._check_policy(db)
+        await self._bump_version(db, f"delete rule: {rule_id}")
+        await db.commit()
+
+        await self.load(db)
+        return True
+
+    async def get_documents(self, db: AsyncSession) -> List[ConfidentialDocument]:
+        """Зарегистрированные конфиденциальные документы"""
+        result = await db.execute(select(ConfidentialDocument).order_by(ConfidentialDocument.id))
+        return list(result.scalars().all())
+
+    async def register_document(self, db: AsyncSession, name: str, text: str,
+                                filename: Optional[str] = None) -> ConfidentialDocument:
+        """
+        Зарегистрировать конфиденциальный документ по его тексту
+
+        В БД сохраняется только отпечаток. Бросает ValueError, если
+        в документе нет текста.
+        """
+        word_count = len(words(text))
+        if not word_count:
+            raise ValueError("В документе нет текста")
+
+        chunks = await asyncio.to_thread(fingerprint_text, text)
+        document = ConfidentialDocument(
+            name=name,
+            filename=filename,
+            word_count=word_count,
+            chunk_count=len(chunks),
+            fingerprint=pack_fingerprint(chunks)
+        )
+        db.add(document)
+        await self._bump_version(db, f"register document: {name}")
+        await db.commit()
+        await db.refresh(document)
+
+        await self.load(db)
+        return document
+
+    async def remove_document(self, db: AsyncSession, document_id: int) -> bool:
+        """Удалить документ из реестра. Возвращает False, если его не было"""
+        result = await db.execute(delete(ConfidentialDocument).where(ConfidentialDocument.id == document_id))
+        if not result.rowcount:
+            await db.rollback()
+            return False
+
+        await self._bump_version(db, f"remove document: {document_id}")
+        await db.commit()
+
+        await self.load(db)
+        return True
+
+    async def get_shadow(self, db: AsyncSession) -> Optional[ShadowPolicy]:
+        """Кандидатная политика, проверяемая в теневом режиме"""
+        result = await db.execute(
+            select(ShadowPolicy).where(ShadowPolicy.status == "active").order_by(ShadowPolicy.id.desc()).limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    async def get_disagreements(self, db: AsyncSession, shadow_id: int, after_id: int = 0,
+                                limit: int = 100) -> List[ShadowDisagreement]:
+        """Расхождения вердиктов кандидатной политики, страница по ключу (id > after_id)"""
+        result = await db.execute(
+            select(ShadowDisagreement)
+            .where(ShadowDisagreement.shadow_id == shadow_id, ShadowDisagreement.id > after_id)
+            .order_by(ShadowDisagreement.id)
+            .limit(limit)
+        )
+        return list(result.scalars().all())
+
+    async def count_disagreements(self, db: AsyncSession, shadow_id: int) -> int:
+        """Число записанных расхождений (всеми воркерами)"""
+        result = await db.execute(
+            select(func.count(ShadowDisagreement.id)).where(ShadowDisagreement.shadow_id == shadow_id)
+        )
+        return result.scalar() or 0
+
+    async def start_shadow(self, db: AsyncSession, rules: List[Dict], sample_rate: float,
+                           name: Optional[str] = None) -> ShadowPolicy:
+        """
+        Запустить теневую проверку кандидатной политики
+
+        Прежний кандидат отбрасывается. Бросает ValueError при ошибке
+        в описании правил.
+        """
+        if not rules:
+            raise ValueError("В кандидатной политике нет правил")
+        if not 0 < sample_rate <= 1:
+            raise ValueError("Доля сообщений должна быть в диапазоне (0, 1]")
+
+        keywords = await self.get_keywords(db)
+        # План компилируется заранее: ошибка в regex видна сразу, а не в воркерах
+        try:
+            await asyncio.to_thread(compile_policy, self._with_keywords([dict(rule) for rule in rules], keywords))
+        except re.error as e:
+            raise ValueError(f"Ошибка в регулярном выражении: {e}")
+
+        await self._finish_shadow(db, "discarded")
+        shadow = ShadowPolicy(
+            name=name,
+            definition=json.dumps(rules, ensure_ascii=False),
+            sample_rate=sample_rate
+        )
+        db.add(shadow)
+        await self._bump_version(db, f"start shadow policy: {name or len(rules)}")
+        await db.commit()
+        await db.refresh(shadow)
+
+        await self.load(db)
+        return shadow
+
+    async def discard_shadow(self, db: AsyncSession) -> Optional[ShadowPolicy]:
+        """Отбросить кандидатную политику. Возвращает None, если её не было"""
+        shadow = await self._finish_shadow(db, "discarded")
+        if shadow is None:
+            return None
+
+        await self._bump_version(db, f"discard shadow policy: {shadow.id}")
+        await db.commit()
+
+        await self.load(db)
+        return shadow
+
+    async def promote_shadow(self, db: AsyncSession) -> Optional[ShadowPolicy]:
+        """
+        Сделать кандидатную политику активной
+
+        Правила политики заменяются правилами кандидата (в том же порядке),
+        список запрещённых слов не меняется. Возвращает None, если
+        кандидата нет.
+        """
+        shadow = await self._finish_shadow(db, "promoted")
+        if shadow is None:
+            return None
+
+        await db.execute(delete(DLPRule))
+        for position, rule in enumerate(json.loads(shadow.definition), start=1):
+            definition = {key: value for key, value in rule.items()
+                          if not (key == "keywords" and rule.get("source") == KEYWORD_STORE_SOURCE)}
+            db.add(DLPRule(
+                rule_id=rule["id"],
+                position=position,
+                definition=json.dumps(definition, ensure_ascii=False)
+            ))
+
+        await self._check_policy(db)
+        await self._bump_version(db, f"promote shadow policy: {shadow.id}")
+        await db.commit()
+
+        await self.load(db)
+        return shadow
+
+    async def _finish_shadow(self, db: AsyncSession, new_status: str) -> Optional[ShadowPolicy]:
+        """Завершить теневую проверку текущего кандидата"""
+        shadow = await self.get_shadow(db)
+        if shadow is not None:
+            shadow.status = new_status
+            shadow.finished_at = datetime.utcnow()
+        return shadow
+
+    async def seed_defaults(self, db: AsyncSession, keywords: List[str]):
+        """Заполнить слова и правила по умолчанию, если они ещё не создавались"""
+        changes = []
+
+        if not await self.get_version(db):
+            for keyword in keywords:
+                db.add(ForbiddenKeyword(keyword=keyword))
+            changes.append("default keywords")
+
+        if not await self.get_rules(db):
+            for position, rule in enumerate(DEFAULT_RULES, start=1):
+                definition = {key: value for key, value in rule.items() if key != "keywords"}
+                db.add(DLPRule(
+                    rule_id=rule["id"],
+                    position=position,
+                    definition=json.dumps(definition, ensure_ascii=False)
+                ))
+            changes.append("default rules")
+
+        if changes:
+            await self._bump_version(db, ", ".join(changes))
+            await db.commit()
+
+    async def _poll(self):
+        """Фоновая проверка версии политики"""
+        while True:
+            await asyncio.sleep(settings.DLP_POLICY_POLL_SECONDS)
+            try:
+                async with AsyncSessionLocal() as db:
+                    if await self.get_version(db) != self.version:
+                        await self.load(db)
+            except Exception as e:
+                print(f"⚠️ Ошибка обновления DLP политики: {e}")
+
+    def start(self):
+        """Запустить фоновую проверку версии"""
+        if self._poller is None:
+            self._poller = asyncio.create_task(self._poll())
+
+    async def stop(self):
+        """Остановить фоновую проверку версии"""
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+            self._poller = None
+
+
+policy_service = PolicyService()
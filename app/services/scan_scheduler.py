@@ -0,0 +1,432 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, func, or_
+from app.config import settings
+from app.dlp.engine import dlp_engine
+from app.models.file import UploadedFile
+from app.models.url_check import URLCheck
+from app.services.held_message_service import held_message_service
+from app.services.virustotal_service import virustotal_service
+
+
+# Элемент очереди: ("url", URL) или ("file", SHA-256 содержимого)
+ScanKey = Tuple[str, str]
+
+# Итоговые статусы VirusTotal
+FINAL_STATUSES = ("clean", "malicious", "suspicious")
+
+# Сохранённые результаты (json.dumps): анализ ещё идёт / решение оставлено администратору
+SCANNING_RESULT = '"status": "scanning"'
+SUSPICIOUS_RESULT = '"status": "suspicious"'
+
+
+def _stored_analysis(vt_result: Optional[str]) -> Optional[str]:
+    """analysis_id из сохранённого результата проверки, если анализ ещё идёт"""
+    try:
+        result = json.loads(vt_result) if vt_result else {}
+    except ValueError:
+        return None
+    if not isinstance(result, dict) or result.get("status") != "scanning":
+        return None
+    return result.get("analysis_id")
+
+
+def _file_sha256(path: str) -> str:
+    """SHA-256 файла (читается блоками)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ScanScheduler:
+    """
+    Фоновая проверка ожидающих URL и файлов через VirusTotal
+
+    Раз в POLL_SECONDS (или сразу после notify) выбирает из БД URL на
+    проверке (url_checks: pending, без вердикта) и файлы с модерацией
+    virustotal, ещё не проверенные. Работает только с настоящим ключом
+    API: имитация результатов не должна решать судьбу сообщений. Одинаковые URL и файлы с одинаковым
+    содержимым проверяются одним запросом, вердикт применяется ко всем
+    строкам. Одновременно идёт не больше VIRUSTOTAL_CONCURRENCY проверок,
+    частоту запросов ограничивает квота VirusTotalService: новые проверки
+    берутся только на освободившиеся места, очередь остаётся в БД.
+
+    Запущенный анализ (scanning с analysis_id) опрашивается с растущим
+    интервалом, в том числе анализ, запущенный проверкой по кнопке
+    администратора (analysis_id в сохранённом результате). Ошибки
+    повторяются с экспоненциальной задержкой. Вердикт по URL применяется
+    как решение администратора: индекс вердиктов и задержанные сообщения.
+    Подозрительные URL и файлы остаются на проверке с сохранённым
+    результатом VirusTotal - их решает администратор.
+
+    Очередь живёт в БД, а не в памяти: после перезапуска проверка
+    продолжается, повторные запросы по уже проверенным URL и файлам
+    отвечаются готовыми отчётами VirusTotal.
+    """
+
+    POLL_SECONDS = 5.0  # Период выборки очереди без событий
+    RETRY_BASE_SECONDS = 30.0  # Первая повторная попытка после ошибки
+    RETRY_MAX_SECONDS = 3600.0
+    ANALYSIS_BASE_SECONDS = 15.0  # Первый опрос результата анализа
+    ANALYSIS_MAX_SECONDS = 600.0
+    MAX_ANALYSIS_POLLS = 10  # После этого анализ запрашивается заново
+    LAG_SAMPLES = 1000  # Замеров задержки от постановки в очередь до вердикта
+
+    def __init__(self):
+        self.concurrency = settings.VIRUSTOTAL_CONCURRENCY
+        self._session_factory = None
+        self._runner: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._tasks: Dict[ScanKey, asyncio.Task] = {}
+        self._retry: Dict[ScanKey, Tuple[float, int]] = {}  # ключ -> (когда повторить, попыток)
+        self._analyses: Dict[ScanKey, Dict] = {}  # ключ -> {analysis_id, polls, next_at}
+        self._file_hashes: Dict[int, str] = {}  # id файла -> SHA-256
+        self._seen_analyses: set = set()  # analysis_id из БД, уже взятые на опрос
+
+        self.scanned = dict.fromkeys(FINAL_STATUSES, 0)
+        self.errors = 0
+        self.deduplicated = 0  # Строк, получивших вердикт без отдельного запроса
+        self.queue_urls = 0
+        self.queue_files = 0
+        self.oldest_pending_at: Optional[datetime] = None
+        self._lag: deque = deque(maxlen=self.LAG_SAMPLES)
+
+    def start(self, session_factory):
+        """Запустить фоновую проверку"""
+        if not settings.VIRUSTOTAL_AUTO_SCAN or self._runner is not None:
+            return
+        if not virustotal_service.is_configured():
+            print("⚠️ Фоновая проверка VirusTotal отключена: не задан VIRUSTOTAL_API_KEY")
+            return
+        self._session_factory = session_factory
+        self._runner = asyncio.create_task(self._run())
+
+    def notify(self):
+        """В очереди появились новые URL или файлы - выбрать их, не дожидаясь периода"""
+        self._wakeup.set()
+
+    async def stop(self):
+        """Остановить фоновую проверку (при остановке сервера)"""
+        tasks = list(self._tasks.values())
+        if self._runner is not None:
+            tasks.append(self._runner)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._runner = None
+        self._tasks.clear()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._tick()
+            except Exception as e:
+                print(f"⚠️ Ошибка фоновой проверки VirusTotal: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _tick(self):
+        """Выборка очереди и запуск проверок на свободные места"""
+        free = self.concurrency - len(self._tasks)
+        now = time.monotonic()
+
+        # Сначала - опрос уже запущенных анализов
+        for key, analysis in list(self._analyses.items()):
+            if free > 0 and analysis["next_at"] <= now and key not in self._tasks:
+                self._spawn(key, self._poll(key, analysis))
+                free -= 1
+
+        async with self._session_factory() as db:
+            urls = await self._pending_urls(db)
+            files = await self._pending_files(db)
+
+        for key, target in urls + files:
+            if free <= 0:
+                break
+            if key in self._tasks or key in self._analyses:
+                continue
+            retry = self._retry.get(key)
+            if retry is not None and retry[0] > now:
+                continue
+            self._spawn(key, self._scan(key, target))
+            free -= 1
+
+    async def _pending_urls(self, db) -> List[Tuple[ScanKey, str]]:
+        """Уникальные URL на проверке, давно ждущие первыми"""
+        pending = (URLCheck.status == "pending", URLCheck.is_reviewed == False,
+                   or_(URLCheck.virustotal_result == None, ~URLCheck.virustotal_result.contains(SUSPICIOUS_RESULT)))
+        result = await db.execute(
+            select(func.count(func.distinct(URLCheck.url)), func.min(URLCheck.created_at)).where(*pending)
+        )
+        self.queue_urls, oldest_url = result.one()
+
+        # Анализы, запущенные проверкой по кнопке, опрашиваются, а не запускаются заново
+        result = await db.execute(
+            select(URLCheck.url, URLCheck.virustotal_result)
+            .where(*pending, URLCheck.virustotal_result.contains(SCANNING_RESULT))
+        )
+        for url, vt_result in result.all():
+            self._resume_analysis(("url", url), vt_result)
+
+        # Заведомо больше, чем можно запустить: часть URL может ждать повтора или анализа
+        limit = self.concurrency + len(self._retry) + len(self._analyses) + len(self._tasks)
+        result = await db.execute(
+            select(URLCheck.url)
+            .where(*pending)
+            .group_by(URLCheck.url)
+            .order_by(func.min(URLCheck.created_at))
+            .limit(limit)
+        )
+        self._update_oldest(oldest_url, None)
+        return [(("url", url), url) for url in result.scalars().all()]
+
+    async def _pending_files(self, db) -> List[Tuple[ScanKey, str]]:
+        """
+        Непроверенные файлы с модерацией virustotal и файлы, отправленные на
+        анализ по кнопке администратора; одинаковое содержимое - один элемент
+        """
+        result = await db.execute(
+            select(UploadedFile.id, UploadedFile.file_path, UploadedFile.created_at, UploadedFile.virustotal_result)
+            .where(UploadedFile.status == "pending",
+                   or_(UploadedFile.moderation_type == "virustotal",
+                       UploadedFile.virustotal_result.contains(SCANNING_RESULT)),
+                   or_(UploadedFile.virustotal_result == None,
+                       ~UploadedFile.virustotal_result.contains(SUSPICIOUS_RESULT)))
+            .order_by(UploadedFile.id)
+        )
+        rows = result.all()
+        self.queue_files = len(rows)
+        # Файлы, решённые администратором, больше не нужны в кэше хэшей
+        pending_ids = {row[0] for row in rows}
+        for file_id in [file_id for file_id in self._file_hashes if file_id not in pending_ids]:
+            del self._file_hashes[file_id]
+        self._update_oldest(self.oldest_pending_at, rows[0][2] if rows else None)
+
+        items: Dict[ScanKey, str] = {}
+        for file_id, file_path, _, vt_result in rows:
+            file_hash = self._file_hashes.get(file_id)
+            if file_hash is None:
+                try:
+                    file_hash = await asyncio.to_thread(_file_sha256, file_path)
+                except OSError as e:
+                    print(f"⚠️ Файл {file_path} недоступен для проверки VirusTotal: {e}")
+                    continue
+                self._file_hashes[file_id] = file_hash
+            self._resume_analysis(("file", file_hash), vt_result)
+            items.setdefault(("file", file_hash), file_path)
+        return list(items.items())
+
+    def _resume_analysis(self, key: ScanKey, vt_result: Optional[str]):
+        """Взять на опрос анализ из сохранённого результата (каждый analysis_id - один раз)"""
+        analysis_id = _stored_analysis(vt_result)
+        if analysis_id is None or analysis_id in self._seen_analyses:
+            return
+        self._seen_analyses.add(analysis_id)
+        if key not in self._analyses and key not in self._tasks:
+            self._analyses[key] = {"analysis_id": analysis_id, "polls": 0, "next_at": time.monotonic()}
+
+    def _update_oldest(self, oldest_url: Optional[datetime], oldest_file: Optional[datetime]):
+        values = [value for value in (oldest_url, oldest_file) if value is not None]
+        self.oldest_pending_at = min(values) if values else None
+
+    def _spawn(self, key: ScanKey, coro):
+        task = asyncio.create_task(coro)
+        self._tasks[key] = task
+
+        def done(_):
+            self._tasks.pop(key, None)
+            if not task.cancelled() and task.exception() is not None:
+                # Ошибка применения вердикта (БД и т.п.) - повтор с отсрочкой,
+                # а не сразу, чтобы не тратить квоту на тот же ключ
+                self.errors += 1
+                self._analyses.pop(key, None)
+                self._schedule_retry(key)
+                print(f"⚠️ Ошибка проверки VirusTotal ({key[1]}): {task.exception()}")
+            # Место освободилось - можно брать следующий элемент очереди
+            self.notify()
+
+        task.add_done_callback(done)
+
+    async def _scan(self, key: ScanKey, target: str):
+        """Проверка URL или файла (target - URL или путь к файлу)"""
+        kind = key[0]
+        if kind == "url":
+            result = await virustotal_service.scan_url(target)
+        else:
+            result = await virustotal_service.scan_file(target)
+        await self._handle(key, result)
+
+    async def _poll(self, key: ScanKey, analysis: Dict):
+        """Опрос результата запущенного анализа"""
+        result = await virustotal_service.get_analysis(analysis["analysis_id"], key[0])
+        if result.get("status") == "scanning":
+            analysis["polls"] += 1
+            if analysis["polls"] >= self.MAX_ANALYSIS_POLLS:
+                # Анализ завис - запрашиваем заново (сначала готовый отчёт)
+                del self._analyses[key]
+                self._schedule_retry(key)
+            else:
+                analysis["next_at"] = time.monotonic() + min(
+                    self.ANALYSIS_BASE_SECONDS * 2 ** analysis["polls"], self.ANALYSIS_MAX_SECONDS
+                )
+            return
+
+        del self._analyses[key]
+        await self._handle(key, result)
+
+    async def _handle(self, key: ScanKey, result: Dict):
+        """Применить ответ VirusTotal"""
+        vt_status = result.get("status")
+        if vt_status == "scanning":
+            if result.get("analysis_id"):
+                self._analyses[key] = {
+                    "analysis_id": result["analysis_id"],
+                    "polls": 0,
+                    "next_at": time.monotonic() + self.ANALYSIS_BASE_SECONDS
+                }
+            else:
+                self._schedule_retry(key, self.ANALYSIS_BASE_SECONDS)
+            return
+
+        if vt_status not in FINAL_STATUSES:
+            self.errors += 1
+            self._schedule_retry(key)
+            print(f"⚠️ VirusTotal: {result.get('summary')} ({key[1]})")
+            return
+
+        if key[0] == "url":
+            await self._apply_url(key[1], result)
+        else:
+            await self._apply_file(key[1], result)
+        # Отсрочка сбрасывается только после того, как вердикт записан
+        self._retry.pop(key, None)
+        self.scanned[vt_status] += 1
+
+    def _schedule_retry(self, key: ScanKey, delay: Optional[float] = None):
+        attempts = self._retry.get(key, (0.0, 0))[1] + 1
+        if delay is None:
+            delay = min(self.RETRY_BASE_SECONDS * 2 ** (attempts - 1), self.RETRY_MAX_SECONDS)
+        self._retry[key] = (time.monotonic() + delay, attempts)
+
+    async def _apply_url(self, url: str, result: Dict):
+        """
+        Вердикт по URL - всем строкам на проверке, индексу вердиктов и задержанным сообщениям
+
+        Подозрительный URL остаётся на проверке (pending, не просмотрен) с
+        результатом VirusTotal: решение за администратором.
+        """
+        url_status = "safe" if result["status"] == "clean" else result["status"]
+        async with self._session_factory() as db:
+            rows = await db.execute(
+                select(URLCheck)
+                .where(URLCheck.url == url, URLCheck.status == "pending", URLCheck.is_reviewed == False)
+                .order_by(URLCheck.created_at, URLCheck.id)
+            )
+            checks = list(rows.scalars().all())
+            if not checks:
+                return  # Решено администратором, пока шла проверка
+
+            vt_result = json.dumps(result, ensure_ascii=False)
+            for check in checks:
+                check.virustotal_result = vt_result
+                if url_status != "suspicious":
+                    check.status = url_status
+                    check.is_reviewed = True
+            await db.commit()
+
+            if url_status == "suspicious":
+                print(f"⚠️ VirusTotal (авто): {url} подозрителен, оставлен администратору")
+                return
+
+            latest = checks[-1]
+            dlp_engine.update_url_verdict(url, url_status, latest.created_at, latest.id)
+            resolved = await held_message_service.resolve(db, {url: url_status})
+
+        self.deduplicated += len(checks) - 1
+        self._lag.append((datetime.utcnow() - checks[0].created_at).total_seconds())
+        print(f"🔎 VirusTotal (авто): {url} -> {url_status}, опубликовано {len(resolved['published'])}, "
+              f"отклонено {len(resolved['rejected'])}")
+
+    async def _apply_file(self, file_hash: str, result: Dict):
+        """Вердикт по содержимому - всем непроверенным файлам с этим хэшем"""
+        from app.websocket.manager import manager
+
+        file_ids = [file_id for file_id, value in self._file_hashes.items() if value == file_hash]
+        async with self._session_factory() as db:
+            rows = await db.execute(
+                select(UploadedFile)
+                .where(UploadedFile.id.in_(file_ids),
+                       UploadedFile.status == "pending",
+                       or_(UploadedFile.virustotal_result == None,
+                           ~UploadedFile.virustotal_result.contains(SUSPICIOUS_RESULT)))
+            )
+            files = list(rows.scalars().all())
+
+            vt_result = json.dumps(result, ensure_ascii=False)
+            for file_obj in files:
+                file_obj.virustotal_result = vt_result
+                # Подозрительные файлы остаются на ручную проверку
+                if result["status"] == "clean":
+                    file_obj.status = "approved"
+                elif result["status"] == "malicious":
+                    file_obj.status = "rejected"
+            await db.commit()
+
+        for file_id in file_ids:
+            self._file_hashes.pop(file_id, None)
+        if not files:
+            return
+
+        self.deduplicated += len(files) - 1
+        self._lag.append((datetime.utcnow() - min(f.created_at for f in files)).total_seconds())
+        print(f"🔎 VirusTotal (авто): файлов {len(files)} -> {result['status']}")
+
+        for file_obj in files:
+            await manager.broadcast({
+                "type": "file_status_update",
+                "file_id": file_obj.id,
+                "status": file_obj.status
+            })
+
+    def stats(self) -> Dict:
+        """Глубина очереди, задержка и квота фоновой проверки"""
+        def percentile(values: List[float], q: float) -> Optional[float]:
+            if not values:
+                return None
+            values = sorted(values)
+            return round(values[min(len(values) - 1, int(q * len(values)))], 1)
+
+        lag = list(self._lag)
+        return {
+            "enabled": settings.VIRUSTOTAL_AUTO_SCAN and virustotal_service.is_configured(),
+            "running": self._runner is not None,
+            "queue": {
+                "urls": self.queue_urls,
+                "files": self.queue_files,
+                "oldest_pending_seconds": round((datetime.utcnow() - self.oldest_pending_at).total_seconds(), 1)
+                if self.oldest_pending_at else None
+            },
+            "in_flight": len(self._tasks),
+            "awaiting_analysis": len(self._analyses),
+            "backoff": len(self._retry),
+            "scanned": dict(self.scanned),
+            "errors": self.errors,
+            "deduplicated": self.deduplicated,
+            "lag_seconds": {"p50": percentile(lag, 0.5), "p95": percentile(lag, 0.95),
+                            "max": round(max(lag), 1) if lag else None},
+            "quota": virustotal_service.quota.stats()
+        }
+
+
+# Глобальный планировщик фоновой проверки
+scan_scheduler = ScanScheduler()
@@ -1,9 +1,59 @@
 import aiohttp
+import asyncio
 import hashlib
+import time
+from collections import deque
 from pathlib import Path
 from app.config import settings
 
 
+class RequestQuota:
+    """
+    Квота запросов к API: не больше per_minute запросов в скользящем окне
+
+    Запрос сверх квоты ждёт освобождения окна, а не получает 429 от API.
+    Квота общая для фоновой проверки и проверок по кнопке администратора.
+    """
+
+    WINDOW_SECONDS = 60.0
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self._sent = deque()
+        self._lock = asyncio.Lock()
+        self.requests = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    async def acquire(self):
+        """Дождаться места в квоте и занять его"""
+        if self.per_minute <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                while self._sent and self._sent[0] <= now - self.WINDOW_SECONDS:
+                    self._sent.popleft()
+                if len(self._sent) < self.per_minute:
+                    self._sent.append(now)
+                    self.requests += 1
+                    return
+                delay = self._sent[0] + self.WINDOW_SECONDS - now
+                self.waits += 1
+                self.wait_seconds += delay
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "per_minute": self.per_minute,
+            "used": sum(1 for sent in self._sent if sent > now - self.WINDOW_SECONDS),
+            "requests": self.requests,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 1)
+        }
+
+
 class VirusTotalService:
     """Сервис для работы с VirusTotal API"""
 
@@ -11,6 +61,11 @@ class VirusTotalService:
 
     def __init__(self):
         self.api_key = settings.VIRUSTOTAL_API_KEY
+        self.quota = RequestQuota(settings.VIRUSTOTAL_REQUESTS_PER_MINUTE)
+
+    def is_configured(self) -> bool:
+        """Задан ли настоящий ключ API (без него результаты имитируются)"""
+        return self.api_key != "your_api_key_here"
 
     async def scan_file(self, file_path: str) -> dict:
         """
@@ -37,6 +92,7 @@ class VirusTotalService:
 
                 # Проверяем существующий отчёт
                 url = f"{self.BASE_URL}/files/{file_hash}"
+                await self.quota.acquire()
                 async with session.get(url, headers=headers) as response:
                     if response.status == 200:
                         data = await response.json()
@@ -49,6 +105,7 @@ class VirusTotalService:
                                filename=Path(file_path).name,
                                content_type='application/octet-stream')
 
+                await self.quota.acquire()
                 async with session.post(url, headers=headers, data=data) as response:
                     if response.status == 200:
                         result = await response.json()
@@ -116,6 +173,7 @@ class VirusTotalService:
 
                 # Проверяем существующий отчёт
                 check_url = f"{self.BASE_URL}/urls/{url_id}"
+                await self.quota.acquire()
                 async with session.get(check_url, headers=headers) as response:
                     if response.status == 200:
                         data = await response.json()
@@ -126,12 +184,15 @@ class VirusTotalService:
                 data = aiohttp.FormData()
                 data.add_field('url', url)
 
+                await self.quota.acquire()
                 async with session.post(scan_url, headers=headers, data=data) as response:
                     if response.status == 200:
+                        result = await response.json()
                         return {
                             "status": "scanning",
                             "summary": "URL отправлен на проверку. Результат будет доступен через несколько секунд.",
-                            "url": url
+                            "url": url,
+                            "analysis_id": result.get("data", {}).get("id")
                         }
                     else:
                         return {
@@ -145,6 +206,45 @@ class VirusTotalService:
                 "summary": f"Ошибка при проверке URL: {str(e)}"
             }
 
+    async def get_analysis(self, analysis_id: str, kind: str = "file") -> dict:
+        """
+        Результат анализа, запущенного scan_file / scan_url (по analysis_id)
+
+        Пока анализ не завершён, возвращает статус scanning.
+        kind - "file" или "url" (формат сводки).
+        """
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {"x-apikey": self.api_key}
+
+                await self.quota.acquire()
+                async with session.get(f"{self.BASE_URL}/analyses/{analysis_id}", headers=headers) as response:
+                    if response.status != 200:
+                        return {
+                            "status": "error",
+                            "summary": f"Ошибка получения результата анализа: {response.status}"
+                        }
+                    data = await response.json()
+
+            attributes = data.get("data", {}).get("attributes", {})
+            if attributes.get("status") != "completed":
+                return {
+                    "status": "scanning",
+                    "summary": "Анализ ещё не завершён",
+                    "analysis_id": analysis_id
+                }
+
+            # Сводка анализа в формате отчёта по файлу или URL
+            report = {"data": {"attributes": {"last_analysis_stats": attributes.get("stats", {})}}}
+            return self._parse_url_report(report) if kind == "url" else self._parse_report(report)
+
+        except Exception as e:
+            return {
+                "status": "error",
+                "summary": f"Ошибка получения результата анализа: {str(e)}"
+            }
+
     async def _mock_url_scan_result(self, url: str) -> dict:
         """Имитация результата проверки URL для тестирования"""
 
@@ -5,8 +5,9 @@ from contextlib import asynccontextmanager
 from app.config import settings
 from app.api.routes import messages, dlp_admin, auth, violations, files, url_checks
 from app.websocket.manager import manager
-from app.database import init_db
+from app.database import init_db, AsyncSessionLocal
 from app.dlp.engine import dlp_engine
+from app.dlp.batch import MessageBatcher
 
 
 @asynccontextmanager
@@ -22,9 +23,40 @@ async def lifespan(app: FastAPI):
     # Инициализация начальных данных
     from app.database import AsyncSessionLocal
     from app.init_data import initialize_default_data
+    from app.services.policy_service import policy_service
+    from app.services.backfill_service import backfill_service
+    from app.services.scan_scheduler import scan_scheduler
 
     async with AsyncSessionLocal() as db:
         await initialize_default_data(db)
+        await policy_service.load(db)
+        await dlp_engine.url_verdicts.load(db)
+        # Проверки истории, прерванные остановкой сервера, продолжаются вручную
+        await backfill_service.recover(db)
+
+    # Следим за версией политики и вердиктами URL (изменения из других воркеров)
+    policy_service.start()
+    dlp_engine.url_verdicts.start(AsyncSessionLocal)
+    # Ожидающие URL и файлы проверяются VirusTotal в фоне
+    scan_scheduler.start(AsyncSessionLocal)
+    print(f"🔗 Индекс вердиктов URL загружен: {len(dlp_engine.url_verdicts)} проверенных URL")
+
+    # Реестр реальных идентификаторов клиентов (EDM)
+    if settings.DLP_EDM_INDEX_PATH:
+        try:
+            stats = dlp_engine.load_edm(settings.DLP_EDM_INDEX_PATH)
+            print(f"🗂️ Индекс EDM загружен: {stats['records']} записей")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Индекс EDM не загружен: {e}")
+
+    # Блоклист доменов из фидов угроз
+    if settings.DLP_BLOCKLIST_PATH:
+        try:
+            stats = dlp_engine.load_blocklist(settings.DLP_BLOCKLIST_PATH)
+            print(f"🚫 Блоклист доменов загружен: {stats['domains']} доменов, "
+                  f"{stats['memory_bytes'] // 1024} КБ")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Блоклист доменов не загружен: {e}")
 
     print(f"🛡️ DLP система активна. Запрещённые слова: {dlp_engine.text_analyzer.get_keywords()}")
     print("\n" + "=" * 60)
@@ -37,8 +69,17 @@ async def lifespan(app: FastAPI):
 
     # Shutdown
     print("\n👋 Остановка приложения...")
+    await policy_service.stop()
+    await dlp_engine.url_verdicts.stop()
+    await backfill_service.stop()
+    await scan_scheduler.stop()
+    await dlp_engine.shadow.stop()
+    dlp_engine.batch.shutdown()
 
 
+# При всплеске нагрузки одновременные проверки объединяются в пакеты
+dlp_batcher = MessageBatcher(dlp_engine, AsyncSessionLocal)
+
 app = FastAPI(
     title=settings.APP_NAME,
     debug=settings.DEBUG,
@@ -161,26 +202,37 @@ async def websocket_endpoint(websocket: WebSocket):
             # DLP проверка
             print(f"🛡️ Проверка DLP...")
 
-            from app.database import AsyncSessionLocal
-            async with AsyncSessionLocal() as db:
-                dlp_result = await dlp_engine.check_message(text, user, db_session=db)
+            dlp_result = await dlp_batcher.check(text, user)
 
             print(f"[DLP] allowed={dlp_result['allowed']}, status={dlp_result['status']}")
 
+            # В журналы нарушений и очередь модерации - без персональных данных
+            stored_text = dlp_result.get("sanitized_text", text)
+
             # Блокируем запрещённые слова
             if dlp_result["status"] == "block":
                 print(f"🚫 БЛОКИРУЕМ по ключевым словам")
 
                 if user_id:
                     from app.database import AsyncSessionLocal
+
+                    found_items = list(dlp_result.get("found_keywords", []))
+                    if dlp_result.get("fingerprint"):
+                        found_items.append(f"Документ: {dlp_result['fingerprint']['name']}")
+                    if dlp_result.get("secrets"):
+                        found_items.extend(
+                            f"{item['name']}: {item['value']}"
+                            for item in dlp_result["secrets"]["found_secrets"]
+                        )
+
                     async with AsyncSessionLocal() as db:
                         await manager.save_violation(
                             db=db,
                             user_id=user_id,
                             username=data.get("username", "unknown"),
                             display_name=user,
-                            message_text=text,
-                            found_keywords=dlp_result.get("found_keywords", [])
+                            message_text=stored_text,
+                            found_keywords=found_items
                         )
 
                 await websocket.send_json({
@@ -195,32 +247,24 @@ async def websocket_endpoint(websocket: WebSocket):
 
                 if user_id:
                     from app.database import AsyncSessionLocal
-                    from app.models.url_check import URLCheck
+                    from app.services.held_message_service import held_message_service
 
+                    url_result = dlp_result.get("urls", {})
                     async with AsyncSessionLocal() as db:
-                        urls = dlp_result.get("urls", {}).get("urls", [])
-
-                        for url in urls:
-                            # Проверяем, нет ли уже такого URL на проверке
-                            result = await db.execute(
-                                select(URLCheck).where(URLCheck.url == url)
-                            )
-                            existing = result.scalar_one_or_none()
-
-                            if not existing:
-                                # Создаём новую проверку
-                                url_check = URLCheck(
-                                    url=url,
-                                    user_id=user_id,
-                                    username=data.get("username", "unknown"),
-                                    display_name=user,
-                                    message_text=text,
-                                    status="pending"
-                                )
-                                db.add(url_check)
-
-                        await db.commit()
-                        print(f"   Сохранено {len(urls)} URL на модерацию")
+                        # Сообщение публикуется, когда будут проверены все его ссылки
+                        held = await held_message_service.hold(
+                            db,
+                            user_id=user_id,
+                            username=data.get("username", "unknown"),
+                            display_name=user,
+                            text=stored_text,
+                            urls=url_result.get("urls", []),
+                            manual_review=bool(url_result.get("timed_out"))
+                        )
+                        print(f"   Сообщение задержано ({held.status}), ссылок на проверке: {held.pending_urls}")
+
+                    from app.services.scan_scheduler import scan_scheduler
+                    scan_scheduler.notify()
 
                 await websocket.send_json({
                     "type": "error",
@@ -228,6 +272,41 @@ async def websocket_endpoint(websocket: WebSocket):
                 })
                 continue
 
+            # Сообщение задержано правилом политики до проверки администратором
+            if dlp_result["status"] == "moderation_required":
+                print(f"🕵️ ЗАДЕРЖИВАЕМ сообщение на модерацию (правило {dlp_result.get('rule')})")
+
+                if user_id:
+                    from app.database import AsyncSessionLocal
+
+                    found_items = list(dlp_result.get("found_keywords", []))
+                    if dlp_result.get("sensitive_data"):
+                        found_items.extend(
+                            f"{item['name']}: {item['value']}"
+                            for item in dlp_result["sensitive_data"]["found_data"]
+                        )
+                    if dlp_result.get("secrets"):
+                        found_items.extend(
+                            f"{item['name']}: {item['value']}"
+                            for item in dlp_result["secrets"]["found_secrets"]
+                        )
+
+                    async with AsyncSessionLocal() as db:
+                        await manager.save_violation(
+                            db=db,
+                            user_id=user_id,
+                            username=data.get("username", "unknown"),
+                            display_name=user,
+                            message_text=stored_text,
+                            found_keywords=found_items
+                        )
+
+                await websocket.send_json({
+                    "type": "error",
+                    "message": f"❌ {dlp_result['reason']}\nАдминистратор проверит сообщение."
+                })
+                continue
+
             # Обработка конфиденциальных данных
             if dlp_result.get("register_violation") and user_id:
                 print(f"⚠️ РЕГИСТРИРУЕМ нарушение (конфиденциальные данные)")
@@ -244,20 +323,25 @@ async def websocket_endpoint(websocket: WebSocket):
                         ]
                         found_items.extend(sensitive_items)
                         print(f"   Найдено: {found_items}")
+                    if dlp_result.get("secrets"):
+                        found_items.extend(
+                            f"{item['name']}: {item['value']}"
+                            for item in dlp_result["secrets"]["found_secrets"]
+                        )
 
                     await manager.save_violation(
                         db=db,
                         user_id=user_id,
                         username=data.get("username", "unknown"),
                         display_name=user,
-                        message_text=text,
+                        message_text=stored_text,
                         found_keywords=found_items
                     )
 
                     violation_result = await violation_service.register_violation(
                         db=db,
                         user_id=user_id,
-                        message_text=text,
+                        message_text=stored_text,
                         found_items=found_items
                     )
 
@@ -300,7 +384,7 @@ async def websocket_endpoint(websocket: WebSocket):
                             user_id=user_id,
                             username=data.get("username", "unknown"),
                             display_name=user,
-                            message_text=text,
+                            message_text=stored_text,
                             status="pending"
                         )
                         db.add(url_check)
@@ -315,6 +399,10 @@ async def websocket_endpoint(websocket: WebSocket):
                 })
 
 
+            # Правило redact: публикуем замаскированный текст
+            if dlp_result.get("redacted_text") is not None:
+                text = dlp_result["redacted_text"]
+
             # Сохраняем и отправляем сообщение
             print(f"✅ Сохраняем и отправляем сообщение")
 
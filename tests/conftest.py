@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Настройки приложения обязательны, для тестов хватает заглушек без .env
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+os.environ.setdefault("DATABASE_URL_SYNC", "sqlite://")
+os.environ.setdefault("SECRET_KEY", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,150 @@
+import asyncio
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+from app.database import Base
+from app.dlp.engine import dlp_engine
+from app.models import HeldMessage, Message, URLCheck
+from app.services.held_message_service import held_message_service
+
+
+def _run(scenario):
+    """Сценарий с отдельной БД в памяти: scenario(db)"""
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                return await scenario(db)
+        finally:
+            await engine.dispose()
+
+    return asyncio.run(run())
+
+
+def _check(url: str, status: str = "pending", is_reviewed: bool = False) -> URLCheck:
+    return URLCheck(url=url, user_id=1, username="u", display_name="U", message_text="old",
+                    status=status, is_reviewed=is_reviewed)
+
+
+async def _count(db, model, *where) -> int:
+    return (await db.execute(select(func.count()).select_from(model).where(*where))).scalar()
+
+
+async def _hold(db, text, urls, **kwargs) -> HeldMessage:
+    return await held_message_service.hold(db, 1, "u", "U", text, urls, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def empty_verdict_index(monkeypatch):
+    # Вердикты берутся только из url_checks тестовой БД
+    monkeypatch.setattr(dlp_engine.url_verdicts, "get", lambda url: None)
+
+
+def test_new_url_is_queued_once():
+    async def scenario(db):
+        first = await _hold(db, "a", ["https://new.example/"])
+        second = await _hold(db, "b", ["https://new.example/"])
+        return first, second, await _count(db, URLCheck, URLCheck.url == "https://new.example/")
+
+    first, second, checks = _run(scenario)
+    assert first.status == second.status == "held"
+    assert first.pending_urls == 1
+    assert checks == 1
+
+
+def test_reviewed_safe_check_publishes_immediately():
+    async def scenario(db):
+        db.add(_check("https://ok.example/", "safe", True))
+        await db.commit()
+        held = await _hold(db, "ok", ["https://ok.example/"])
+        return held, await _count(db, Message)
+
+    held, messages = _run(scenario)
+    assert held.status == "published"
+    assert held.message_id is not None
+    assert messages == 1
+
+
+def test_reviewed_malicious_check_rejects_immediately():
+    async def scenario(db):
+        db.add(_check("https://bad.example/", "malicious", True))
+        await db.commit()
+        return await _hold(db, "bad", ["https://ok.example/", "https://bad.example/"])
+
+    held = _run(scenario)
+    assert held.status == "rejected"
+
+
+def test_reviewed_suspicious_check_is_queued_again():
+    async def scenario(db):
+        db.add(_check("https://sus.example/", "suspicious", True))
+        await db.commit()
+        held = await _hold(db, "sus", ["https://sus.example/"])
+        pending = await _count(db, URLCheck, URLCheck.url == "https://sus.example/",
+                               URLCheck.status == "pending", URLCheck.is_reviewed == False)
+        return held, pending
+
+    held, pending = _run(scenario)
+    assert held.status == "held"
+    assert held.pending_urls == 1
+    assert pending == 1
+
+
+def test_resolve_publishes_after_last_verdict():
+    async def scenario(db):
+        held = await _hold(db, "two", ["https://a.example/", "https://b.example/"])
+        first = await held_message_service.resolve(db, {"https://a.example/": "safe"})
+        second = await held_message_service.resolve(db, {"https://b.example/": "safe"})
+        again = await held_message_service.resolve(db, {"https://b.example/": "safe"})
+        await db.refresh(held)
+        return held, first, second, again
+
+    held, first, second, again = _run(scenario)
+    assert first["published"] == []
+    assert [item["id"] for item in second["published"]] == [held.id]
+    assert again == {"published": [], "rejected": []}
+    assert held.status == "published"
+
+
+def test_resolve_rejects_on_malicious():
+    async def scenario(db):
+        held = await _hold(db, "two", ["https://a.example/", "https://b.example/"])
+        result = await held_message_service.resolve(db, {"https://b.example/": "malicious"})
+        await held_message_service.resolve(db, {"https://a.example/": "safe"})
+        await db.refresh(held)
+        return held, result
+
+    held, result = _run(scenario)
+    assert [item["id"] for item in result["rejected"]] == [held.id]
+    assert held.status == "rejected"
+
+
+def test_suspicious_verdict_keeps_waiting():
+    async def scenario(db):
+        held = await _hold(db, "one", ["https://a.example/"])
+        result = await held_message_service.resolve(db, {"https://a.example/": "suspicious"})
+        await db.refresh(held)
+        return held, result
+
+    held, result = _run(scenario)
+    assert result == {"published": [], "rejected": []}
+    assert held.status == "held"
+
+
+def test_manual_review_waits_for_admin():
+    async def scenario(db):
+        held = await _hold(db, "timeout", ["https://a.example/"], manual_review=True)
+        await held_message_service.resolve(db, {"https://a.example/": "safe"})
+        await db.refresh(held)
+        status_before = held.status
+        published = await held_message_service.publish(db, held.id)
+        repeated = await held_message_service.publish(db, held.id)
+        return status_before, published, repeated
+
+    status_before, published, repeated = _run(scenario)
+    assert status_before == "held"
+    assert published.status == "published"
+    assert repeated is None
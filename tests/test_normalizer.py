@@ -0,0 +1,45 @@
+from app.dlp.normalizer import fold, normalize
+
+
+def test_ascii_offsets_unchanged():
+    normalized = normalize("plain text")
+    assert normalized.text == "plain text"
+    assert normalized.span(0, 5) == (0, 5)
+
+
+def test_offset_map():
+    text = "ﬁle па​рoль"
+    normalized = normalize(text)
+    assert normalized.text == "file пароль"
+    # Лигатура дала два символа из одного, невидимый символ удалён
+    assert normalized.span(0, 2) == (0, 1)
+    assert normalized.span(5, 11) == (4, 11)
+    start, end = normalized.span(5, 11)
+    assert text[start:end] == "па​рoль"
+
+
+def test_empty_span():
+    normalized = normalize("ﬁ")
+    assert normalized.span(2, 2) == (1, 1)
+
+
+def test_compose_short_i():
+    assert normalize("йод").text == "йод"
+
+
+def test_fold_keeps_homoglyphs():
+    # Для ссылок похожие буквы не заменяются: это другой домен
+    assert normalize("cоrp").text == "corp"
+    assert fold("cоrp") == "cоrp"
+    assert fold("https://ｃorp.example/​x") == "https://corp.example/x"
+
+
+def test_mathematical_digits_folded():
+    text = "карта 𝟒𝟓𝟑𝟐"
+    normalized = normalize(text)
+    assert normalized.text == "карта 4532"
+    assert text[slice(*normalized.span(6, 10))] == "𝟒𝟓𝟑𝟐"
+
+
+def test_unmix_each_word_separately():
+    assert normalize("пaроль и pаsswоrd").text == "пароль и password"
@@ -0,0 +1,98 @@
+import pytest
+from app.dlp.policy import DEFAULT_RULES, compile_policy, validate_rule
+
+
+def _regex_rule(rule_id: str, pattern: str, **extra) -> dict:
+    return {"id": rule_id, "name": rule_id, "kind": "regex", "pattern": pattern,
+            "severity": "high", "action": "block", **extra}
+
+
+@pytest.fixture(scope="module")
+def default_plan():
+    return compile_policy(DEFAULT_RULES)
+
+
+def test_rule_id_is_not_a_group_name():
+    # id с дефисом - не имя группы регулярного выражения
+    plan = compile_policy([_regex_rule("my-rule", r"\bTOKEN-\d{4}\b")])
+    result = plan.execute("ключ TOKEN-1234")
+    assert result["action"] == "block"
+    assert result["rules"] == ["my-rule"]
+    assert result["spans"][0]["start"] == 5 and result["spans"][0]["end"] == 15
+
+
+def test_backreference_rejected():
+    with pytest.raises(ValueError, match="Недопустимое регулярное выражение"):
+        validate_rule(_regex_rule("repeat", r"(\w+)\s+\1"))
+
+
+def test_named_group_rejected():
+    with pytest.raises(ValueError, match="Недопустимое регулярное выражение"):
+        validate_rule(_regex_rule("named", r"(?P<token>\d{4})"))
+
+
+def test_invalid_regex_rejected():
+    with pytest.raises(ValueError):
+        compile_policy([_regex_rule("broken", r"(\d")])
+
+
+def test_unknown_detector_rejected():
+    rule = {"id": "near", "name": "near", "kind": "proximity", "detector": "missing",
+            "anchors": ["cvv"], "window": 3, "severity": "high", "action": "block"}
+    with pytest.raises(ValueError, match="неизвестный детектор"):
+        compile_policy([rule])
+
+
+def test_empty_policy_allows_everything():
+    result = compile_policy([]).execute("карта 4111 1111 1111 1111")
+    assert result["action"] == "allow"
+    assert result["spans"] == []
+
+
+def test_snils_before_phone(default_plan):
+    # 11 цифр с 8 в начале и верным контрольным числом - СНИЛС, а не телефон
+    result = default_plan.execute("данные 81234560069")
+    assert [span["type"] for span in result["spans"]] == ["snils"]
+    assert result["action"] == "redact"
+
+
+def test_phone_falls_back_from_snils(default_plan):
+    result = default_plan.execute("звони 89123456789")
+    assert [span["type"] for span in result["spans"]] == ["phone"]
+    assert result["action"] == "warn"
+
+
+def test_separated_formats(default_plan):
+    assert [s["type"] for s in default_plan.execute("тел +7 912 345-67-89")["spans"]] == ["phone"]
+    assert [s["type"] for s in default_plan.execute("снилс 112-233-445 95")["spans"]] == ["snils"]
+
+
+def test_card_with_cvv_blocked(default_plan):
+    result = default_plan.execute("карта 4111 1111 1111 1111 cvv 123")
+    assert result["action"] == "block"
+    assert "bank_card_cvv" in result["rules"]
+
+
+def _keyword_rule(rule_id: str, keywords: list) -> dict:
+    return {"id": rule_id, "name": rule_id, "kind": "keywords", "keywords": keywords,
+            "severity": "high", "action": "block"}
+
+
+def test_keywords_with_punctuation():
+    plan = compile_policy([_keyword_rule("tech", ["e-mail", "c++"])])
+    assert plan.execute("пришли e-mail")["keyword_result"]["found_keywords"] == ["e-mail"]
+    assert plan.execute("код на c++, срочно")["keyword_result"]["found_keywords"] == ["c++"]
+    assert plan.execute("код на c")["action"] == "allow"
+
+
+def test_long_phrase_forms_are_not_multiplied():
+    keyword = "конфиденциальная банковская информация секретного клиента кредитной организации"
+    plan = compile_policy([_keyword_rule("phrase", [keyword])])
+    assert plan.keywords.automaton.size < 1000
+    result = plan.execute("передаю конфиденциальной банковской информации секретного клиента кредитной организации")
+    assert result["keyword_result"]["found_keywords"] == [keyword]
+
+
+def test_keyword_without_words_rejected():
+    with pytest.raises(ValueError, match="буквы или цифры"):
+        validate_rule(_keyword_rule("punct", ["++"]))
@@ -0,0 +1,23 @@
+from app.dlp.analyzers.url_analyzer import URLAnalyzer, canonicalize_url
+from app.dlp.normalizer import fold
+from app.dlp.url_verdicts import URLVerdictIndex
+
+
+def test_canonicalize_url():
+    assert canonicalize_url("HTTP://Example.COM:80/?utm_source=x&a=1#frag") == "http://example.com/?a=1"
+    assert canonicalize_url("https://example.com") == "https://example.com/"
+    assert canonicalize_url("https://example.com:8443/a%7eb?fbclid=1") == "https://example.com:8443/a~b"
+    assert canonicalize_url("https://пример.рф/путь") == \
+        "https://xn--e1afmkfd.xn--p1ai/%D0%BF%D1%83%D1%82%D1%8C"
+
+
+def test_homograph_url_is_another_domain():
+    result = URLAnalyzer().analyze(fold("зайди на https://cоrp.example/login"))
+    assert result["urls"] == ["https://xn--crp-sed.example/login"]
+
+
+def test_homograph_not_covered_by_domain_rule():
+    index = URLVerdictIndex()
+    index.rules.add(1, "corp.example", "", "safe")
+    assert index.get("https://corp.example/login") == "safe"
+    assert index.get("https://xn--crp-sed.example/login") is None
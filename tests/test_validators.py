@@ -0,0 +1,31 @@
+from app.dlp.validators import digits_of, inn_valid, luhn_valid, max_confidence, snils_valid, validate_batch
+
+
+def test_luhn():
+    assert luhn_valid(digits_of("4111 1111 1111 1111"))
+    assert not luhn_valid(digits_of("4111 1111 1111 1112"))
+    assert not luhn_valid(digits_of("0000 0000"))  # Слишком короткий номер
+
+
+def test_inn():
+    assert inn_valid(digits_of("7707083893"))  # 10 цифр - юрлицо
+    assert inn_valid(digits_of("500100732259"))  # 12 цифр - физлицо
+    assert not inn_valid(digits_of("7707083894"))
+    assert not inn_valid(digits_of("500100732258"))
+    assert not inn_valid(digits_of("12345678901"))
+
+
+def test_snils():
+    assert snils_valid(digits_of("112-233-445 95"))
+    assert not snils_valid(digits_of("112-233-445 96"))
+    # Номера до 001-001-998 контрольным числом не проверяются
+    assert not snils_valid(digits_of("001-001-998 00"))
+
+
+def test_validate_batch():
+    assert validate_batch("luhn", ["4111111111111111", "4111111111111112"]) == [True, False]
+
+
+def test_max_confidence():
+    assert max_confidence(["low", "high", "medium"]) == "high"
+    assert max_confidence([]) == "low"
@@ -0,0 +1,32 @@
+import asyncio
+import time
+from app.services.virustotal_service import RequestQuota
+
+
+def test_quota_waits_for_window():
+    async def run():
+        quota = RequestQuota(2)
+        quota.WINDOW_SECONDS = 0.2
+        started = time.monotonic()
+        for _ in range(3):
+            await quota.acquire()
+        return quota, time.monotonic() - started
+
+    quota, elapsed = asyncio.run(run())
+    # Третий запрос ждёт, пока из окна не выйдет первый
+    assert elapsed >= 0.15
+    stats = quota.stats()
+    assert stats["requests"] == 3
+    assert stats["waits"] == 1
+    assert stats["used"] <= 2
+
+
+def test_quota_disabled():
+    async def run():
+        quota = RequestQuota(0)
+        for _ in range(100):
+            await quota.acquire()
+        return quota
+
+    quota = asyncio.run(run())
+    assert quota.stats()["waits"] == 0